@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CACHE_DIR, SCHEMA
+from groupby_engine import GroupIndex
+
+# Compute-once aggregate cache shared by every script. Aggregates are stored
+# as mergeable partials (sums, counts, first values with their row positions,
+# group sizes) keyed by the dataset fingerprint and the group keys, both in
+# process and on disk. A request that is a coarser version of a cached
+# aggregate is rolled up from it instead of rescanning the rows.
+
+AGGREGATE_DIR = os.path.join(CACHE_DIR, 'aggregates')
+
+# Columns whose values are fully determined by the dataset fingerprint; any
+# other column (e.g. one a script derived ad hoc) bypasses the cache
+CACHEABLE_COLUMNS = set(SCHEMA) | {'Date', 'Month', 'Year'}
+
+FUNC_PARTIALS = {
+    'sum': ('sum',),
+    'mean': ('sum', 'count'),
+    'count': ('count',),
+    'min': ('min',),
+    'max': ('max',),
+    'first': ('first', 'first_row'),
+    'nunique': ('nunique',),
+}
+
+# Cache misses on at least MIN_SHARD_ROWS rows are aggregated by SHARD_JOBS
+# hash-partitioned worker processes (see sharded.py) when SHARD_JOBS > 1
+SHARD_JOBS = int(os.environ.get('ANALYSIS_SHARDS', '1'))
+MIN_SHARD_ROWS = 500_000
+
+ROWS = ('__group__', 'rows')
+FIRST_ROW = ('__group__', 'first_row')
+
+_memory = {}
+
+
+def normalize_spec(spec):
+    items = []
+    for col, funcs in spec.items():
+        for func in ([funcs] if isinstance(funcs, str) else funcs):
+            if func not in FUNC_PARTIALS:
+                raise ValueError(f"Unsupported aggregation '{func}' for column '{col}'")
+            items.append((col, func))
+    return items
+
+
+def required_partials(spec_items):
+    partials = {ROWS, FIRST_ROW}
+    for col, func in spec_items:
+        partials.update((col, stat) for stat in FUNC_PARTIALS[func])
+    return partials
+
+
+def _entry_id(fingerprint, keys, partials):
+    raw = json.dumps([fingerprint, list(keys), sorted(map(list, partials))])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _column_name(partial):
+    return '|'.join(partial)
+
+
+def compute_partials(frame, keys, partials):
+    """Compute every partial in one fused pass over the rows, keyed by keys."""
+    index = GroupIndex(frame, keys)
+    out = {}
+    for col, stat in sorted(partials):
+        if (col, stat) == ROWS:
+            out[(col, stat)] = index.size()
+        elif (col, stat) == FIRST_ROW:
+            out[(col, stat)] = index.first_row()
+        elif stat == 'first_row':
+            out[(col, stat)] = index.first_row(frame[col])
+        else:
+            out[(col, stat)] = index.reduce(stat, frame[col])
+    result = index.key_frame.copy()
+    for partial, values in out.items():
+        result[_column_name(partial)] = values
+    return result
+
+
+def remap_first_rows(partial_frame, rows):
+    """Map first-row positions computed on a subset of rows back to dataset positions."""
+    for name in partial_frame.columns:
+        if name.endswith('|first_row'):
+            local = partial_frame[name].to_numpy()
+            present = ~np.isnan(local)
+            mapped = np.full(len(local), np.nan)
+            mapped[present] = np.asarray(rows)[local[present].astype(np.int64)]
+            partial_frame[name] = mapped
+    return partial_frame
+
+
+def _compute(frame, keys, partials, fingerprint=None):
+    if SHARD_JOBS > 1 and len(frame) >= MIN_SHARD_ROWS:
+        from sharded import sharded_partials
+        return sharded_partials(frame, keys, partials, SHARD_JOBS, fingerprint)
+    return compute_partials(frame, keys, partials)
+
+
+def _rollup(entry, keys, partials):
+    """Derive partials at a coarser grain from a cached finer aggregate."""
+    return rollup_partials(entry['frame'], entry['keys'], keys, partials)
+
+
+def rollup_partials(cached, fine_keys, keys, partials):
+    """Partials for keys (a subset of fine_keys) from partials computed at the fine_keys grain."""
+    out = {}
+    for col, stat in partials:
+        name = _column_name((col, stat))
+        if col in fine_keys:
+            values = cached[col]
+            weights = cached[_column_name(ROWS)]
+            if stat == 'sum':
+                out[name] = values.astype('float64') * weights if values.dtype.kind == 'f' else values.astype('int64') * weights
+            elif stat == 'count':
+                out[name] = weights
+            elif stat == 'first_row':
+                out[name] = cached[_column_name(FIRST_ROW)]
+            else:
+                out[name] = values
+        else:
+            out[name] = cached[name]
+    work = pd.DataFrame(out)
+    for k in keys:
+        work[k] = cached[k]
+
+    grouped = work.groupby(list(keys), observed=True, sort=True)
+    result = {}
+    for col, stat in partials:
+        name = _column_name((col, stat))
+        if stat in ('sum', 'count', 'rows'):
+            result[name] = grouped[name].sum()
+        elif stat in ('min', 'first_row'):
+            result[name] = grouped[name].min()
+        elif stat == 'max':
+            result[name] = grouped[name].max()
+        elif stat == 'nunique':
+            result[name] = grouped[name].nunique()
+        elif stat == 'first':
+            # The coarse group's first value is the one from the finer group
+            # whose first (non-null) row comes earliest
+            order_col = _column_name((col, 'first_row')) if col not in fine_keys else _column_name(FIRST_ROW)
+            ordered = work.assign(_order=cached[order_col]).sort_values('_order', kind='stable')
+            result[name] = ordered.groupby(list(keys), observed=True, sort=True)[name].first()
+    return pd.DataFrame(result).reset_index()
+
+
+def merge_partials(frames, keys):
+    """Combine partial frames computed over disjoint sets of rows for the same keys.
+
+    Row positions in ``first_row`` columns must already be global (offset by
+    the rows that precede each part) so the earliest first value wins.
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    combined = pd.concat(frames, ignore_index=True)
+    if not len(combined):
+        return combined
+    grouped = combined.groupby(keys, observed=True, sort=True)
+    result = {}
+    for name in combined.columns:
+        if name in keys:
+            continue
+        col, stat = name.rsplit('|', 1)
+        if stat in ('sum', 'count', 'rows'):
+            result[name] = grouped[name].sum()
+        elif stat in ('min', 'first_row'):
+            result[name] = grouped[name].min()
+        elif stat == 'max':
+            result[name] = grouped[name].max()
+        elif stat == 'first':
+            order_col = _column_name((col, 'first_row'))
+            ordered = combined.sort_values(order_col, kind='stable')
+            result[name] = ordered.groupby(keys, observed=True, sort=True)[name].first()
+        else:
+            raise ValueError(f"Partial '{name}' cannot be merged across row sets")
+    return pd.DataFrame(result).reset_index()
+
+
+def _can_derive(entry, keys, partials):
+    fine_keys = entry['keys']
+    if not entry['complete'] or not set(keys) < set(fine_keys):
+        return False
+    available = set(entry['partials'])
+    for col, stat in partials:
+        if col in fine_keys:
+            continue
+        if stat == 'nunique' or (col, stat) not in available:
+            return False
+    return True
+
+
+def _disk_entries(fingerprint):
+    if not os.path.isdir(AGGREGATE_DIR):
+        return []
+    metas = []
+    for name in os.listdir(AGGREGATE_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(AGGREGATE_DIR, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if meta['fingerprint'] == fingerprint:
+            meta['keys'] = tuple(meta['keys'])
+            meta['partials'] = [tuple(p) for p in meta['partials']]
+            metas.append(meta)
+    return metas
+
+
+def _load(meta):
+    if meta['id'] not in _memory:
+        try:
+            frame = pd.read_pickle(os.path.join(AGGREGATE_DIR, meta['id'] + '.pkl'))
+        except (OSError, ValueError):
+            return None
+        _memory[meta['id']] = dict(meta, frame=frame)
+    return _memory[meta['id']]
+
+
+def _store(fingerprint, keys, partials, frame, complete, replaces=None):
+    entry_id = _entry_id(fingerprint, keys, partials)
+    meta = {'id': entry_id, 'fingerprint': fingerprint, 'keys': tuple(keys),
+            'partials': sorted(partials), 'groups': len(frame), 'complete': complete}
+    _memory[entry_id] = dict(meta, frame=frame)
+    os.makedirs(AGGREGATE_DIR, exist_ok=True)
+    path = os.path.join(AGGREGATE_DIR, entry_id)
+    frame.to_pickle(path + '.pkl.tmp')
+    os.replace(path + '.pkl.tmp', path + '.pkl')
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.json.tmp', path + '.json')
+    if replaces and replaces != entry_id:
+        _memory.pop(replaces, None)
+        for ext in ('.json', '.pkl'):
+            try:
+                os.remove(os.path.join(AGGREGATE_DIR, replaces + ext))
+            except OSError:
+                pass
+    return _memory[entry_id]
+
+
+def _lookup(table, keys, partials):
+    fingerprint = table.fingerprint
+    candidates = {e['id']: e for e in _memory.values() if e['fingerprint'] == fingerprint}
+    for meta in _disk_entries(fingerprint):
+        candidates.setdefault(meta['id'], meta)
+
+    same_keys = [m for m in candidates.values() if m['keys'] == keys]
+    for meta in same_keys:
+        if partials <= set(meta['partials']):
+            entry = _load(meta)
+            if entry is not None:
+                return entry
+
+    finer = [m for m in candidates.values() if _can_derive(m, keys, partials)]
+    for meta in sorted(finer, key=lambda m: m['groups']):
+        entry = _load(meta)
+        if entry is not None:
+            frame = _rollup(entry, keys, partials)
+            return _store(fingerprint, keys, partials, frame, complete=True)
+
+    # Scan the rows, but only for the partials no cached entry already holds
+    frame = table.frame
+    complete = bool(frame[list(keys)].notna().all().all())
+    for meta in same_keys:
+        entry = _load(meta)
+        if entry is None:
+            continue
+        missing = partials - set(entry['partials'])
+        extra = _compute(frame, keys, missing, fingerprint)
+        merged = entry['frame'].join(extra.drop(columns=list(keys)))
+        return _store(fingerprint, keys, partials | set(entry['partials']), merged, complete, replaces=entry['id'])
+    return _store(fingerprint, keys, partials, _compute(frame, keys, partials, fingerprint), complete)
+
+
+def materialize(table, keys, partials):
+    """Partial frame for keys through the cache, e.g. to seed a fine grain that later queries roll up from."""
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    columns = set(keys) | {col for col, _ in partials if col != ROWS[0]}
+    if table.fingerprint is None or not columns <= CACHEABLE_COLUMNS:
+        return _compute(table.frame, keys, set(partials), table.fingerprint)
+    return _lookup(table, keys, set(partials))['frame']
+
+
+def finalize(partial_frame, keys, spec_items, multi):
+    out = {k: partial_frame[k] for k in keys}
+    for col, func in spec_items:
+        name = (col, func) if multi else col
+        if func == 'mean':
+            out[name] = partial_frame[_column_name((col, 'sum'))] / partial_frame[_column_name((col, 'count'))]
+        else:
+            out[name] = partial_frame[_column_name((col, func))]
+    result = pd.DataFrame(out)
+    if multi:
+        result.columns = pd.MultiIndex.from_tuples([(k, '') for k in keys] + [(c, f) for c, f in spec_items])
+    return result
+
+
+def aggregate(table, keys, spec):
+    """Cached equivalent of ``table.frame.groupby(keys).agg(spec).reset_index()``."""
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    spec_items = normalize_spec(spec)
+    multi = any(not isinstance(funcs, str) for funcs in spec.values())
+    partials = required_partials(spec_items)
+
+    columns = set(keys) | {col for col, _ in spec_items}
+    if table.fingerprint is None or not columns <= CACHEABLE_COLUMNS:
+        partial_frame = _compute(table.frame, keys, partials, table.fingerprint)
+    else:
+        partial_frame = _lookup(table, keys, partials)['frame']
+    return finalize(partial_frame, keys, spec_items, multi)
+
+
+def clear_cache(disk=False):
+    _memory.clear()
+    if disk and os.path.isdir(AGGREGATE_DIR):
+        for name in os.listdir(AGGREGATE_DIR):
+            os.remove(os.path.join(AGGREGATE_DIR, name))
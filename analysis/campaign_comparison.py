@@ -2,76 +2,116 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy import stats
 import os
+from typed_table import load_table
+from metrics import compute_metrics
+from sketches import approximate, quantile_sketch
+from resampling import compare_groups, resample_count, resampling_tests
+from segmentation import assign_segments, load_or_fit
+from figures import FigureSet
+from plot_summaries import box_summary, plot_boxes
 
 # Create reports directory if it doesn't exist
 if not os.path.exists('reports/figures'):
     os.makedirs('reports/figures')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
 
 # Calculate campaign performance metrics
-campaign_metrics = df.groupby('Campaign_ID').agg({
+campaign_metrics = compute_metrics(table, 'Campaign_ID', {
     'Revenue_Generated': 'sum',
     'Budget': 'mean',
     'Clicks': 'sum',
     'Conversions': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Common_Keywords': 'first'
-}).reset_index()
+}, ['ROI', 'CPA'])
 
-campaign_metrics['ROI'] = (campaign_metrics['Revenue_Generated'] - campaign_metrics['Budget']) / campaign_metrics['Budget'] * 100
-campaign_metrics['CPA'] = campaign_metrics['Budget'] / campaign_metrics['Conversions']
-
-campaign_metrics['Performance'] = pd.qcut(campaign_metrics['ROI'], q=2, labels=['Low', 'High'])
+if approximate():
+    # Median split on the KLL sketch's median; qcut's bins are (min, median] and (median, max]
+    median_roi = quantile_sketch(campaign_metrics['ROI']).quantiles([0.5])[0]
+    campaign_metrics['Performance'] = pd.Categorical(np.where(campaign_metrics['ROI'] <= median_roi, 'Low', 'High'),
+                                                     categories=['Low', 'High'], ordered=True)
+else:
+    campaign_metrics['Performance'] = pd.qcut(campaign_metrics['ROI'], q=2, labels=['Low', 'High'])
 
 # Create side-by-side comparison plots
-plt.figure(figsize=(15, 10))
-
-# ROI Comparison
-plt.subplot(2, 2, 1)
-sns.boxplot(data=campaign_metrics, x='Performance', y='ROI', palette='viridis')
-plt.title('ROI Distribution by Campaign Performance')
-plt.ylabel('ROI (%)')
-
-# CPA Comparison
-plt.subplot(2, 2, 2)
-sns.boxplot(data=campaign_metrics, x='Performance', y='CPA', palette='viridis')
-plt.title('CPA Distribution by Campaign Performance')
-plt.ylabel('CPA ($)')
-
-# Clicks vs Conversions
-plt.subplot(2, 2, 3)
-sns.scatterplot(data=campaign_metrics, x='Clicks', y='Conversions',
-               hue='Performance', palette='viridis', alpha=0.7)
-plt.title('Clicks vs Conversions by Campaign Performance')
-plt.xlabel('Clicks')
-plt.ylabel('Conversions')
-
-# Campaign Channel Distribution
-plt.subplot(2, 2, 4)
-channel_counts = campaign_metrics.groupby(['Performance', 'Common_Keywords']).size().unstack().fillna(0)
-channel_counts.plot(kind='bar', stacked=True)
-plt.title('Campaign Channel Distribution by Performance')
-plt.ylabel('Number of Campaigns')
-
-plt.tight_layout()
-plt.savefig('reports/figures/campaign_comparison.png', dpi=300)
-plt.close()
+def plot_campaign_comparison(data):
+    campaigns = data['campaigns']
+
+    # ROI Comparison (boxes drawn from precomputed quartiles and whiskers)
+    plt.subplot(2, 2, 1)
+    plot_boxes(data['boxes'], 'ROI', palette='viridis')
+    plt.title('ROI Distribution by Campaign Performance')
+    plt.ylabel('ROI (%)')
+
+    # CPA Comparison
+    plt.subplot(2, 2, 2)
+    plot_boxes(data['boxes'], 'CPA', palette='viridis')
+    plt.title('CPA Distribution by Campaign Performance')
+    plt.ylabel('CPA ($)')
+
+    # Clicks vs Conversions
+    plt.subplot(2, 2, 3)
+    sns.scatterplot(data=campaigns, x='Clicks', y='Conversions',
+                   hue='Performance', palette='viridis', alpha=0.7)
+    plt.title('Clicks vs Conversions by Campaign Performance')
+    plt.xlabel('Clicks')
+    plt.ylabel('Conversions')
+
+    # Campaign Channel Distribution
+    plt.subplot(2, 2, 4)
+    channel_counts = campaigns.groupby(['Performance', 'Common_Keywords'], observed=True).size().unstack().fillna(0)
+    channel_counts.plot(kind='bar', stacked=True, ax=plt.gca())
+    plt.title('Campaign Channel Distribution by Performance')
+    plt.ylabel('Number of Campaigns')
+
+    plt.tight_layout()
+
+
+figures = FigureSet()
+figures.add('reports/figures/campaign_comparison.png', plot_campaign_comparison, {
+    'campaigns': campaign_metrics[['Clicks', 'Conversions', 'Performance', 'Common_Keywords']],
+    'boxes': box_summary(campaign_metrics, 'Performance', ['ROI', 'CPA']),
+}, figsize=(15, 10))
+figures.render()
 
 # Statistical Analysis
 high_performance = campaign_metrics[campaign_metrics['Performance'] == 'High']
 low_performance = campaign_metrics[campaign_metrics['Performance'] == 'Low']
 
-# Calculate statistical significance
-roi_ttest = stats.ttest_ind(high_performance['ROI'], low_performance['ROI'])
-cpa_ttest = stats.ttest_ind(high_performance['CPA'], low_performance['CPA'])
+# Calculate statistical significance: permutation p-values of the difference
+# in mean campaign ROI and CPA between the two halves
+split_tests = resampling_tests(campaign_metrics, 'Performance', {'ROI': 'mean', 'CPA': 'mean'})
+split_pvalues = split_tests[split_tests['Group'] == 'High'].set_index('Statistic')['P_Value']
 
 print("\nCampaign Performance Analysis:")
 print(f"High Performance Campaigns: {len(high_performance)}")
 print(f"Low Performance Campaigns: {len(low_performance)}")
-print(f"\nStatistical Significance:")
-print(f"ROI Difference p-value: {roi_ttest.pvalue:.4f}")
-print(f"CPA Difference p-value: {cpa_ttest.pvalue:.4f}")
+print(f"\nStatistical Significance ({resample_count()} permutations):")
+print(f"ROI Difference p-value: {split_pvalues['ROI']:.4f}")
+print(f"CPA Difference p-value: {split_pvalues['CPA']:.4f}")
+
+# Channel, tier and segment comparisons over the transactions: bootstrap
+# intervals and permutation p-values of ROI, CPA and conversion rate (CTR),
+# Holm-adjusted over every test
+customer_metrics = compute_metrics(table, 'Customer_ID', {
+    'Revenue_Generated': 'sum',
+    'Units_Sold': 'sum',
+    'Customer_Satisfaction_Post_Refund': 'mean',
+    'Subscription_Tier': 'first',
+    'Subscription_Length': 'mean'
+}, ['CLTV'])
+segments = assign_segments(customer_metrics, load_or_fit(customer_metrics, k=4, fingerprint=table.fingerprint))
+transactions = df[['Common_Keywords', 'Subscription_Tier', 'Revenue_Generated', 'Budget', 'Clicks', 'Conversions']].copy()
+transactions['Segment_Label'] = df['Customer_ID'].map(segments.set_index('Customer_ID')['Segment_Label'])
+group_tests = compare_groups(transactions, ['Common_Keywords', 'Subscription_Tier', 'Segment_Label'],
+                             metrics=['ROI', 'CPA', 'CTR'])
+
+print(f"\nGroup Comparisons (each group vs the rest, Holm-adjusted, {resample_count()} resamples):")
+for _, test in group_tests.iterrows():
+    flag = ' *' if test['Significant'] else ''
+    print(f"{test['Dimension']}={test['Group']} {test['Statistic']}: {test['Estimate']:.2f} "
+          f"[{test['CI_Low']:.2f}, {test['CI_High']:.2f}], p={test['P_Value']:.4f}, adjusted p={test['P_Adjusted']:.4f}{flag}")
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CACHE_DIR, dataset_fingerprint, load_dataset
+from typed_table import TypedTable
+
+# Memory-mapped column store. The typed table is written once per dataset
+# version as one .npy file per column (categoricals as their codes) plus a
+# manifest of names, dtypes, categories and ID dictionaries. Worker processes
+# attach to the files read-only, so every process shares the same page-cache
+# copy of the data instead of parsing or unpickling its own.
+
+STORE_DIR = os.path.join(CACHE_DIR, 'columns')
+MANIFEST = 'manifest.json'
+
+
+def store_path(fingerprint, directory=STORE_DIR):
+    return os.path.join(directory, fingerprint[:16])
+
+
+def materialize(table=None, directory=STORE_DIR):
+    """Write the typed table to the column store unless it is already there; returns the store path."""
+    fingerprint = table.fingerprint if table is not None else dataset_fingerprint()
+    path = store_path(fingerprint, directory)
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        return path
+    if table is None:
+        table = TypedTable.from_frame(load_dataset(), fingerprint)
+
+    tmp = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    columns = []
+    for name in table.frame.columns:
+        values = table.frame[name]
+        entry = {'name': name}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            array = values.cat.codes.to_numpy()
+            entry['categories'] = values.cat.categories.tolist()
+        else:
+            array = values.to_numpy()
+            if array.dtype == object:
+                raise TypeError(f"Column '{name}' has no fixed-width dtype to map")
+        entry['dtype'] = array.dtype.str
+        np.save(os.path.join(tmp, name + '.npy'), array)
+        columns.append(entry)
+
+    manifest = {
+        'fingerprint': fingerprint,
+        'rows': len(table.frame),
+        'columns': columns,
+        'dictionaries': {col: index.tolist() for col, index in table.dictionaries.items()},
+    }
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for name in os.listdir(directory):
+        stale = os.path.join(directory, name)
+        if stale != path and not name.startswith(os.path.basename(path)):
+            shutil.rmtree(stale, ignore_errors=True)
+    return path
+
+
+def read_manifest(path):
+    """The manifest of a materialized store, or None if there is none."""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def attach(path):
+    """Open a materialized store as a TypedTable whose columns map the files read-only."""
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f'No column store at {path}')
+    data = {}
+    for entry in manifest['columns']:
+        # Plain ndarray view of the mapping, so pandas never sees the memmap subclass
+        array = np.asarray(np.load(os.path.join(path, entry['name'] + '.npy'), mmap_mode='r'))
+        if 'categories' in entry:
+            data[entry['name']] = pd.Categorical.from_codes(array, categories=pd.Index(entry['categories']),
+                                                           validate=False)
+        else:
+            data[entry['name']] = array
+    frame = pd.DataFrame(data, copy=False)
+    dictionaries = {col: pd.Index(labels, name=col) for col, labels in manifest['dictionaries'].items()}
+    return TypedTable(frame, dictionaries, manifest['fingerprint'])
@@ -7,6 +7,8 @@ import os
 # Create directories if they don't exist
 base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 presentation_dir = os.path.join(base_dir, 'reports', 'presentations')
+# stakeholder_visuals.py writes its charts under analysis/reports
+figures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'figures', 'presentation')
 if not os.path.exists(presentation_dir):
     os.makedirs(presentation_dir)
 
@@ -49,7 +51,7 @@ def create_presentation():
     height = Inches(4.5)
     
     try:
-        img_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reports', 'figures', 'presentation', 'trend_plots.png')
+        img_path = os.path.join(figures_dir, 'trend_plots.png')
         slide.shapes.add_picture(img_path, left, top, width, height)
     except:
         txt = slide.shapes.add_textbox(left, top, width, height)
@@ -72,7 +74,7 @@ def create_presentation():
     height = Inches(4.5)
     
     try:
-        img_path = '../reports/figures/presentation/customer_map.png'
+        img_path = os.path.join(figures_dir, 'customer_map.png')
         slide.shapes.add_picture(img_path, left, top, width, height)
     except:
         txt = slide.shapes.add_textbox(left, top, width, height)
@@ -95,7 +97,7 @@ def create_presentation():
     height = Inches(4.5)
     
     try:
-        img_path = '../reports/figures/presentation/segmentation_charts.png'
+        img_path = os.path.join(figures_dir, 'segmentation_charts.png')
         slide.shapes.add_picture(img_path, left, top, width, height)
     except:
         txt = slide.shapes.add_textbox(left, top, width, height)
@@ -118,7 +120,7 @@ def create_presentation():
     height = Inches(4.5)
     
     try:
-        img_path = '../reports/figures/presentation/kpi_bars.png'
+        img_path = os.path.join(figures_dir, 'kpi_bars.png')
         slide.shapes.add_picture(img_path, left, top, width, height)
     except:
         txt = slide.shapes.add_textbox(left, top, width, height)
@@ -0,0 +1,83 @@
+import pandas as pd
+
+from aggregate_cache import FIRST_ROW, ROWS, finalize, materialize, normalize_spec, required_partials, rollup_partials
+from metrics import evaluate, metric_spec
+from typed_table import SyntheticDates, TypedTable
+
+# Precomputed cube of the additive measures behind the Power BI pages. Sums
+# and counts of every measure are materialized once at the finest grain of
+# the dashboard dimensions; any rollup or slice over those dimensions is then
+# answered from the cube's cells instead of the transaction rows. The cube is
+# stored through the aggregate cache, so plain aggregate() calls over a subset
+# of its dimensions roll up from it as well.
+
+DIMENSIONS = ['Campaign_ID', 'Common_Keywords', 'Bundle_ID', 'Discount_Level', 'Subscription_Tier', 'Year', 'Month']
+MEASURES = ['Revenue_Generated', 'Budget', 'Clicks', 'Conversions', 'Units_Sold',
+            'Customer_Satisfaction_Post_Refund', 'Bundle_Price', 'Subscription_Length']
+CUBE_FUNCS = ('sum', 'mean', 'count')
+
+
+class Cube:
+    def __init__(self, cells, dictionaries):
+        self.cells = cells
+        self.dictionaries = dictionaries
+
+    @classmethod
+    def build(cls, table):
+        """Load the cube for the table's dataset version, computing it on first use."""
+        # Year is determined by Month, so it adds no cells; the synthetic dates
+        # are the same ones add_synthetic_dates() assigns
+        frame = SyntheticDates(len(table.frame)).add_to(table.frame.copy(deep=False))
+        dated = TypedTable(frame, table.dictionaries, table.fingerprint)
+        partials = {ROWS, FIRST_ROW}
+        partials.update((col, stat) for col in MEASURES for stat in ('sum', 'count'))
+        return cls(materialize(dated, DIMENSIONS, partials), table.dictionaries)
+
+    def slice(self, **filters):
+        """Cube restricted to cells matching every filter.
+
+        A filter is a list of values, or a (low, high) tuple for an inclusive
+        range; ID dimensions take labels and Month takes 'YYYY-MM' strings.
+        """
+        mask = pd.Series(True, index=self.cells.index)
+        for dim, condition in filters.items():
+            if dim not in DIMENSIONS:
+                raise KeyError(f"'{dim}' is not a cube dimension")
+            values = self.cells[dim]
+            if isinstance(condition, tuple):
+                low, high = (self._coerce(dim, [bound])[0] if bound is not None else None for bound in condition)
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+            else:
+                condition = [condition] if isinstance(condition, (str, int)) else list(condition)
+                mask &= values.isin(self._coerce(dim, condition))
+        return Cube(self.cells[mask].reset_index(drop=True), self.dictionaries)
+
+    def _coerce(self, dim, values):
+        if dim in self.dictionaries:
+            return list(self.dictionaries[dim].get_indexer(values))
+        if dim == 'Month':
+            return [pd.Period(v, freq='M') for v in values]
+        return values
+
+    def aggregate(self, keys, spec):
+        """Equivalent of aggregate(table, keys, spec) for the cube's dimensions and measures."""
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        unknown = [k for k in keys if k not in DIMENSIONS]
+        if unknown:
+            raise KeyError(f"Not cube dimensions: {unknown}")
+        spec_items = normalize_spec(spec)
+        for col, func in spec_items:
+            if func not in CUBE_FUNCS or (col not in MEASURES and col not in DIMENSIONS):
+                raise ValueError(f"The cube cannot answer '{func}' of '{col}'")
+        partials = required_partials(spec_items)
+        multi = any(not isinstance(funcs, str) for funcs in spec.values())
+        frame = rollup_partials(self.cells, DIMENSIONS, keys, partials)
+        return finalize(frame, keys, spec_items, multi)
+
+    def compute_metrics(self, keys, spec, metrics):
+        """Cube counterpart of metrics.compute_metrics()."""
+        full_spec, helper_columns = metric_spec(spec, metrics)
+        return evaluate(self.aggregate(keys, full_spec), metrics).drop(columns=helper_columns)
@@ -2,41 +2,58 @@ import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler, LabelEncoder
-from sklearn.metrics import silhouette_score
 import os
+from typed_table import load_table
+from metrics import compute_metrics
+from groupby_engine import fused_agg
+from segmentation import load_or_fit, sweep_k
+from sketches import approx_distinct, approximate, quantile_sketch
+from figures import FigureSet
+from plot_summaries import histogram_summary, plot_histogram, sketch_histogram_summary
 
 # Create reports directory if it doesn't exist
 if not os.path.exists('reports/figures'):
     os.makedirs('reports/figures')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Charts are rendered together at the end; unchanged ones are not redrawn
+figures = FigureSet()
 
 # Customer Lifetime Value Analysis
 print("\nCustomer Lifetime Value Analysis:")
-customer_metrics = df.groupby('Customer_ID').agg({
+customer_spec = {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Subscription_Tier': 'first',
     'Subscription_Length': 'mean',
     'Common_Keywords': 'nunique'
-}).reset_index()
-
-# Calculate Customer Lifetime Value
-customer_metrics['CLTV'] = customer_metrics['Revenue_Generated'] * (1 + customer_metrics['Subscription_Length'])
-
-# Plot CLTV distribution
-plt.figure(figsize=(12, 6))
-sns.histplot(data=customer_metrics, x='CLTV', bins=50, kde=True)
-plt.title('Customer Lifetime Value Distribution')
-plt.xlabel('Customer Lifetime Value ($)')
-plt.ylabel('Number of Customers')
-plt.tight_layout()
-plt.savefig('reports/figures/cltv_distribution.png', dpi=300)
-plt.close()
+}
+if approximate():
+    # Distinct channels per customer from per-chunk HyperLogLog sketches
+    del customer_spec['Common_Keywords']
+customer_metrics = compute_metrics(table, 'Customer_ID', customer_spec, ['CLTV'])
+if approximate():
+    distinct_channels = approx_distinct(df, 'Customer_ID', 'Common_Keywords')
+    customer_metrics['Common_Keywords'] = distinct_channels.reindex(customer_metrics['Customer_ID']).to_numpy()
+
+# Plot CLTV distribution from a fixed-bin histogram (KDE by FFT over its fine bins)
+def plot_cltv_distribution(data):
+    plot_histogram(data, bins=50, kde=True)
+    plt.title('Customer Lifetime Value Distribution')
+    plt.xlabel('Customer Lifetime Value ($)')
+    plt.ylabel('Number of Customers')
+    plt.tight_layout()
+
+
+if approximate():
+    cltv_histogram = sketch_histogram_summary(quantile_sketch(customer_metrics['CLTV']), 50)
+else:
+    cltv_histogram = histogram_summary(customer_metrics['CLTV'], 50)
+figures.add('reports/figures/cltv_distribution.png', plot_cltv_distribution, cltv_histogram)
 
 # Customer Segmentation using K-Means
 print("\nCustomer Segmentation Analysis:")
@@ -51,25 +68,28 @@ segmentation_data['Common_Keywords'] = le.fit_transform(segmentation_data['Commo
 scaler = StandardScaler()
 scaled_data = scaler.fit_transform(segmentation_data)
 
-# Determine optimal number of clusters using silhouette score
-silhouette_scores = []
-for k in range(2, 11):
-    kmeans = KMeans(n_clusters=k, random_state=42)
-    labels = kmeans.fit_predict(scaled_data)
-    silhouette_scores.append(silhouette_score(scaled_data, labels))
-
-plt.figure(figsize=(10, 6))
-plt.plot(range(2, 11), silhouette_scores, marker='o')
-plt.title('Silhouette Score Analysis')
-plt.xlabel('Number of Clusters')
-plt.ylabel('Silhouette Score')
-plt.savefig('reports/figures/silhouette_score.png', dpi=300)
-plt.close()
+# Determine optimal number of clusters using silhouette score; candidate k
+# values are fitted in parallel and large inputs use a sampled silhouette
+sweep = sweep_k(scaled_data, range(2, 11))
+
+def plot_silhouette(data):
+    plt.plot(data['k'], data['silhouette'], marker='o')
+    plt.fill_between(data['k'], data['silhouette_low'], data['silhouette_high'], alpha=0.2)
+    plt.title('Silhouette Score Analysis')
+    plt.xlabel('Number of Clusters')
+    plt.ylabel('Silhouette Score')
+
+
+# Fit times vary run to run and are not part of the chart
+figures.add('reports/figures/silhouette_score.png', plot_silhouette,
+            sweep[['k', 'silhouette', 'silhouette_low', 'silhouette_high']], figsize=(10, 6))
 
 # Apply KMeans with optimal number of clusters
-optimal_clusters = silhouette_scores.index(max(silhouette_scores)) + 2
-kmeans = KMeans(n_clusters=optimal_clusters, random_state=42)
-customer_metrics['Segment'] = kmeans.fit_predict(scaled_data)
+optimal_clusters = int(sweep.loc[sweep['silhouette'].idxmax(), 'k'])
+# Reuses the stored model for these features and k unless the data has drifted
+model = load_or_fit(segmentation_data, name='analysis', k=optimal_clusters,
+                    features=list(segmentation_data.columns), fingerprint=table.fingerprint)
+customer_metrics['Segment'] = model.predict(segmentation_data)
 
 # Segment Analysis
 print("\nSegment Analysis:")
@@ -87,26 +107,28 @@ print(segment_analysis)
 # Campaign Response by Segment
 df_with_segments = pd.merge(df, customer_metrics[['Customer_ID', 'Segment']], on='Customer_ID')
 
-campaign_response = df_with_segments.groupby(['Segment', 'Common_Keywords']).agg({
+campaign_response = fused_agg(df_with_segments, ['Segment', 'Common_Keywords'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+})
 
 # Plot campaign response by segment
-plt.figure(figsize=(15, 8))
-sns.barplot(data=campaign_response, x='Common_Keywords', y='Revenue_Generated', 
-             hue='Segment', palette='viridis', ci=None)
-plt.title('Campaign Response by Customer Segment')
-plt.xlabel('Campaign Channel')
-plt.ylabel('Total Revenue ($)')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('reports/figures/campaign_response.png', dpi=300)
-plt.close()
+def plot_campaign_response(data):
+    sns.barplot(data=data, x='Common_Keywords', y='Revenue_Generated',
+                hue='Segment', palette='viridis', ci=None)
+    plt.title('Campaign Response by Customer Segment')
+    plt.xlabel('Campaign Channel')
+    plt.ylabel('Total Revenue ($)')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+
+
+figures.add('reports/figures/campaign_response.png', plot_campaign_response, campaign_response, figsize=(15, 8))
+figures.render()
 
 # Key Insights
 print("\nKey Insights:")
 print(f"High Value Segment: {segment_analysis['CLTV']['mean'].idxmax()}")
 print(f"Most Loyal Segment: {segment_analysis['Subscription_Length']['mean'].idxmax()}")
-print(f"Best Performing Channel: {campaign_response.groupby('Common_Keywords')['Revenue_Generated'].sum().idxmax()}")
+print(f"Best Performing Channel: {campaign_response.groupby('Common_Keywords', observed=True)['Revenue_Generated'].sum().idxmax()}")
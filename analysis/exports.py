@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from data_loader import CACHE_DIR, HAS_PYARROW
+
+# Change-aware writer for the Power BI tables. A script collects its tables in
+# an ExportBatch and writes them together: each file is written by a thread
+# pool to a temporary name and renamed into place, and a table whose content
+# hash matches what the previous run wrote to the same path is left untouched,
+# so a dashboard refresh only re-imports the tables that actually changed.
+# Besides CSV, tables can be written as Parquet with dictionary-encoded ID and
+# category columns.
+
+MANIFEST_DIR = os.path.join(CACHE_DIR, 'exports')
+
+# Comma-separated formats to write, e.g. 'csv,parquet' (default: csv)
+FORMATS_ENV = 'ANALYSIS_EXPORT_FORMATS'
+FORMATS = ('csv', 'parquet')
+MAX_WRITERS = 8
+
+
+def export_formats():
+    formats = [f.strip() for f in os.environ.get(FORMATS_ENV, 'csv').split(',') if f.strip()]
+    unknown = [f for f in formats if f not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown export format(s) {unknown}; choose from {list(FORMATS)}")
+    if 'parquet' in formats and not HAS_PYARROW:
+        raise ImportError('Parquet exports need pyarrow')
+    return formats
+
+
+def content_digest(frame):
+    """Hash of a table's column names, dtypes and values."""
+    digest = hashlib.sha1()
+    digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in frame.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _write_csv(frame, path):
+    frame.to_csv(path, index=False)
+
+
+def _write_parquet(frame, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    frame = frame.copy(deep=False)
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.PeriodDtype):
+            # Same 'YYYY-MM' labels as the CSV export
+            frame[col] = frame[col].astype(str)
+    # String and categorical columns (IDs, channels, tiers, labels) repeat a
+    # small set of values, so they are stored as dictionaries
+    encoded = [col for col in frame.columns
+               if isinstance(frame[col].dtype, pd.CategoricalDtype)
+               or not (pd.api.types.is_numeric_dtype(frame[col]) or pd.api.types.is_datetime64_any_dtype(frame[col]))]
+    pq.write_table(pa.Table.from_pandas(frame, preserve_index=False), path, use_dictionary=encoded or False)
+
+
+WRITERS = {'csv': _write_csv, 'parquet': _write_parquet}
+
+
+def _write_atomic(writer, frame, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp{os.getpid()}'
+    try:
+        writer(frame, tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+class ExportBatch:
+    """Tables bound for one output directory, written together by write()."""
+
+    def __init__(self, output_dir, formats=None):
+        self.output_dir = output_dir
+        self.formats = list(formats) if formats is not None else export_formats()
+        self.tables = {}
+
+    def add(self, name, frame):
+        """Queue a table; name is its path under output_dir without an extension."""
+        self.tables[name] = frame
+
+    def _manifest_path(self):
+        key = hashlib.sha1(os.path.realpath(self.output_dir).encode()).hexdigest()[:16]
+        return os.path.join(MANIFEST_DIR, key + '.json')
+
+    def write(self):
+        """Write changed tables; returns the paths actually (re)written."""
+        manifest_path = self._manifest_path()
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+
+        jobs = []
+        for name, frame in self.tables.items():
+            digest = content_digest(frame)
+            for fmt in self.formats:
+                path = os.path.join(self.output_dir, f'{name}.{fmt}')
+                previous = manifest.get(os.path.abspath(path))
+                if previous and previous['digest'] == digest and os.path.exists(path) and \
+                        os.path.getsize(path) == previous['size']:
+                    continue
+                jobs.append((fmt, frame, path, digest))
+
+        written = []
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(MAX_WRITERS, len(jobs))) as pool:
+                futures = [(pool.submit(_write_atomic, WRITERS[fmt], frame, path), path, digest)
+                           for fmt, frame, path, digest in jobs]
+                for future, path, digest in futures:
+                    future.result()
+                    manifest[os.path.abspath(path)] = {'digest': digest, 'size': os.path.getsize(path)}
+                    written.append(path)
+            os.makedirs(MANIFEST_DIR, exist_ok=True)
+            with open(manifest_path + '.tmp', 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(manifest_path + '.tmp', manifest_path)
+        self.tables = {}
+        return written
+
+
+def write_exports(tables, output_dir, formats=None):
+    """Write a {name: frame} mapping through an ExportBatch."""
+    batch = ExportBatch(output_dir, formats)
+    for name, frame in tables.items():
+        batch.add(name, frame)
+    return batch.write()
@@ -0,0 +1,145 @@
+import hashlib
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import pandas as pd
+
+from exports import content_digest
+from workers import worker_budget
+
+# Declarative figures. A chart is a draw function of an aggregated input
+# table (plus a few keyword arguments); scripts collect their charts in a
+# FigureSet and render them together at the end, concurrently in forked
+# worker processes on the Agg backend. Each PNG carries a digest of its
+# table, arguments, draw code and figure settings in its metadata, and a
+# chart whose digest matches the PNG already on disk is not redrawn, so an
+# unchanged chart costs one hash instead of a dpi=300 render.
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Worker processes for rendering (default: the shared budget, see workers.py; 1 renders inline)
+FIGURE_JOBS_ENV = 'ANALYSIS_FIGURE_JOBS'
+DIGEST_KEY = 'Chart-Digest'
+
+
+class Chart:
+    """One PNG: ``draw(data, **spec)`` on a fresh figure, saved to ``path``.
+
+    data is one table, or a dict of tables for charts that combine several
+    summaries (e.g. a histogram and category shares).
+    """
+
+    def __init__(self, path, draw, data, figsize=(12, 6), dpi=300, savefig=None, **spec):
+        self.path = path
+        self.draw = draw
+        self.data = data
+        self.figsize = figsize
+        self.dpi = dpi
+        self.savefig = savefig or {}
+        self.spec = spec
+
+    def digest(self):
+        digest = hashlib.sha1()
+        tables = self.data if isinstance(self.data, dict) else {None: self.data}
+        for name, frame in tables.items():
+            digest.update(repr(name).encode())
+            digest.update(content_digest(frame).encode())
+        for source in _code_sources(self.draw):
+            digest.update(source.encode())
+        for part in (sorted(self.spec.items()), self.figsize, self.dpi, sorted(self.savefig.items()),
+                     matplotlib.__version__):
+            digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+
+def _code_sources(draw):
+    """Source of the draw function and of the script helpers and analysis modules it calls."""
+    sources = [inspect.getsource(draw)]
+    for name in draw.__code__.co_names:
+        obj = draw.__globals__.get(name)
+        module = obj if inspect.ismodule(obj) else inspect.getmodule(obj)
+        path = getattr(module, '__file__', None)
+        if module is None or path is None or os.path.dirname(os.path.abspath(path)) != ANALYSIS_DIR:
+            continue
+        if module.__name__ == '__main__':
+            if inspect.isfunction(obj) and obj is not draw:
+                sources.append(inspect.getsource(obj))
+        else:
+            sources.append(inspect.getsource(module))
+    return sources
+
+
+def stored_digest(path):
+    """Chart digest recorded in an existing PNG, or None."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            return image.text.get(DIGEST_KEY)
+    except (OSError, SyntaxError):
+        return None
+
+
+def _render(chart, digest):
+    import matplotlib.pyplot as plt
+
+    plt.switch_backend('Agg')
+    plt.figure(figsize=chart.figsize)
+    try:
+        chart.draw(chart.data, **chart.spec)
+        directory = os.path.dirname(chart.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{chart.path}.tmp.png'
+        plt.savefig(tmp_path, dpi=chart.dpi, metadata={DIGEST_KEY: digest}, **chart.savefig)
+        os.replace(tmp_path, chart.path)
+    finally:
+        plt.close('all')
+    return chart.path
+
+
+def _jobs(jobs, n_charts):
+    jobs = worker_budget(jobs, FIGURE_JOBS_ENV)
+    # Draw functions live in the calling script, so workers must be forked from it
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return 1
+    return min(jobs, n_charts)
+
+
+class FigureSet:
+    """Charts collected by a script and rendered together; unchanged ones are skipped."""
+
+    def __init__(self):
+        self.charts = []
+
+    def add(self, path, draw, data, **kwargs):
+        tables = data if isinstance(data, dict) else {None: data}
+        if not all(isinstance(frame, pd.DataFrame) for frame in tables.values()):
+            raise TypeError('A chart is drawn from a DataFrame or a dict of DataFrames')
+        # Snapshot the tables, since scripts keep adding columns to their frames
+        if isinstance(data, dict):
+            data = {name: frame.copy() for name, frame in data.items()}
+        else:
+            data = data.copy()
+        self.charts.append(Chart(path, draw, data, **kwargs))
+
+    def render(self, jobs=None):
+        """Render the charts whose PNG is missing or stale; returns the paths drawn."""
+        pending = []
+        for chart in self.charts:
+            digest = chart.digest()
+            if stored_digest(chart.path) != digest:
+                pending.append((chart, digest))
+        jobs = _jobs(jobs, len(pending))
+        if jobs <= 1:
+            drawn = [_render(chart, digest) for chart, digest in pending]
+        else:
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+                futures = [pool.submit(_render, chart, digest) for chart, digest in pending]
+                drawn = [future.result() for future in futures]
+        self.charts = []
+        return drawn
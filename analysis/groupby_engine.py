@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+# Vectorized groupby engine. The keys are factorized once into dense group
+# labels, and every reduction in an agg spec is computed from those labels
+# with NumPy kernels (bincount for sums and counts, unbuffered ufunc.at for
+# min/max/first) instead of a separate pandas pass per function.
+
+SUPPORTED_FUNCS = ('sum', 'mean', 'count', 'min', 'max', 'first', 'nunique')
+
+# Integer sums go through float64 bincount only while they are exact
+_EXACT_FLOAT_LIMIT = 2 ** 53
+
+
+class GroupIndex:
+    def __init__(self, frame, keys):
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.n_rows = len(frame)
+
+        codes, uniques = [], []
+        for key in self.keys:
+            key_codes, key_uniques = pd.factorize(frame[key], sort=True)
+            codes.append(key_codes.astype(np.int64))
+            uniques.append(key_uniques)
+
+        valid = np.ones(self.n_rows, dtype=bool)
+        for key_codes in codes:
+            valid &= key_codes >= 0
+        self.valid = valid
+
+        if len(codes) == 1:
+            # Sorted factorize codes are already dense, ordered group labels
+            labels = codes[0][valid]
+            key_codes = [np.arange(len(uniques[0]))]
+        else:
+            # Mixed-radix combination of the per-key codes keeps lexicographic
+            # key order, so sorting the combined ids reproduces groupby(sort=True)
+            sizes = [max(len(u), 1) for u in uniques]
+            if np.prod(sizes, dtype=float) < 2 ** 62:
+                combined = np.ravel_multi_index([c[valid] for c in codes], sizes)
+                labels, group_ids = pd.factorize(combined, sort=True)
+                key_codes = np.unravel_index(group_ids, sizes)
+            else:
+                # Key space too large to ravel: fall back to sorting the code tuples
+                stacked = np.stack([c[valid] for c in codes], axis=1)
+                group_tuples, labels = np.unique(stacked, axis=0, return_inverse=True)
+                key_codes = group_tuples.T
+
+        self.labels = np.full(self.n_rows, -1, dtype=np.int64)
+        self.labels[valid] = labels.reshape(-1)
+        self.ngroups = len(key_codes[0])
+        self.key_frame = pd.DataFrame({
+            key: pd.Series(u.take(c), name=key).reset_index(drop=True)
+            for key, u, c in zip(self.keys, uniques, key_codes)
+        })
+
+    def _select(self, values=None):
+        """Labels and row selector of the rows that take part in a reduction."""
+        mask = self.valid if values is None else self.valid & np.asarray(pd.notna(values))
+        if mask.all():
+            return self.labels, slice(None)
+        rows = np.flatnonzero(mask)
+        return self.labels[rows], rows
+
+    def size(self):
+        labels, _ = self._select()
+        return np.bincount(labels, minlength=self.ngroups)
+
+    def count(self, values):
+        labels, _ = self._select(values)
+        return np.bincount(labels, minlength=self.ngroups)
+
+    def sum(self, values):
+        labels, rows = self._select(values)
+        raw = _numeric(values)[rows]
+        if raw.dtype.kind in 'iub':
+            ints = raw.astype(np.int64)
+            if len(ints) and np.abs(ints).max() * len(ints) >= _EXACT_FLOAT_LIMIT:
+                out = np.zeros(self.ngroups, dtype=np.int64)
+                np.add.at(out, labels, ints)
+                return out
+            return np.bincount(labels, weights=ints, minlength=self.ngroups).astype(np.int64)
+        return np.bincount(labels, weights=raw, minlength=self.ngroups)
+
+    def mean(self, values):
+        return self.sum(values) / self.count(values)
+
+    def _extreme(self, ufunc, values):
+        labels, rows = self._select(values)
+        raw = _numeric(values)
+        fill = np.inf if ufunc is np.fmin else -np.inf
+        out = np.full(self.ngroups, fill)
+        ufunc.at(out, labels, raw[rows].astype('float64'))
+        present = np.bincount(labels, minlength=self.ngroups) > 0
+        if raw.dtype.kind in 'iub' and present.all():
+            return out.astype(raw.dtype)
+        return np.where(present, out, np.nan)
+
+    def min(self, values):
+        return self._extreme(np.fmin, values)
+
+    def max(self, values):
+        return self._extreme(np.fmax, values)
+
+    def first_row(self, values=None):
+        """Position of each group's first (non-null) row, NaN when it has none."""
+        labels, rows = self._select(values)
+        positions = np.arange(self.n_rows)[rows]
+        out = np.full(self.ngroups, self.n_rows, dtype=np.int64)
+        np.minimum.at(out, labels, positions)
+        return np.where(out < self.n_rows, out, np.nan)
+
+    def first(self, values):
+        positions = self.first_row(values)
+        series = values.reset_index(drop=True) if isinstance(values, pd.Series) else pd.Series(values)
+        if np.isnan(positions).any():
+            taken = series.take(np.nan_to_num(positions, nan=0).astype(np.int64)).reset_index(drop=True)
+            return taken.where(~np.isnan(positions))
+        return series.take(positions.astype(np.int64)).reset_index(drop=True)
+
+    def nunique(self, values):
+        labels, rows = self._select(values)
+        value_codes, value_uniques = pd.factorize(values)
+        width = max(len(value_uniques), 1)
+        distinct = pd.unique(labels * width + value_codes[rows]) // width
+        return np.bincount(distinct, minlength=self.ngroups)
+
+    def reduce(self, func, values):
+        if func not in SUPPORTED_FUNCS:
+            raise ValueError(f"Unsupported aggregation '{func}'")
+        return getattr(self, func)(values)
+
+
+def _numeric(values):
+    if isinstance(values, pd.Series):
+        if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+            raise TypeError(f"Column '{values.name}' is not numeric")
+        if values.dtype.kind in 'iub':
+            return values.to_numpy()
+        return values.to_numpy(dtype='float64', na_value=np.nan)
+    return np.asarray(values)
+
+
+def fused_agg(frame, keys, spec, group_index=None):
+    """Drop-in for ``frame.groupby(keys, observed=True).agg(spec).reset_index()``."""
+    index = group_index if group_index is not None else GroupIndex(frame, keys)
+    multi = any(not isinstance(funcs, str) for funcs in spec.values())
+    out = {key: index.key_frame[key] for key in index.keys}
+    columns = [(key, '') for key in index.keys]
+    for col, funcs in spec.items():
+        for func in ([funcs] if isinstance(funcs, str) else funcs):
+            name = (col, func) if multi else col
+            out[name] = index.reduce(func, frame[col])
+            columns.append((col, func))
+    result = pd.DataFrame(out)
+    if multi:
+        result.columns = pd.MultiIndex.from_tuples(columns)
+    return result
@@ -0,0 +1,212 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import compute_partials, finalize, merge_partials, normalize_spec, required_partials
+from data_loader import CACHE_DIR, DATA_PATH, SCHEMA
+from metrics import evaluate
+from segmentation import OnlineSegments, load_or_fit
+from streaming import (ACCUMULATORS, ANALYSIS_DIR, DEFAULT_CHUNKSIZE, EXPORTS, SEGMENTATION_EXPORT, build_tables,
+                       order_table, segmentation_frames, stream_aggregates, write_tables)
+from typed_table import set_date_columns
+
+# Incremental refresh of the Power BI exports. The base aggregates behind every
+# export are kept as mergeable partials per group key; a file of newly
+# appended transactions is folded into them, and only the groups it touches
+# are finalized, have their metrics evaluated and are spliced into the stored
+# tables, so a refresh costs time proportional to the delta. Customer segments
+# are kept current the same way: only the customers in the delta are
+# reassigned, against centroids maintained by OnlineSegments.
+
+STATE_DIR = os.path.join(CACHE_DIR, 'incremental')
+STATE_PATH = os.path.join(STATE_DIR, 'state.json')
+
+
+class GroupState:
+    """Partial aggregates of one accumulator, indexed by its group keys."""
+
+    def __init__(self, keys, spec, frame):
+        self.keys = list(keys)
+        self.spec_items = normalize_spec(spec)
+        self.partials = required_partials(self.spec_items)
+        if any(stat == 'nunique' for _, stat in self.partials):
+            raise ValueError('Distinct counts cannot be maintained incrementally')
+        self.frame = frame
+
+    def fold(self, chunk, row_offset):
+        """Merge a chunk of new rows into the state; returns the keys of the groups it touched."""
+        delta = compute_partials(chunk, self.keys, self.partials)
+        for name in delta.columns:
+            if name.endswith('|first_row'):
+                delta[name] += row_offset
+        delta = delta.set_index(self.keys)
+
+        positions = self.frame.index.get_indexer(delta.index)
+        known = positions >= 0
+        if known.any():
+            existing = self.frame.iloc[positions[known]].reset_index()
+            merged = merge_partials([existing, delta[known].reset_index()], self.keys).set_index(self.keys)
+            merged = merged.reindex(delta.index[known])
+            for name in merged.columns:
+                self.frame.iloc[positions[known], self.frame.columns.get_loc(name)] = merged[name].to_numpy()
+        if not known.all():
+            self.frame = pd.concat([self.frame, delta[~known]]).sort_index()
+        return delta.index
+
+    def result(self, groups=None):
+        frame = self.frame if groups is None else self.frame.loc[groups]
+        return finalize(frame.reset_index(), self.keys, self.spec_items, multi=False)
+
+    def first_rows(self):
+        return self.frame.reset_index()[self.keys + ['__group__|first_row']]
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _pickle_path(kind, name):
+    return os.path.join(STATE_DIR, kind, name.replace('/', '__') + '.pkl')
+
+
+def _dump(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle(obj, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def load_state():
+    with open(STATE_PATH) as f:
+        meta = json.load(f)
+    groups = {name: GroupState(keys, spec, pd.read_pickle(_pickle_path('groups', name)))
+              for name, (keys, spec) in ACCUMULATORS.items()}
+    return meta, groups, pd.read_pickle(_pickle_path('segments', 'online'))
+
+
+def save_state(meta, groups, tables, online):
+    for name, table in tables.items():
+        _dump(table, _pickle_path('tables', name))
+    for name, state in groups.items():
+        _dump(state.frame, _pickle_path('groups', name))
+    _dump(online, _pickle_path('segments', 'online'))
+    # The manifest is written last, so an interrupted refresh leaves the
+    # previous state in place
+    with open(STATE_PATH + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(STATE_PATH + '.tmp', STATE_PATH)
+
+
+def init(source=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, output_dir=None):
+    """Build the state store and every export from the full history."""
+    output_dir = output_dir or os.path.join(ANALYSIS_DIR, 'reports', 'powerbi')
+    aggregates = stream_aggregates(source, chunksize)
+    tables = build_tables(aggregates)
+    groups = {name: GroupState(agg.keys, agg.spec, agg.partial_frame().set_index(agg.keys))
+              for name, agg in aggregates.items()}
+    rows = int(groups['campaign'].frame['__group__|rows'].sum())
+    write_tables(tables, output_dir)
+    customers = tables['segmentation/customer_metrics.csv']
+    online = OnlineSegments.start(load_or_fit(customers, k=4), customers)
+    save_state({'rows': rows, 'output_dir': output_dir, 'applied': []}, groups, tables, online)
+    return tables
+
+
+def read_delta(path, date=None):
+    delta = pd.read_csv(path, dtype=SCHEMA)
+    if 'Date' in delta.columns:
+        dates = pd.to_datetime(delta['Date'])
+    else:
+        # Rows without a transaction date are booked on the refresh date
+        dates = pd.Series(pd.Timestamp(date).normalize() if date else pd.Timestamp.today().normalize(),
+                          index=delta.index)
+    return set_date_columns(delta, dates.to_numpy())
+
+
+def splice(table, update, keys, order):
+    """Replace the rows of table whose keys appear in update, keeping the table's row order."""
+    stale = pd.MultiIndex.from_frame(table[keys]).isin(pd.MultiIndex.from_frame(update[keys]))
+    return order_table(pd.concat([table[~stale], update], ignore_index=True), order)
+
+
+def update_segments(online, state, customers, seed):
+    """Segmentation tables with the given customers reassigned by the online model."""
+    rows = online.update(evaluate(state.result(customers), ['CLTV']))
+    metrics_table = pd.read_pickle(_pickle_path('tables', 'segmentation/customer_metrics.csv'))
+    churn_table = pd.read_pickle(_pickle_path('tables', 'segmentation/churn_risk.csv'))
+    # Known customers keep their synthetic churn flag; new ones draw one as the full build does
+    churn_risk = churn_table.set_index('Customer_ID')['Churn_Risk'].reindex(rows['Customer_ID']).to_numpy(dtype=float, copy=True)
+    new = np.isnan(churn_risk)
+    churn_risk[new] = np.random.default_rng(seed).choice([0, 1], size=new.sum(), p=[0.85, 0.15])
+    update = segmentation_frames(rows, churn_risk.astype(int))
+    return {
+        'segmentation/customer_metrics.csv': splice(metrics_table, update['segmentation/customer_metrics.csv'],
+                                                    state.keys, state.keys),
+        'segmentation/churn_risk.csv': splice(churn_table, update['segmentation/churn_risk.csv'],
+                                              state.keys, state.keys),
+    }
+
+
+def append(path, date=None):
+    """Fold a file of new transactions into the state and rewrite the exports it affects."""
+    meta, groups, online = load_state()
+    digest = _file_digest(path)
+    if digest in meta['applied']:
+        raise ValueError(f"{path} has already been applied")
+
+    delta = read_delta(path, date)
+    changed = {name: state.fold(delta, meta['rows']) for name, state in groups.items()}
+
+    updated = {}
+    for export in EXPORTS:
+        groups_changed = changed[export.source]
+        if not len(groups_changed):
+            continue
+        state = groups[export.source]
+        if export is SEGMENTATION_EXPORT:
+            # The one export that needs every group; the online model stands in for a refit
+            updated.update(update_segments(online, state, groups_changed, meta['rows']))
+            continue
+        for name, rows in export.build(state.result(groups_changed), groups).items():
+            table = pd.read_pickle(_pickle_path('tables', name))
+            updated[name] = splice(table, rows, state.keys, export.order.get(name, state.keys))
+
+    write_tables(updated, meta['output_dir'])
+    meta['rows'] += len(delta)
+    meta['applied'].append(digest)
+    save_state(meta, groups, updated, online)
+    return changed, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the Power BI exports up to date from newly appended transactions.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    init_parser = sub.add_parser('init', help='build the state store and all exports from the full history')
+    init_parser.add_argument('--source', default=DATA_PATH, help='transaction CSV holding the full history')
+    init_parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='rows per chunk')
+    init_parser.add_argument('--output-dir', default=None)
+    append_parser = sub.add_parser('append', help='fold a CSV of new transactions into the exports')
+    append_parser.add_argument('path', help='CSV with the same columns as the transaction file')
+    append_parser.add_argument('--date', default=None, help='date for rows without a Date column (default: today)')
+    args = parser.parse_args()
+
+    if args.command == 'init':
+        tables = init(args.source, args.chunksize, args.output_dir)
+        print(f"Incremental state initialised; wrote {len(tables)} tables")
+        return
+
+    changed, updated = append(args.path, args.date)
+    for name, keys in changed.items():
+        print(f"{name}: {len(keys)} groups updated")
+    print(f"Rewrote {len(updated)} tables: {', '.join(sorted(updated))}")
+
+
+if __name__ == '__main__':
+    main()
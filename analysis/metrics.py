@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import aggregate
+
+# Declarative KPI registry. Each metric is defined once as an expression over
+# base aggregates (columns of the grouped table) or other metrics. A query
+# resolves every base aggregate it needs into a single aggregate() call and
+# evaluates each metric, including shared intermediates, exactly once.
+
+# Default reduction for a base column a metric needs but the caller did not
+# aggregate explicitly
+BASE_AGGREGATIONS = {
+    'Revenue_Generated': 'sum',
+    'Budget': 'sum',
+    'Clicks': 'sum',
+    'Conversions': 'sum',
+    'Units_Sold': 'sum',
+    'Bundle_Price': 'mean',
+    'Discount_Level': 'mean',
+    'Subscription_Length': 'mean',
+    'Customer_Satisfaction_Post_Refund': 'mean',
+}
+
+ROI_BINS = [-np.inf, 0, 50, 100, np.inf]
+ROI_LABELS = ['< 0%', '0-50%', '50-100%', '> 100%']
+CPA_BINS = [-np.inf, 100, 200, 300, np.inf]
+CPA_LABELS = ['< $100', '$100-200', '$200-300', '> $300']
+
+
+class Metric:
+    def __init__(self, name, inputs, formula):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.formula = formula
+
+
+METRICS = {}
+
+
+def register(name, inputs, formula):
+    METRICS[name] = Metric(name, inputs, formula)
+
+
+register('ROI', ['Revenue_Generated', 'Budget'], lambda revenue, budget: (revenue - budget) / budget * 100)
+register('CPA', ['Budget', 'Conversions'], lambda budget, conversions: budget / conversions)
+register('Cost_per_Unit', ['Budget', 'Units_Sold'], lambda budget, units: budget / units)
+register('CTR', ['Conversions', 'Clicks'], lambda conversions, clicks: conversions / clicks * 100)
+register('CPC', ['Budget', 'Clicks'], lambda budget, clicks: budget / clicks)
+register('CLTV', ['Revenue_Generated', 'Subscription_Length'], lambda revenue, length: revenue * (1 + length))
+register('Average_Revenue_per_Unit', ['Revenue_Generated', 'Units_Sold'], lambda revenue, units: revenue / units)
+register('Bundle_Cost', ['Bundle_Price', 'Units_Sold'], lambda price, units: price * units)
+register('Profit_Margin', ['Revenue_Generated', 'Bundle_Cost'], lambda revenue, cost: (revenue - cost) / revenue)
+register('Bundle_ROI', ['Profit_Margin'], lambda margin: margin * 100)
+register('ROI_Category', ['ROI'], lambda roi: pd.cut(roi, bins=ROI_BINS, labels=ROI_LABELS))
+register('Bundle_ROI_Category', ['Bundle_ROI'], lambda roi: pd.cut(roi, bins=ROI_BINS, labels=ROI_LABELS))
+register('CPA_Category', ['CPA'], lambda cpa: pd.cut(cpa, bins=CPA_BINS, labels=CPA_LABELS))
+
+
+def resolve(metrics):
+    """Return (evaluation order of metrics, base columns they read)."""
+    order, bases, visiting = [], [], set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name not in METRICS:
+            if name not in bases:
+                bases.append(name)
+            return
+        if name in visiting:
+            raise ValueError(f"Metric '{name}' depends on itself")
+        visiting.add(name)
+        for dep in METRICS[name].inputs:
+            visit(dep)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in metrics:
+        if name not in METRICS:
+            raise KeyError(f"Unknown metric '{name}'")
+        visit(name)
+    return order, bases
+
+
+def evaluate(frame, metrics):
+    """Add the requested metrics to an already aggregated frame."""
+    order, _ = resolve(metrics)
+    values = {}
+    for name in order:
+        metric = METRICS[name]
+        args = [values[dep] if dep in values else frame[dep] for dep in metric.inputs]
+        values[name] = metric.formula(*args)
+    out = frame.copy()
+    for name in metrics:
+        out[name] = values[name]
+    return out
+
+
+def metric_spec(spec, metrics):
+    """Return (spec plus default aggregations of the base columns the metrics need, those added columns)."""
+    _, bases = resolve(metrics)
+    full_spec = dict(spec)
+    for col in bases:
+        if col not in full_spec:
+            if col not in BASE_AGGREGATIONS:
+                raise KeyError(f"No default aggregation for base column '{col}'")
+            full_spec[col] = BASE_AGGREGATIONS[col]
+    return full_spec, [col for col in full_spec if col not in spec]
+
+
+def compute_metrics(table, keys, spec, metrics):
+    """Aggregate spec for keys and evaluate metrics on it in one pass.
+
+    Base columns the metrics need but spec does not list are aggregated with
+    their BASE_AGGREGATIONS default and left out of the result.
+    """
+    full_spec, helper_columns = metric_spec(spec, metrics)
+    grouped = evaluate(aggregate(table, keys, full_spec), metrics)
+    return grouped.drop(columns=helper_columns)
@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from cube import Cube
+from data_loader import dataset_fingerprint
+from metrics import compute_metrics
+from streaming import ACCUMULATORS, BUNDLE_SPEC, CAMPAIGN_SPEC, CHANNEL_SPEC, CUSTOMER_SPEC, segment_customers
+from typed_table import load_table
+
+# Local HTTP service for the dashboard tables. The dataset and its cube are
+# loaded once; each endpoint answers from the cube with optional filters, and
+# responses are kept in an LRU cache keyed by the query and the data version.
+# Concurrent identical requests share one computation, and clients revalidate
+# with ETags instead of re-downloading unchanged tables.
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PORT = 8050
+CACHE_ENTRIES = 256
+
+# Discount bands of the trends page, as inclusive Discount_Level ranges
+DISCOUNT_BANDS = {
+    '0-10%': (0, 10),
+    '10-20%': (11, 20),
+    '20-30%': (21, 30),
+    '>30%': (31, None),
+}
+
+TREND_SPEC = ACCUMULATORS['year_month'][1]
+
+
+class QueryError(ValueError):
+    pass
+
+
+FILTERS = ('channel', 'tier', 'start', 'end', 'discount')
+
+
+def _month(value):
+    try:
+        return str(pd.Period(value, freq='M'))
+    except ValueError:
+        raise QueryError(f"Invalid month '{value}'; use YYYY-MM") from None
+
+
+def _cube_filters(params):
+    unsupported = set(params) - set(FILTERS) - {'format'}
+    if unsupported:
+        raise QueryError(f"Unsupported parameters: {', '.join(sorted(unsupported))}")
+    filters = {}
+    if 'channel' in params:
+        filters['Common_Keywords'] = params['channel']
+    if 'tier' in params:
+        filters['Subscription_Tier'] = params['tier']
+    if 'start' in params or 'end' in params:
+        filters['Month'] = tuple(_month(params[name][0]) if name in params else None for name in ('start', 'end'))
+    if 'discount' in params:
+        band = params['discount'][0]
+        if band not in DISCOUNT_BANDS:
+            raise QueryError(f"Unknown discount band '{band}'; use one of {', '.join(DISCOUNT_BANDS)}")
+        filters['Discount_Level'] = DISCOUNT_BANDS[band]
+    return filters
+
+
+def campaigns_table(data, params):
+    cube = data.cube.slice(**_cube_filters(params))
+    return data.table.decode(cube.compute_metrics(['Campaign_ID', 'Common_Keywords'], CAMPAIGN_SPEC,
+                                                  ['ROI', 'CPA', 'ROI_Category', 'CPA_Category']))
+
+
+def channels_table(data, params):
+    cube = data.cube.slice(**_cube_filters(params))
+    return cube.compute_metrics('Common_Keywords', CHANNEL_SPEC, ['CTR', 'CPC'])
+
+
+def bundles_table(data, params):
+    cube = data.cube.slice(**_cube_filters(params))
+    bundles = cube.compute_metrics(['Bundle_ID', 'Discount_Level'], BUNDLE_SPEC,
+                                   ['Average_Revenue_per_Unit', 'Bundle_ROI', 'Bundle_ROI_Category'])
+    return data.table.decode(bundles).rename(columns={
+        'Average_Revenue_per_Unit': 'Bundle_Price',
+        'Bundle_ROI': 'ROI',
+        'Bundle_ROI_Category': 'ROI_Category'
+    })
+
+
+def trends_table(data, params):
+    cube = data.cube.slice(**_cube_filters(params))
+    trends = cube.aggregate(['Year', 'Month'], TREND_SPEC)
+    trends['Month_Name'] = trends['Month'].dt.strftime('%B')
+    return trends
+
+
+def segments_table(data, params):
+    unsupported = set(params) - {'tier', 'format'}
+    if unsupported:
+        raise QueryError(f"Segments can only be filtered by tier, not {', '.join(sorted(unsupported))}")
+    if data.segments is None:
+        customers = compute_metrics(data.table, 'Customer_ID', CUSTOMER_SPEC, ['CLTV'])
+        data.segments = segment_customers(data.table.decode(customers), data.version)
+    segments = data.segments
+    if 'tier' in params:
+        segments = segments[segments['Subscription_Tier'].isin(params['tier'])]
+    return segments
+
+
+ENDPOINTS = {
+    '/campaigns': campaigns_table,
+    '/channels': channels_table,
+    '/bundles': bundles_table,
+    '/segments': segments_table,
+    '/trends': trends_table,
+}
+
+
+class DataState:
+    """The loaded table, its cube and the dataset version they belong to."""
+
+    def __init__(self):
+        self.table = load_table()
+        self.version = self.table.fingerprint
+        self.cube = Cube.build(self.table)
+        self.segments = None
+
+
+class ResponseCache:
+    """LRU of rendered responses keyed by (version, path, query, format)."""
+
+    def __init__(self, max_entries=CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def render(frame, fmt):
+    frame = frame.copy()
+    for col in frame.columns:
+        if str(frame[col].dtype).startswith('period'):
+            frame[col] = frame[col].astype(str)
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        frame.to_csv(buffer, index=False)
+        return buffer.getvalue().encode(), 'text/csv; charset=utf-8'
+    return frame.to_json(orient='records', date_format='iso').encode(), 'application/json'
+
+
+class MetricsService:
+    def __init__(self):
+        # One worker thread: table computations run off the event loop, one at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Data-version checks (a stat and the manifest, unless the file changed)
+        # get their own thread, so cached and 304 responses never queue behind
+        # a computation
+        self.versions = ThreadPoolExecutor(max_workers=1)
+        self.data = None
+        self.cache = ResponseCache()
+        self.inflight = {}
+
+    def _ensure_data(self):
+        if self.data is None or self.data.version != dataset_fingerprint():
+            self.data = DataState()
+            self.cache.clear()
+        return self.data
+
+    def _compute(self, path, params, fmt):
+        data = self._ensure_data()
+        body, content_type = render(ENDPOINTS[path](data, params), fmt)
+        return data.version, body, content_type, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    async def respond(self, path, query):
+        if path == '/health':
+            return HTTPStatus.OK, json.dumps({'ok': True, 'cached': len(self.cache.entries)}).encode(), \
+                'application/json', None
+        if path not in ENDPOINTS:
+            return HTTPStatus.NOT_FOUND, json.dumps({'error': f'unknown endpoint {path}',
+                                                     'endpoints': sorted(ENDPOINTS)}).encode(), \
+                'application/json', None
+        params = parse_qs(query)
+        fmt = params.get('format', ['json'])[0]
+        if fmt not in ('json', 'csv'):
+            return HTTPStatus.BAD_REQUEST, json.dumps({'error': f"Unknown format '{fmt}'"}).encode(), \
+                'application/json', None
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(self.versions, dataset_fingerprint)
+        key = (version, path, tuple(sorted((k, tuple(v)) for k, v in params.items())), fmt)
+
+        cached = self.cache.get(key)
+        if cached is None:
+            # Identical requests arriving while this one computes await the same result
+            if key not in self.inflight:
+                self.inflight[key] = loop.run_in_executor(self.executor, self._compute, path, params, fmt)
+            future = self.inflight[key]
+            try:
+                data_version, body, content_type, etag = await future
+            except QueryError as exc:
+                return HTTPStatus.BAD_REQUEST, json.dumps({'error': str(exc)}).encode(), 'application/json', None
+            finally:
+                self.inflight.pop(key, None)
+            cached = (body, content_type, etag)
+            self.cache.put((data_version,) + key[1:], cached)
+        body, content_type, etag = cached
+        return HTTPStatus.OK, body, content_type, etag
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) != 3 or request_line[0] not in ('GET', 'HEAD'):
+                await self._send(writer, HTTPStatus.METHOD_NOT_ALLOWED, b'', 'text/plain', None)
+                return
+            url = urlsplit(request_line[1])
+            status, body, content_type, etag = await self.respond(url.path.rstrip('/') or '/', url.query)
+            if etag is not None and headers.get('if-none-match') == etag:
+                status, body = HTTPStatus.NOT_MODIFIED, b''
+            await self._send(writer, status, b'' if request_line[0] == 'HEAD' else body, content_type, etag)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, body, content_type, etag):
+        head = [f'HTTP/1.1 {status.value} {status.phrase}',
+                f'Content-Type: {content_type}',
+                f'Content-Length: {len(body)}',
+                'Cache-Control: no-cache',
+                'Connection: close']
+        if etag is not None:
+            head.append(f'ETag: {etag}')
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+        await writer.drain()
+
+
+async def serve(host='127.0.0.1', port=DEFAULT_PORT):
+    service = MetricsService()
+    # Load the dataset before accepting clients
+    await asyncio.get_running_loop().run_in_executor(service.executor, service._ensure_data)
+    server = await asyncio.start_server(service.handle, host, port)
+    print(f"Metrics service ready on http://{host}:{port} ({', '.join(sorted(ENDPOINTS))})")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the dashboard tables over local HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    os.chdir(ANALYSIS_DIR)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import compute_partials, finalize, merge_partials, normalize_spec, remap_first_rows, required_partials
+from data_loader import CACHE_DIR, HAS_PYARROW
+from typed_table import SyntheticDates, set_date_columns
+
+# Month-partitioned copy of the transaction table for the trend queries. Each
+# month is stored as its own file with min/max statistics per column, so a
+# query over a date range only opens the months it overlaps. Aggregates of
+# every closed month are cached by the partition's content hash; only the
+# latest (still open) month is recomputed on each run.
+
+PARTITION_DIR = os.path.join(CACHE_DIR, 'partitions')
+AGGREGATE_DIR = os.path.join(PARTITION_DIR, 'aggregates')
+MANIFEST = 'manifest.json'
+ROW_COLUMN = '__row__'
+
+# Optional month range ('YYYY-MM') for the trend tables and plots
+RANGE_ENV = ('ANALYSIS_TRENDS_START', 'ANALYSIS_TRENDS_END')
+
+_memory = {}
+
+
+def trends_range():
+    return tuple(os.environ.get(name) or None for name in RANGE_ENV)
+
+
+def _stats(frame, months):
+    """[min, max] per month of every numeric and datetime column, for pruning."""
+    columns = [col for col in frame.columns if frame[col].dtype.kind in 'iufM']
+    extremes = frame[columns].groupby(months.to_numpy(), sort=True).agg(['min', 'max'])
+    stats = [{} for _ in range(len(extremes))]
+    for col in columns:
+        pairs = zip(extremes[(col, 'min')].tolist(), extremes[(col, 'max')].tolist())
+        for month_stats, (low, high) in zip(stats, pairs):
+            month_stats[col] = [str(low), str(high)] if frame[col].dtype.kind == 'M' else [low, high]
+    return stats
+
+
+def build(table, directory=PARTITION_DIR):
+    """Split the table into month partitions; returns the store path."""
+    path = os.path.join(directory, table.fingerprint[:16])
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        return path
+
+    frame = SyntheticDates(len(table.frame)).add_to(table.frame.copy(deep=False))
+    frame[ROW_COLUMN] = np.arange(len(frame))
+    frame = frame.sort_values('Month', kind='stable', ignore_index=True)
+    months = frame.pop('Month')
+    frame = frame.drop(columns='Year')
+    row_hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    bounds = np.flatnonzero(np.r_[True, months.to_numpy()[1:] != months.to_numpy()[:-1], True])
+
+    ext = 'parquet' if HAS_PYARROW else 'pkl'
+    if HAS_PYARROW:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        arrow = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp = f'{path}.tmp{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    partitions = []
+    stats = _stats(frame, months)
+    for (lo, hi), month_stats in zip(zip(bounds[:-1], bounds[1:]), stats):
+        month = months.iloc[lo]
+        name = f'{month}.{ext}'
+        if HAS_PYARROW:
+            pq.write_table(arrow.slice(lo, hi - lo), os.path.join(tmp, name))
+        else:
+            frame.iloc[lo:hi].reset_index(drop=True).to_pickle(os.path.join(tmp, name))
+        partitions.append({'month': str(month), 'file': name, 'rows': int(hi - lo),
+                           'digest': hashlib.sha1(row_hashes[lo:hi].tobytes()).hexdigest(),
+                           'stats': month_stats})
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump({'fingerprint': table.fingerprint, 'partitions': partitions}, f)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for name in os.listdir(directory):
+        stale = os.path.join(directory, name)
+        if name != 'aggregates' and stale != path and not name.startswith(os.path.basename(path)):
+            shutil.rmtree(stale, ignore_errors=True)
+    return path
+
+
+def open_store(table):
+    path = build(table)
+    with open(os.path.join(path, MANIFEST)) as f:
+        return path, json.load(f)['partitions']
+
+
+def select(partitions, start=None, end=None):
+    """Partitions whose Date range overlaps the months start..end (inclusive)."""
+    low = pd.Period(start, freq='M').start_time if start else None
+    high = pd.Period(end, freq='M').end_time if end else None
+    chosen = []
+    for part in partitions:
+        date_min, date_max = (pd.Timestamp(v) for v in part['stats']['Date'])
+        if (low is None or date_max >= low) and (high is None or date_min <= high):
+            chosen.append(part)
+    return chosen
+
+
+def read_partitions(path, parts, columns=None):
+    """Rows of the given (non-empty list of) partitions, read in one batch."""
+    if columns is not None:
+        # Month and Year are derived from Date on read
+        columns = list(dict.fromkeys([c for c in columns if c not in ('Month', 'Year')] + ['Date', ROW_COLUMN]))
+    files = [os.path.join(path, part['file']) for part in parts]
+    if HAS_PYARROW:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        frame = pa.concat_tables([pq.read_table(file, columns=columns) for file in files]).to_pandas()
+    else:
+        frame = pd.concat([pd.read_pickle(file) for file in files], ignore_index=True)
+        if columns is not None:
+            frame = frame[columns]
+    return set_date_columns(frame, frame['Date'].to_numpy())
+
+
+def read_months(table, start=None, end=None, columns=None):
+    """Rows of the months start..end, reading only their partitions."""
+    path, partitions = open_store(table)
+    chosen = select(partitions, start, end)
+    if not chosen:
+        return read_partitions(path, partitions[:1], columns).iloc[:0]
+    return read_partitions(path, chosen, columns)
+
+
+def _load_entry(entry):
+    if entry not in _memory:
+        try:
+            _memory[entry] = pd.read_pickle(os.path.join(AGGREGATE_DIR, entry + '.pkl'))
+        except (OSError, ValueError):
+            _memory[entry] = None
+    return _memory[entry]
+
+
+def _save_entry(entry, frame):
+    _memory[entry] = frame
+    os.makedirs(AGGREGATE_DIR, exist_ok=True)
+    path = os.path.join(AGGREGATE_DIR, entry + '.pkl')
+    frame.to_pickle(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def month_partials(table, keys, partials, start=None, end=None):
+    """Partials per (month, keys) for the selected months, tagged with their partition digest.
+
+    Closed months come from the aggregate cache when their partition content
+    is unchanged; the open month and any new or changed month are read from
+    their partitions.
+    """
+    path, partitions = open_store(table)
+    chosen = select(partitions, start, end)
+    group_keys = keys if 'Month' in keys else keys + ['Month']
+    entry = hashlib.sha1(json.dumps([group_keys, sorted(map(list, partials))]).encode()).hexdigest()
+    closed = {part['digest'] for part in partitions[:-1]}
+
+    cached = _load_entry(entry)
+    have = set(cached['__partition__'].unique()) & closed if cached is not None else set()
+    missing = [part for part in chosen if part['digest'] not in have]
+    frames = []
+    if cached is not None:
+        wanted = {part['digest'] for part in chosen} & have
+        frames.append(cached[cached['__partition__'].isin(wanted)])
+    if missing:
+        rows = read_partitions(path, missing, keys + [col for col, _ in partials if not col.startswith('__')])
+        computed = remap_first_rows(compute_partials(rows, group_keys, partials), rows[ROW_COLUMN].to_numpy())
+        digests = {pd.Period(part['month'], freq='M'): part['digest'] for part in missing}
+        computed['__partition__'] = computed['Month'].map(digests)
+        frames.append(computed)
+
+        new_closed = computed[computed['__partition__'].isin(closed)]
+        if len(new_closed):
+            # Keep entries only for partitions that still exist
+            kept = cached[cached['__partition__'].isin(closed)] if cached is not None else None
+            _save_entry(entry, pd.concat([kept, new_closed], ignore_index=True) if kept is not None else
+                        new_closed.reset_index(drop=True))
+    if not frames:
+        empty = read_partitions(path, partitions[:1]).iloc[:0]
+        computed = compute_partials(empty, group_keys, partials)
+        computed['__partition__'] = pd.Series(dtype=object)
+        frames.append(computed)
+    return pd.concat(frames, ignore_index=True)
+
+
+def aggregate_months(table, keys, spec, start=None, end=None):
+    """``aggregate(table, keys, spec)`` over the rows dated in the months start..end."""
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    spec_items = normalize_spec(spec)
+    multi = any(not isinstance(funcs, str) for funcs in spec.values())
+    partials = required_partials(spec_items)
+
+    if 'Month' not in keys and any(stat == 'nunique' for _, stat in partials):
+        # Distinct counts do not add up across months; aggregate the selected rows directly
+        rows = read_months(table, start, end)
+        return finalize(compute_partials(rows, keys, partials), keys, spec_items, multi)
+
+    combined = month_partials(table, keys, partials, start, end).drop(columns='__partition__')
+    if 'Month' in keys:
+        # Every group lies in a single month, so the month partials only need ordering
+        combined = combined.sort_values(keys, ignore_index=True)
+    else:
+        combined = merge_partials([combined.drop(columns='Month')], keys)
+    return finalize(combined, keys, spec_items, multi)
@@ -0,0 +1,308 @@
+import argparse
+import hashlib
+import json
+import os
+import runpy
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from column_store import materialize
+from data_loader import BASE_DIR, CACHE_DIR, DATA_PATH, dataset_fingerprint
+from exports import FORMATS_ENV, export_formats
+from resampling import resample_count
+from sampling import sample_settings
+from segmentation import segment_mode
+from sketches import approximate
+from typed_table import COLUMN_STORE_ENV
+from workers import WORKERS_ENV, stage_budget
+
+# Dependency-aware runner for the analysis scripts. Each stage declares the
+# files it reads and writes; stages whose inputs, code and output settings
+# (see settings()) are unchanged since their last successful run are skipped,
+# and independent stages run concurrently in a process pool. Each stage process gets an equal share of
+# the cores for the pools it starts itself (see workers.py).
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(CACHE_DIR, 'pipeline_state.json')
+
+# Shared modules every dataset stage imports; editing one invalidates them all
+LIBRARY_MODULES = ['data_loader.py', 'typed_table.py', 'aggregate_cache.py', 'groupby_engine.py', 'metrics.py',
+                   'sharded.py', 'column_store.py', 'partitions.py',
+                   'cube.py', 'exports.py', 'segmentation.py', 'sparse_pivot.py',
+                   'sketches.py', 'sampling.py', 'resampling.py',
+                   'figures.py', 'plot_summaries.py', 'workers.py']
+
+FIGURES = 'reports/figures'
+PRESENTATION_FIGURES = 'reports/figures/presentation'
+POWERBI = 'reports/powerbi'
+
+
+class Stage:
+    def __init__(self, name, script, outputs, inputs=(DATA_PATH,), modules=LIBRARY_MODULES):
+        self.name = name
+        self.script = script
+        self.inputs = [_resolve(p) for p in inputs]
+        self.outputs = [_resolve(p) for p in outputs]
+        self.code = [_resolve(p) for p in [script] + list(modules)]
+
+
+def _resolve(path):
+    return path if os.path.isabs(path) else os.path.join(ANALYSIS_DIR, path)
+
+
+STAGES = [
+    Stage('campaign_analysis', 'campaign_analysis.py', [
+        f'{FIGURES}/campaign_roi_by_channel.png',
+        f'{FIGURES}/cpa_by_channel.png',
+        f'{FIGURES}/discount_impact.png',
+    ]),
+    Stage('campaign_comparison', 'campaign_comparison.py', [
+        f'{FIGURES}/campaign_comparison.png',
+    ]),
+    Stage('customer_segmentation', 'customer_segmentation_analysis.py', [
+        f'{FIGURES}/cltv_distribution.png',
+        f'{FIGURES}/silhouette_score.png',
+        f'{FIGURES}/campaign_response.png',
+    ]),
+    Stage('product_bundle', 'product_bundle_analysis.py', [
+        f'{FIGURES}/bundle_performance.png',
+        f'{FIGURES}/discount_correlation.png',
+        f'{FIGURES}/elbow_method.png',
+        f'{FIGURES}/bundle_clusters.png',
+    ]),
+    Stage('stakeholder_visuals', 'stakeholder_visuals.py', [
+        f'{PRESENTATION_FIGURES}/trend_plots.png',
+        f'{PRESENTATION_FIGURES}/customer_map.png',
+        f'{PRESENTATION_FIGURES}/segmentation_charts.png',
+        f'{PRESENTATION_FIGURES}/kpi_bars.png',
+    ]),
+    Stage('powerbi_data', 'prepare_powerbi_data.py', [
+        f'{POWERBI}/campaign_metrics.csv',
+        f'{POWERBI}/bundle_metrics.csv',
+        f'{POWERBI}/customer_metrics.csv',
+        f'{POWERBI}/monthly_trends.csv',
+    ]),
+    Stage('campaign_page', 'prepare_campaign_page.py', [
+        f'{POWERBI}/campaigns/campaign_metrics.csv',
+        f'{POWERBI}/campaigns/channel_efficiency.csv',
+    ]),
+    Stage('bundle_page', 'prepare_bundle_page.py', [
+        f'{POWERBI}/bundles/bundle_metrics.csv',
+        f'{POWERBI}/bundles/bundle_category_metrics.csv',
+    ]),
+    Stage('segmentation_page', 'prepare_segmentation_page.py', [
+        f'{POWERBI}/segmentation/customer_metrics.csv',
+        f'{POWERBI}/segmentation/churn_risk.csv',
+    ]),
+    Stage('trends_page', 'prepare_trends_page.py', [
+        f'{POWERBI}/trends/monthly_trends.csv',
+        f'{POWERBI}/trends/discount_analysis.csv',
+        f'{POWERBI}/trends/campaign_trends.csv',
+    ]),
+    Stage('presentation', 'create_presentation.py',
+          [os.path.join(BASE_DIR, 'reports', 'presentations', 'marketing_analysis.pptx')],
+          inputs=[f'{PRESENTATION_FIGURES}/trend_plots.png',
+                  f'{PRESENTATION_FIGURES}/customer_map.png',
+                  f'{PRESENTATION_FIGURES}/segmentation_charts.png',
+                  f'{PRESENTATION_FIGURES}/kpi_bars.png'],
+          modules=[]),
+    Stage('executive_summary', 'generate_executive_summary.py',
+          ['reports/executive_summary.pdf'],
+          inputs=[f'{FIGURES}/campaign_comparison.png'],
+          modules=[]),
+]
+
+
+def _hash_file(path):
+    if os.path.abspath(path) == os.path.abspath(DATA_PATH):
+        return dataset_fingerprint(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def module_hashes(modules=LIBRARY_MODULES):
+    """Content hash of each shared library module, by file name."""
+    return {name: _hash_file(_resolve(name)) for name in modules}
+
+
+def settings():
+    """Settings outside the code and inputs that change what the stages write."""
+    return {
+        'formats': export_formats(),
+        # Estimated outputs must not pass for exact ones, or the reverse
+        'approximate': approximate(),
+        'segment_mode': segment_mode(),
+        'sample': sample_settings(),
+        'resamples': resample_count(),
+    }
+
+
+def signature(stage):
+    digest = hashlib.sha256()
+    for path in stage.code + stage.inputs:
+        digest.update(os.path.relpath(path, BASE_DIR).encode())
+        digest.update(_hash_file(path).encode())
+    digest.update(json.dumps(settings(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def dependencies(stages):
+    producers = {out: s.name for s in stages for out in s.outputs}
+    deps = {}
+    for stage in stages:
+        deps[stage.name] = {producers[p] for p in stage.inputs if p in producers}
+        missing = [p for p in stage.inputs if p not in producers and not os.path.exists(p)]
+        if missing:
+            raise FileNotFoundError(f"Stage '{stage.name}' needs {missing}, which no stage produces")
+    return deps
+
+
+def select(names):
+    """Requested stages plus everything upstream of them."""
+    by_name = {s.name: s for s in STAGES}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        raise KeyError(f"Unknown stage(s): {', '.join(unknown)}")
+    deps = dependencies(STAGES)
+    wanted, todo = set(), list(names) or list(by_name)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return [s for s in STAGES if s.name in wanted]
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(STATE_PATH + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(STATE_PATH + '.tmp', STATE_PATH)
+
+
+def is_stale(stage, state):
+    if any(not os.path.exists(p) for p in stage.outputs):
+        return True
+    return state.get(stage.name) != signature(stage)
+
+
+def stage_defaults(workers):
+    """Settings every stage process runs with unless they are set explicitly."""
+    os.environ.setdefault(WORKERS_ENV, str(workers))
+
+
+def _init_worker(workers):
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    stage_defaults(workers)
+    os.chdir(ANALYSIS_DIR)
+    if ANALYSIS_DIR not in sys.path:
+        sys.path.insert(0, ANALYSIS_DIR)
+
+
+def run_script(script, column_store=None):
+    start = time.time()
+    if column_store:
+        os.environ[COLUMN_STORE_ENV] = column_store
+    runpy.run_path(os.path.join(ANALYSIS_DIR, script), run_name='__main__')
+    return time.time() - start
+
+
+def run(names=(), force=False, jobs=None, dry_run=False):
+    stages = select(names)
+    deps = {name: d & {s.name for s in stages} for name, d in dependencies(stages).items()}
+    state = load_state()
+    pending = {s.name: s for s in stages}
+    done, failed, rerun = set(), set(), set()
+    running = {}
+    store = None
+
+    jobs = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(stage_budget(jobs),)) as pool:
+        while pending or running:
+            scheduled = len(pending)
+            for name, stage in list(pending.items()):
+                if deps[name] & failed:
+                    print(f"[skip] {name}: upstream stage failed")
+                    failed.add(name)
+                    del pending[name]
+                elif deps[name] <= done:
+                    del pending[name]
+                    if not force and not (dry_run and deps[name] & rerun) and not is_stale(stage, state):
+                        print(f"[fresh] {name}")
+                        done.add(name)
+                    elif dry_run:
+                        print(f"[stale] {name}")
+                        rerun.add(name)
+                        done.add(name)
+                    else:
+                        print(f"[run] {name}")
+                        if store is None and DATA_PATH in stage.inputs:
+                            # Materialized once; every stage process maps the same files
+                            store = materialize()
+                        running[pool.submit(run_script, stage.script, store)] = stage
+            if not running:
+                if pending and len(pending) == scheduled:
+                    raise RuntimeError(f"Dependency cycle among stages: {sorted(pending)}")
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    elapsed = future.result()
+                except BaseException as exc:
+                    print(f"[fail] {stage.name}: {exc!r}")
+                    failed.add(stage.name)
+                    state.pop(stage.name, None)
+                    continue
+                missing = [p for p in stage.outputs if not os.path.exists(p)]
+                if missing:
+                    print(f"[fail] {stage.name}: did not write {missing}")
+                    failed.add(stage.name)
+                    continue
+                print(f"[done] {stage.name} ({elapsed:.1f}s)")
+                state[stage.name] = signature(stage)
+                done.add(stage.name)
+            if not dry_run:
+                save_state(state)
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the analysis pipeline, skipping stages that are up to date.')
+    parser.add_argument('stages', nargs='*', help='stages to bring up to date (default: all)')
+    parser.add_argument('--force', action='store_true', help='rerun stages even if they are up to date')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help='worker processes per large aggregation inside each stage (default: 1)')
+    parser.add_argument('--formats', default=None,
+                        help="comma-separated Power BI export formats, e.g. 'csv,parquet' (default: csv)")
+    parser.add_argument('--dry-run', action='store_true', help='only report which stages are stale')
+    parser.add_argument('--list', action='store_true', help='list stages and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for stage in STAGES:
+            print(stage.name)
+        return
+    if args.shards:
+        # Read by aggregate_cache when the stage processes import it
+        os.environ['ANALYSIS_SHARDS'] = str(args.shards)
+    if args.formats:
+        os.environ[FORMATS_ENV] = args.formats
+    sys.exit(0 if run(args.stages, args.force, args.jobs, args.dry_run) else 1)
+
+
+if __name__ == '__main__':
+    main()
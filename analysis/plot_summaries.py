@@ -0,0 +1,149 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from matplotlib.colors import to_rgba
+from scipy.signal import fftconvolve
+
+# Aggregate-first plotting. Distribution charts are drawn from compact
+# summaries instead of raw values, so rendering costs the same for a thousand
+# rows or a billion:
+#
+#   histogram_summary   fixed-width histogram, REFINE fine bins per display
+#                       bin, built in one chunked pass; the display bars sum
+#                       the fine bins and the KDE is the fine counts convolved
+#                       with a Gaussian kernel by FFT (binned KDE)
+#   box_summary         quartiles, whisker ends and at most MAX_FLIERS
+#                       outliers per group, as matplotlib's bxp() draws them
+#
+# Like seaborn's histplot(kde=True), the KDE uses Scott's bandwidth, is cut at
+# the data range and is scaled to the bar counts.
+
+REFINE = 8
+MAX_FLIERS = 50
+CHUNK_ROWS = 1_000_000
+BOX_STATS = ['whislo', 'q1', 'med', 'q3', 'whishi']
+
+
+def histogram_summary(values, bins=50, refine=REFINE, chunk_rows=CHUNK_ROWS):
+    """Left, Right and Count of bins * refine equal-width bins over the range of the values."""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    low, high = (values.min(), values.max()) if len(values) else (0.0, 1.0)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    n_bins = bins * refine
+    counts = np.zeros(n_bins)
+    for start in range(0, len(values), chunk_rows):
+        chunk = values[start:start + chunk_rows]
+        # The last bin is closed, as in np.histogram
+        index = np.minimum(((chunk - low) / (high - low) * n_bins).astype(np.int64), n_bins - 1)
+        counts += np.bincount(index, minlength=n_bins)
+    edges = np.linspace(low, high, n_bins + 1)
+    return pd.DataFrame({'Left': edges[:-1], 'Right': edges[1:], 'Count': counts})
+
+
+def sketch_histogram_summary(sketch, bins=50, refine=REFINE):
+    """histogram_summary() of the values behind a KLL sketch."""
+    counts, edges = sketch.histogram(bins * refine)
+    return pd.DataFrame({'Left': edges[:-1], 'Right': edges[1:], 'Count': counts})
+
+
+def coarsen(summary, bins):
+    """(counts, edges) of the display histogram with `bins` bars."""
+    refine = len(summary) // bins
+    counts = summary['Count'].to_numpy().reshape(bins, refine).sum(axis=1)
+    edges = np.append(summary['Left'].to_numpy()[::refine], summary['Right'].iloc[-1])
+    return counts, edges
+
+
+def binned_kde(summary, bw_adjust=1.0):
+    """(centres, expected count per fine bin) of a Gaussian KDE of the binned values."""
+    centres = ((summary['Left'] + summary['Right']) / 2).to_numpy()
+    counts = summary['Count'].to_numpy(dtype=float)
+    n = counts.sum()
+    if n < 2:
+        return centres, np.full(len(centres), np.nan)
+    mean = (counts * centres).sum() / n
+    std = np.sqrt((counts * (centres - mean) ** 2).sum() / (n - 1))
+    bandwidth = std * n ** (-1 / 5) * bw_adjust
+    width = centres[1] - centres[0] if len(centres) > 1 else 1.0
+    if bandwidth <= 0:
+        return centres, counts
+    half = int(np.ceil(4 * bandwidth / width))
+    offsets = np.arange(-half, half + 1) * width
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    # Normalised to the continuous kernel's mass per fine bin, so mass
+    # smoothed past the data range is lost as with a truncated KDE
+    kernel *= width / (bandwidth * np.sqrt(2 * np.pi))
+    return centres, np.maximum(fftconvolve(counts, kernel, mode='same'), 0.0)
+
+
+def plot_histogram(summary, bins=50, kde=False, color=None, ax=None):
+    """Histogram bars (and KDE curve) from a histogram_summary(), like sns.histplot(bins=bins, kde=kde)."""
+    ax = ax or plt.gca()
+    color = color or 'C0'
+    counts, edges = coarsen(summary, bins)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', facecolor=to_rgba(color, 0.5 if kde else 0.75),
+           edgecolor=plt.rcParams['patch.edgecolor'], linewidth=0.5)
+    if kde:
+        centres, density = binned_kde(summary)
+        ax.plot(centres, density * (len(summary) // bins), color=color)
+    return ax
+
+
+def box_summary(frame, group, columns, max_fliers=MAX_FLIERS):
+    """Box-plot statistics of each column per group, in long form (Column, <group>, Stat, Value).
+
+    Stat is one of BOX_STATS, with 1.5 IQR whiskers as in seaborn and
+    matplotlib, or 'flier' for one of the (at most max_fliers) outliers
+    furthest from the box.
+    """
+    rows = []
+    grouped = frame.groupby(group, observed=True, sort=True)
+    for col in columns:
+        quartiles = grouped[col].quantile([0.25, 0.5, 0.75]).unstack()
+        q1, med, q3 = (quartiles[q] for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        keys = frame[group]
+        values = frame[col]
+        low_fence = keys.map(q1 - 1.5 * iqr).astype(float)
+        high_fence = keys.map(q3 + 1.5 * iqr).astype(float)
+        inside = (values >= low_fence) & (values <= high_fence)
+        whislo = values[inside].groupby(keys[inside], observed=True).min()
+        whishi = values[inside].groupby(keys[inside], observed=True).max()
+        stats = pd.DataFrame({'whislo': whislo, 'q1': q1, 'med': med, 'q3': q3, 'whishi': whishi})
+        long = stats.rename_axis(group).reset_index().melt(id_vars=group, var_name='Stat', value_name='Value')
+        rows.append(long.assign(Column=col))
+
+        outside = frame.loc[~inside & values.notna(), [group, col]]
+        distance = np.maximum(outside[col] - outside[group].map(q3).astype(float),
+                              outside[group].map(q1).astype(float) - outside[col])
+        fliers = (outside.assign(distance=distance)
+                  .sort_values('distance', ascending=False, kind='stable')
+                  .groupby(group, observed=True).head(max_fliers))
+        rows.append(pd.DataFrame({group: fliers[group].to_numpy(), 'Stat': 'flier',
+                                  'Value': fliers[col].to_numpy(), 'Column': col}))
+    return pd.concat(rows, ignore_index=True)[['Column', group, 'Stat', 'Value']]
+
+
+def plot_boxes(summary, column, palette=None, ax=None):
+    """Box plot of one column of a box_summary(), one box per group, like sns.boxplot(x=group, y=column)."""
+    ax = ax or plt.gca()
+    group = summary.columns[1]
+    summary = summary[summary['Column'] == column]
+    groups = list(dict.fromkeys(summary[group]))
+    stats = []
+    for key in groups:
+        part = summary[summary[group] == key]
+        box = dict(zip(part['Stat'], part['Value']))
+        stats.append({'label': str(key), 'fliers': part.loc[part['Stat'] == 'flier', 'Value'].to_numpy(),
+                      **{stat: box[stat] for stat in BOX_STATS}})
+    colors = sns.color_palette(palette, len(groups), desat=0.75)
+    artists = ax.bxp(stats, positions=range(len(groups)), widths=0.8, patch_artist=True,
+                     medianprops={'color': '0.25'}, flierprops={'marker': 'd', 'markersize': 4})
+    for patch, color in zip(artists['boxes'], colors):
+        patch.set_facecolor(color)
+    ax.set_xlabel(group)
+    ax.set_ylabel(column)
+    return ax
@@ -1,36 +1,37 @@
-import pandas as pd
 import numpy as np
 import os
+from typed_table import load_table
+from aggregate_cache import aggregate
+from cube import Cube
+from exports import ExportBatch
 
 # Create Power BI data directory if it doesn't exist
 if not os.path.exists('reports/powerbi/bundles'):
     os.makedirs('reports/powerbi/bundles')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Bundle x discount slices roll up from the precomputed cube
+cube = Cube.build(table)
+# Tables are written together at the end; unchanged ones are not rewritten
+exports = ExportBatch('reports/powerbi/bundles')
 
 # 1. Bundle Performance Metrics
-bundle_metrics = df.groupby(['Bundle_ID', 'Discount_Level']).agg({
+# Bundle_Price is the realised revenue per unit; ROI and its category come
+# from the shared Bundle_ROI definition
+bundle_metrics = cube.compute_metrics(['Bundle_ID', 'Discount_Level'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
-
-# Calculate bundle-specific metrics
-bundle_metrics['Bundle_Price'] = bundle_metrics['Revenue_Generated'] / bundle_metrics['Units_Sold']
-bundle_metrics['ROI'] = ((bundle_metrics['Revenue_Generated'] - 
-                         (bundle_metrics['Discount_Level'] * bundle_metrics['Units_Sold'])) / 
-                         bundle_metrics['Revenue_Generated']) * 100
-
-# Add performance categories
-bundle_metrics['ROI_Category'] = pd.cut(
-    bundle_metrics['ROI'],
-    bins=[-np.inf, 0, 50, 100, np.inf],
-    labels=['< 0%', '0-50%', '50-100%', '> 100%']
-)
+}, ['Average_Revenue_per_Unit', 'Bundle_ROI', 'Bundle_ROI_Category']).rename(columns={
+    'Average_Revenue_per_Unit': 'Bundle_Price',
+    'Bundle_ROI': 'ROI',
+    'Bundle_ROI_Category': 'ROI_Category'
+})
 
 # Save bundle metrics
-bundle_metrics.to_csv('reports/powerbi/bundles/bundle_metrics.csv', index=False)
+exports.add('bundle_metrics', table.decode(bundle_metrics))
 
 # 2. Bundle Category Analysis
 # Create synthetic categories based on bundle IDs
@@ -40,13 +41,14 @@ categories = ['Premium', 'Standard', 'Basic'] * (len(unique_bundles) // 3 + 1)
 bundle_categories = dict(zip(unique_bundles, categories[:len(unique_bundles)]))
 
 df['Bundle_Category'] = df['Bundle_ID'].map(bundle_categories)
-bundle_category_metrics = df.groupby(['Bundle_Category', 'Bundle_ID']).agg({
+bundle_category_metrics = aggregate(table, ['Bundle_Category', 'Bundle_ID'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+})
 
 # Save bundle category metrics
-bundle_category_metrics.to_csv('reports/powerbi/bundles/bundle_category_metrics.csv', index=False)
+exports.add('bundle_category_metrics', table.decode(bundle_category_metrics))
+exports.write()
 
 print("Bundle page data preparation complete!")
@@ -1,66 +1,61 @@
-import pandas as pd
-import numpy as np
 import os
+from typed_table import load_table
+from partitions import aggregate_months, trends_range
+from metrics import compute_metrics
+from cube import Cube
+from exports import ExportBatch
 
 # Create Power BI data directory if it doesn't exist
 if not os.path.exists('reports/powerbi'):
     os.makedirs('reports/powerbi')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Campaign and bundle slices roll up from the precomputed cube
+cube = Cube.build(table)
+# Tables are written together at the end; unchanged ones are not rewritten
+exports = ExportBatch('reports/powerbi')
 
 # 1. Campaign Performance Data
-campaign_metrics = df.groupby(['Campaign_ID', 'Common_Keywords']).agg({
+campaign_metrics = cube.compute_metrics(['Campaign_ID', 'Common_Keywords'], {
     'Revenue_Generated': 'sum',
     'Budget': 'mean',
     'Clicks': 'sum',
     'Conversions': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+}, ['ROI', 'CPA'])
 
-campaign_metrics['ROI'] = (campaign_metrics['Revenue_Generated'] - campaign_metrics['Budget']) / campaign_metrics['Budget'] * 100
-campaign_metrics['CPA'] = campaign_metrics['Budget'] / campaign_metrics['Conversions']
-
-campaign_metrics.to_csv('reports/powerbi/campaign_metrics.csv', index=False)
+exports.add('campaign_metrics', table.decode(campaign_metrics))
 
 # 2. Bundle Analysis Data
-bundle_metrics = df.groupby(['Bundle_ID', 'Discount_Level']).agg({
+bundle_metrics = cube.compute_metrics(['Bundle_ID', 'Discount_Level'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
-
-bundle_metrics['ROI'] = ((bundle_metrics['Revenue_Generated'] - 
-                         (bundle_metrics['Discount_Level'] * bundle_metrics['Units_Sold'])) / 
-                         bundle_metrics['Revenue_Generated']) * 100
+}, ['Bundle_ROI']).rename(columns={'Bundle_ROI': 'ROI'})
 
-bundle_metrics.to_csv('reports/powerbi/bundle_metrics.csv', index=False)
+exports.add('bundle_metrics', table.decode(bundle_metrics))
 
 # 3. Customer Segmentation Data
-customer_metrics = df.groupby('Customer_ID').agg({
+customer_metrics = compute_metrics(table, 'Customer_ID', {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Subscription_Tier': 'first',
     'Subscription_Length': 'mean'
-}).reset_index()
+}, ['CLTV'])
 
-customer_metrics['CLTV'] = customer_metrics['Revenue_Generated'] * (1 + customer_metrics['Subscription_Length'])
-
-customer_metrics.to_csv('reports/powerbi/customer_metrics.csv', index=False)
+exports.add('customer_metrics', table.decode(customer_metrics))
 
 # 4. Monthly Trends Data
-# Create synthetic dates for analysis
-np.random.seed(42)
-dates = pd.date_range(start='2023-01-01', periods=len(df), freq='D')
-df['Date'] = np.random.choice(dates, len(df))
-df['Month'] = df['Date'].dt.to_period('M')
-
-monthly_trends = df.groupby(['Month', 'Discount_Level']).agg({
+# Read from the month partitions, limited to the trends range if one is set
+monthly_trends = aggregate_months(table, ['Month', 'Discount_Level'], {
     'Conversions': 'sum',
     'Revenue_Generated': 'sum'
-}).reset_index()
+}, *trends_range())
 
-monthly_trends.to_csv('reports/powerbi/monthly_trends.csv', index=False)
+exports.add('monthly_trends', monthly_trends)
+exports.write()
 
 print("Power BI data preparation complete!")
@@ -1,49 +1,36 @@
-import pandas as pd
 import numpy as np
 import os
-from sklearn.cluster import KMeans
-from sklearn.preprocessing import StandardScaler
+from typed_table import load_table
+from metrics import compute_metrics
+from segmentation import assign_segments, load_or_fit
+from exports import ExportBatch
 
 # Create Power BI data directory if it doesn't exist
 if not os.path.exists('reports/powerbi/segmentation'):
     os.makedirs('reports/powerbi/segmentation')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Tables are written together at the end; unchanged ones are not rewritten
+exports = ExportBatch('reports/powerbi/segmentation')
 
 # 1. Customer Segmentation
-customer_metrics = df.groupby('Customer_ID').agg({
+customer_metrics = compute_metrics(table, 'Customer_ID', {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Subscription_Tier': 'first',
     'Subscription_Length': 'mean'
-}).reset_index()
+}, ['CLTV'])
 
-customer_metrics['CLTV'] = customer_metrics['Revenue_Generated'] * (1 + customer_metrics['Subscription_Length'])
-
-# Prepare data for clustering
-segmentation_data = customer_metrics[['Revenue_Generated', 'Units_Sold', 
-                                     'Customer_Satisfaction_Post_Refund', 
-                                     'Subscription_Length']].copy()
-
-scaler = StandardScaler()
-scaled_data = scaler.fit_transform(segmentation_data)
-
-# Perform KMeans clustering
-kmeans = KMeans(n_clusters=4, random_state=42)
-customer_metrics['Segment'] = kmeans.fit_predict(scaled_data)
-
-# Add segment labels
-customer_metrics['Segment_Label'] = customer_metrics['Segment'].map({
-    0: 'High Value',
-    1: 'Loyal',
-    2: 'New',
-    3: 'Low Value'
-})
+# Score customers with the stored segmentation model (scaler, centroids and
+# segment names); it is refitted only when the customer features have drifted
+model = load_or_fit(customer_metrics, k=4, fingerprint=table.fingerprint)
+customer_metrics = assign_segments(customer_metrics, model)
 
 # Save customer metrics
-customer_metrics.to_csv('reports/powerbi/segmentation/customer_metrics.csv', index=False)
+exports.add('customer_metrics', table.decode(customer_metrics))
 
 # 2. Churn Risk Analysis
 # Create synthetic churn data
@@ -52,8 +39,7 @@ customer_metrics['Churn_Risk'] = np.random.choice([0, 1], size=len(customer_metr
                                                 p=[0.85, 0.15])
 
 # Save churn data
-customer_metrics[['Customer_ID', 'Segment', 'Segment_Label', 'Churn_Risk']].to_csv(
-    'reports/powerbi/segmentation/churn_risk.csv', index=False
-)
+exports.add('churn_risk', table.decode(customer_metrics[['Customer_ID', 'Segment', 'Segment_Label', 'Churn_Risk']]))
+exports.write()
 
 print("Segmentation page data preparation complete!")
@@ -1,42 +1,45 @@
 import pandas as pd
 import numpy as np
 import os
+from typed_table import load_table
+from partitions import aggregate_months, trends_range
+from exports import ExportBatch
 
 # Create Power BI data directory if it doesn't exist
 if not os.path.exists('reports/powerbi/trends'):
     os.makedirs('reports/powerbi/trends')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Tables are written together at the end; unchanged ones are not rewritten
+exports = ExportBatch('reports/powerbi/trends')
 
-# 1. Monthly Trends
-# Create synthetic dates
-np.random.seed(42)
-dates = pd.date_range(start='2023-01-01', periods=len(df), freq='D')
-df['Date'] = np.random.choice(dates, len(df))
-df['Month'] = df['Date'].dt.to_period('M')
-df['Year'] = df['Date'].dt.year
+# Months to report (ANALYSIS_TRENDS_START / ANALYSIS_TRENDS_END, default: all);
+# only the month partitions in this range are read
+start, end = trends_range()
 
+# 1. Monthly Trends
 # Monthly metrics
-monthly_trends = df.groupby(['Year', 'Month']).agg({
+monthly_trends = aggregate_months(table, ['Year', 'Month'], {
     'Revenue_Generated': 'sum',
     'Conversions': 'sum',
     'Clicks': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+}, start, end)
 
 # Add month name for better visualization
 monthly_trends['Month_Name'] = monthly_trends['Month'].dt.strftime('%B')
 
 # Save monthly trends
-monthly_trends.to_csv('reports/powerbi/trends/monthly_trends.csv', index=False)
+exports.add('monthly_trends', monthly_trends)
 
 # 2. Discount Analysis
-discount_analysis = df.groupby(['Discount_Level', 'Month']).agg({
+discount_analysis = aggregate_months(table, ['Discount_Level', 'Month'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+}, start, end)
 
 # Add discount categories
 discount_analysis['Discount_Category'] = pd.cut(
@@ -46,16 +49,17 @@ discount_analysis['Discount_Category'] = pd.cut(
 )
 
 # Save discount analysis
-discount_analysis.to_csv('reports/powerbi/trends/discount_analysis.csv', index=False)
+exports.add('discount_analysis', discount_analysis)
 
 # 3. Campaign Performance Over Time
-campaign_trends = df.groupby(['Campaign_ID', 'Month']).agg({
+campaign_trends = aggregate_months(table, ['Campaign_ID', 'Month'], {
     'Revenue_Generated': 'sum',
     'Conversions': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+}, start, end)
 
 # Save campaign trends
-campaign_trends.to_csv('reports/powerbi/trends/campaign_trends.csv', index=False)
+exports.add('campaign_trends', table.decode(campaign_trends))
+exports.write()
 
 print("Trends page data preparation complete!")
@@ -1,63 +1,72 @@
-import pandas as pd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
 import os
+from typed_table import load_table
+from aggregate_cache import aggregate
+from metrics import compute_metrics
+from segmentation import elbow_k, fit_predict, sweep_k
+from sparse_pivot import sparse_pivot
+from sketches import approx_top, approximate
+from sampling import describe, estimate_aggregate, sampling
+from figures import FigureSet
 
 # Create reports directory if it doesn't exist
 if not os.path.exists('reports/figures'):
     os.makedirs('reports/figures')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Charts are rendered together at the end; unchanged ones are not redrawn
+figures = FigureSet()
 
 # Bundle Performance Analysis
 print("\nBundle Performance Analysis:")
-bundle_metrics = df.groupby('Bundle_ID').agg({
+bundle_metrics = compute_metrics(table, 'Bundle_ID', {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Bundle_Price': 'mean',
     'Discount_Level': 'mean'
-}).reset_index()
-
-# Calculate additional metrics
-bundle_metrics['Average_Revenue_per_Unit'] = bundle_metrics['Revenue_Generated'] / bundle_metrics['Units_Sold']
-bundle_metrics['Profit_Margin'] = (bundle_metrics['Revenue_Generated'] - (bundle_metrics['Bundle_Price'] * bundle_metrics['Units_Sold'])) / bundle_metrics['Revenue_Generated']
+}, ['Average_Revenue_per_Unit', 'Profit_Margin'])
 
 # Plot bundle performance
-plt.figure(figsize=(12, 6))
-sns.scatterplot(data=bundle_metrics, x='Average_Revenue_per_Unit', y='Customer_Satisfaction_Post_Refund', 
-                size='Units_Sold', hue='Profit_Margin', palette='viridis', alpha=0.6)
-plt.title('Bundle Performance Analysis')
-plt.xlabel('Average Revenue per Unit ($)')
-plt.ylabel('Customer Satisfaction')
-plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-plt.tight_layout()
-plt.savefig('reports/figures/bundle_performance.png', dpi=300)
-plt.close()
+def plot_bundle_performance(data):
+    sns.scatterplot(data=data, x='Average_Revenue_per_Unit', y='Customer_Satisfaction_Post_Refund',
+                    size='Units_Sold', hue='Profit_Margin', palette='viridis', alpha=0.6)
+    plt.title('Bundle Performance Analysis')
+    plt.xlabel('Average Revenue per Unit ($)')
+    plt.ylabel('Customer Satisfaction')
+    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    plt.tight_layout()
+
+
+figures.add('reports/figures/bundle_performance.png', plot_bundle_performance,
+            bundle_metrics[['Average_Revenue_per_Unit', 'Customer_Satisfaction_Post_Refund', 'Units_Sold', 'Profit_Margin']])
 
 # Discount Impact Analysis
 print("\nDiscount Impact Analysis:")
-discount_impact = df.groupby(['Bundle_ID', 'Discount_Level']).agg({
+discount_impact = aggregate(table, ['Bundle_ID', 'Discount_Level'], {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+})
 
-# Create pivot table for visualization
-pivot = discount_impact.pivot_table(index='Bundle_ID', columns='Discount_Level',
-                                 values=['Revenue_Generated', 'Units_Sold', 'Customer_Satisfaction_Post_Refund'])
+# Create pivot table for visualization; each bundle sells at few discount
+# levels, so the pivot is kept sparse and correlated over shared rows only
+pivot = sparse_pivot(discount_impact, 'Bundle_ID', 'Discount_Level',
+                     ['Revenue_Generated', 'Units_Sold', 'Customer_Satisfaction_Post_Refund'])
 
 # Plot correlation heatmap
-plt.figure(figsize=(12, 8))
-sns.heatmap(pivot.corr(), annot=True, cmap='coolwarm', center=0)
-plt.title('Correlation between Discount Level and Bundle Performance Metrics')
-plt.tight_layout()
-plt.savefig('reports/figures/discount_correlation.png', dpi=300)
-plt.close()
+def plot_discount_correlation(data):
+    sns.heatmap(data, annot=True, cmap='coolwarm', center=0)
+    plt.title('Correlation between Discount Level and Bundle Performance Metrics')
+    plt.tight_layout()
+
+
+figures.add('reports/figures/discount_correlation.png', plot_discount_correlation, pivot.corr(), figsize=(12, 8))
 
 # Bundle Clustering
 print("\nBundle Clustering Analysis:")
@@ -66,38 +75,47 @@ scaler = StandardScaler()
 scaled_data = scaler.fit_transform(cluster_data)
 
 # Determine optimal number of clusters
-wcss = []
-for i in range(1, 11):
-    kmeans = KMeans(n_clusters=i, init='k-means++', random_state=42)
-    kmeans.fit(scaled_data)
-    wcss.append(kmeans.inertia_)
-
-plt.figure(figsize=(10, 6))
-plt.plot(range(1, 11), wcss, marker='o')
-plt.title('Elbow Method')
-plt.xlabel('Number of Clusters')
-plt.ylabel('WCSS')
-plt.savefig('reports/figures/elbow_method.png', dpi=300)
-plt.close()
-
-# Apply KMeans with optimal number of clusters
-optimal_clusters = 4
-kmeans = KMeans(n_clusters=optimal_clusters, init='k-means++', random_state=42)
-bundle_metrics['Cluster'] = kmeans.fit_predict(scaled_data)
+sweep = sweep_k(scaled_data, range(1, 11), with_silhouette=False)
+
+def plot_elbow(data):
+    plt.plot(data['k'], data['inertia'], marker='o')
+    plt.title('Elbow Method')
+    plt.xlabel('Number of Clusters')
+    plt.ylabel('WCSS')
+
+
+figures.add('reports/figures/elbow_method.png', plot_elbow, sweep[['k', 'inertia']], figsize=(10, 6))
+
+# Apply KMeans with the number of clusters at the elbow of the WCSS curve
+optimal_clusters = elbow_k(sweep['k'], sweep['inertia'])
+bundle_metrics['Cluster'] = fit_predict(scaled_data, optimal_clusters)
 
 # Visualize clusters
-plt.figure(figsize=(12, 6))
-sns.scatterplot(data=bundle_metrics, x='Revenue_Generated', y='Customer_Satisfaction_Post_Refund',
-                hue='Cluster', palette='tab10', style='Cluster',
-                size='Units_Sold', alpha=0.7)
-plt.title('Bundle Performance Clusters')
-plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-plt.tight_layout()
-plt.savefig('reports/figures/bundle_clusters.png', dpi=300)
-plt.close()
+def plot_bundle_clusters(data):
+    sns.scatterplot(data=data, x='Revenue_Generated', y='Customer_Satisfaction_Post_Refund',
+                    hue='Cluster', palette='tab10', style='Cluster',
+                    size='Units_Sold', alpha=0.7)
+    plt.title('Bundle Performance Clusters')
+    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    plt.tight_layout()
+
+
+figures.add('reports/figures/bundle_clusters.png', plot_bundle_clusters,
+            bundle_metrics[['Revenue_Generated', 'Customer_Satisfaction_Post_Refund', 'Cluster', 'Units_Sold']])
+figures.render()
 
 # Key Insights
 print("\nKey Insights:")
-print(f"Top Performing Bundles: {bundle_metrics.sort_values('Revenue_Generated', ascending=False).head(5)['Bundle_ID'].tolist()}")
-print(f"Optimal Discount Range: {df.groupby('Discount_Level')['Units_Sold'].sum().idxmax()}")
+if approximate():
+    # Space-Saving heavy hitters over the transactions, merged chunk by chunk
+    top_bundles = approx_top(df, 'Bundle_ID', 'Revenue_Generated', 5)['Bundle_ID']
+else:
+    top_bundles = bundle_metrics.sort_values('Revenue_Generated', ascending=False).head(5)['Bundle_ID']
+print(f"Top Performing Bundles: {table.labels('Bundle_ID', top_bundles)}")
+# Per-discount totals can be estimated from a stratified sample; the
+# bundle-level tables above need every bundle and stay exact
+units_by_discount = estimate_aggregate(table, 'Discount_Level', {'Units_Sold': 'sum'})
+print(f"Optimal Discount Range: {units_by_discount.set_index('Discount_Level')['Units_Sold'].idxmax()}")
 print(f"Average Profit Margin: {bundle_metrics['Profit_Margin'].mean():.2%}")
+if sampling():
+    print(describe(units_by_discount))
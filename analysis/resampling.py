@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from metrics import evaluate, metric_spec
+from workers import worker_budget
+
+# Batched bootstrap and permutation tests for group comparisons. Statistics
+# are metrics over per-group sums (ROI, CPA, CTR, or plain sums and means), so
+# a batch of resamples is a (resamples x rows) index or label matrix reduced
+# to (resamples x groups) sums in one NumPy call per column; the metric
+# formulas then run once over the whole batch. Batches are bounded to
+# CHUNK_CELLS matrix cells and spread over ANALYSIS_RESAMPLE_JOBS processes
+# (default: the shared budget, see workers.py), each with its own child seed, so results do not
+# depend on the number of processes.
+#
+#   bootstrap     rows resampled with replacement within each group:
+#                 percentile interval of each group's statistic
+#   permutation   group labels shuffled across all rows: two-sided p-value
+#                 of each group's difference from the rest of the rows
+#
+# With many groups, p-values are adjusted with Holm (family-wise error) or
+# Benjamini-Hochberg (false discovery rate).
+
+RESAMPLE_JOBS_ENV = 'ANALYSIS_RESAMPLE_JOBS'
+RESAMPLES_ENV = 'ANALYSIS_RESAMPLES'
+# One default however the scripts are launched; the smallest p-value it can
+# report is 1 / 2001, still significant after Holm over a few dozen tests
+DEFAULT_RESAMPLES = 2_000
+CHUNK_CELLS = 1 << 22
+CORRECTIONS = ('holm', 'fdr_bh', 'none')
+
+# Set in each worker process by _init_worker
+_state = None
+
+
+class _Problem:
+    """Rows sorted by group, the sums each statistic needs, and how to evaluate them."""
+
+    def __init__(self, frame, group, spec, metrics):
+        full_spec, self.helper_columns = metric_spec(spec, metrics)
+        for col, func in full_spec.items():
+            if func not in ('sum', 'mean'):
+                raise ValueError(f"Resampled statistics support sum and mean, not '{func}' for {col}")
+        codes, self.labels = pd.factorize(frame[group], sort=True)
+        keep = codes >= 0
+        order = np.argsort(codes[keep], kind='stable')
+        self.codes = codes[keep][order]
+        self.sizes = np.bincount(self.codes, minlength=len(self.labels))
+        self.starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        self.spec = full_spec
+        self.metrics = list(metrics)
+        self.columns = {}
+        for col in full_spec:
+            values = frame[col].to_numpy(dtype=float)[keep][order]
+            valid = ~np.isnan(values)
+            # Without missing values every row counts, so counts are the group sizes
+            self.columns[col] = (np.where(valid, values, 0.0), None if valid.all() else valid.astype(float))
+
+    @property
+    def statistics(self):
+        return self.metrics + [col for col in self.spec if col not in self.helper_columns]
+
+    def evaluate(self, sums):
+        """Statistics from {column: (sum, count)} arrays of any (matching) shape; returns (..., statistic)."""
+        shape = next(iter(sums.values()))[0].shape
+        frame = pd.DataFrame({col: (total / count if self.spec[col] == 'mean' else total).ravel()
+                              for col, (total, count) in sums.items()})
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frame = evaluate(frame, self.metrics)
+        return frame[self.statistics].to_numpy(dtype=float).reshape(shape + (len(self.statistics),))
+
+    def _group_sums(self, index=None):
+        """{column: (sum, count)} per group; with an index matrix, position j of
+        each resample holds row index[:, j] and belongs to the group of row j."""
+        sums = {}
+        for col, (values, valid) in self.columns.items():
+            taken = values if index is None else values[index]
+            total = np.add.reduceat(taken, self.starts, axis=-1)
+            if valid is None:
+                count = np.broadcast_to(self.sizes.astype(float), total.shape)
+            else:
+                count = np.add.reduceat(valid if index is None else valid[index], self.starts, axis=-1)
+            sums[col] = (total, count)
+        return sums
+
+    def _rest(self, sums):
+        grand = self._group_sums()
+        return {col: (grand[col][0].sum() - total, grand[col][1].sum() - count)
+                for col, (total, count) in sums.items()}
+
+    def bootstrap(self, size, rng):
+        # Each position draws a row of its own group: start + floor(u * group size)
+        n = len(self.codes)
+        starts, sizes = self.starts[self.codes], self.sizes[self.codes]
+        index = starts + (rng.random((size, n)) * sizes).astype(np.int64)
+        return self.evaluate(self._group_sums(index))
+
+    def permutation(self, size, rng):
+        # Shuffling which rows sit at each group's positions shuffles the labels
+        n = len(self.codes)
+        index = rng.permuted(np.broadcast_to(np.arange(n), (size, n)), axis=1)
+        sums = self._group_sums(index)
+        return self.evaluate(sums) - self.evaluate(self._rest(sums))
+
+    def difference(self):
+        sums = self._group_sums()
+        return self.evaluate(sums), self.evaluate(self._rest(sums))
+
+
+def resample_count():
+    """Resamples per test: ANALYSIS_RESAMPLES, else DEFAULT_RESAMPLES."""
+    return int(os.environ.get(RESAMPLES_ENV, DEFAULT_RESAMPLES))
+
+
+def _init_worker(problem):
+    global _state
+    _state = problem
+
+
+def _run_chunk(kind, size, seed):
+    rng = np.random.default_rng(seed)
+    return getattr(_state, kind)(size, rng)
+
+
+def _resample(problem, kind, n_resamples, seed, jobs):
+    size = max(1, min(n_resamples, CHUNK_CELLS // max(len(problem.codes), 1)))
+    chunks = [min(size, n_resamples - start) for start in range(0, n_resamples, size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    jobs = min(worker_budget(jobs, RESAMPLE_JOBS_ENV), len(chunks))
+    if jobs <= 1:
+        _init_worker(problem)
+        results = [_run_chunk(kind, chunk, s) for chunk, s in zip(chunks, seeds)]
+    else:
+        # Forked workers share the parent's arrays instead of each unpickling a copy
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_init_worker,
+                                 initargs=(problem,)) as pool:
+            results = list(pool.map(_run_chunk, [kind] * len(chunks), chunks, seeds))
+    return np.concatenate(results, axis=0)
+
+
+def adjust_pvalues(pvalues, method='holm'):
+    """Multiple-comparison adjusted p-values: 'holm' (step-down, family-wise) or 'fdr_bh' (Benjamini-Hochberg)."""
+    p = np.asarray(pvalues, dtype=float)
+    if method == 'none' or p.size == 0:
+        return p.copy()
+    m = p.size
+    order = np.argsort(p, kind='stable')
+    ranked = p[order]
+    if method == 'holm':
+        adjusted = np.maximum.accumulate((m - np.arange(m)) * ranked)
+    elif method == 'fdr_bh':
+        adjusted = np.minimum.accumulate((m / np.arange(1, m + 1) * ranked)[::-1])[::-1]
+    else:
+        raise ValueError(f"Unknown correction '{method}', expected one of {CORRECTIONS}")
+    result = np.empty(m)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def resampling_tests(frame, group, spec=None, metrics=(), n_resamples=None, alpha=0.05, seed=42, jobs=None):
+    """Bootstrap interval and permutation p-value of every statistic for every group of one column.
+
+    One row per (group, statistic): the group's estimate with its
+    (1 - alpha) percentile interval, the same statistic over the rest of
+    the rows, their difference and its unadjusted permutation p-value.
+    """
+    n_resamples = n_resamples or resample_count()
+    problem = _Problem(frame, group, spec or {}, metrics)
+    estimate, rest = problem.difference()
+    boot = _resample(problem, 'bootstrap', n_resamples, seed, jobs)
+    null = _resample(problem, 'permutation', n_resamples, seed + 1, jobs)
+
+    low, high = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    observed = estimate - rest
+    # Ties count as extreme; the +1 keeps the p-value of a finite test above zero
+    extreme = (np.abs(null) >= np.abs(observed) * (1 - 1e-12)).sum(axis=0)
+    pvalues = (1 + extreme) / (1 + n_resamples)
+
+    statistics = problem.statistics
+    G, S = len(problem.labels), len(statistics)
+    return pd.DataFrame({
+        'Group': np.repeat(np.asarray(problem.labels), S),
+        'Statistic': np.tile(statistics, G),
+        'Estimate': estimate.ravel(),
+        'CI_Low': low.ravel(),
+        'CI_High': high.ravel(),
+        'Rest': rest.ravel(),
+        'Difference': observed.ravel(),
+        'P_Value': pvalues.ravel(),
+    })
+
+
+def compare_groups(frame, groups, spec=None, metrics=(), n_resamples=None, alpha=0.05,
+                   correction='holm', seed=42, jobs=None):
+    """resampling_tests() for each grouping column, with p-values adjusted over all tests together."""
+    tables = []
+    for offset, group in enumerate(groups):
+        result = resampling_tests(frame, group, spec, metrics, n_resamples, alpha, seed + 2 * offset, jobs)
+        result.insert(0, 'Dimension', group)
+        tables.append(result)
+    results = pd.concat(tables, ignore_index=True)
+    results['P_Adjusted'] = adjust_pvalues(results['P_Value'], correction)
+    results['Significant'] = results['P_Adjusted'] < alpha
+    return results
@@ -0,0 +1,252 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+
+from aggregate_cache import aggregate
+from metrics import compute_metrics, evaluate, metric_spec
+
+# Stratified-sample estimates for exploratory runs. Rows are sampled within
+# every channel x subscription tier x discount band stratum, each sampled row
+# stands for N_h / n_h rows of its stratum, and every estimate carries a
+# confidence interval from a stratified delete-a-group jackknife. Samples are
+# nested: a larger fraction keeps every row of a smaller one, so progressive
+# refinement only adds rows until the intervals are as tight as requested.
+#
+#   ANALYSIS_SAMPLE            fraction of each stratum to sample, e.g. 0.05
+#   ANALYSIS_SAMPLE_PRECISION  largest acceptable CI half-width relative to the
+#                              estimate, e.g. 0.02; the sample doubles until met
+#
+# Either variable switches the scripts that support it to sampled estimates.
+
+SAMPLE_ENV = 'ANALYSIS_SAMPLE'
+PRECISION_ENV = 'ANALYSIS_SAMPLE_PRECISION'
+DEFAULT_FRACTION = 0.01
+SAMPLE_SEED = 42
+REPLICATES = 20
+MIN_STRATUM_ROWS = 2
+GROWTH = 2
+CONFIDENCE = 0.95
+Z = stats.norm.ppf(0.5 + CONFIDENCE / 2)
+
+DISCOUNT_BINS = [0, 10, 20, 30, np.inf]
+STRATA = ['Common_Keywords', 'Subscription_Tier', 'Discount_Band']
+
+# Samplers by (dataset fingerprint, settings), oldest first
+CACHED_SAMPLERS = 2
+_samplers = {}
+
+
+def sample_settings():
+    """(fraction, precision) from the environment, or None when sampling is off."""
+    fraction = os.environ.get(SAMPLE_ENV, '')
+    precision = os.environ.get(PRECISION_ENV, '')
+    if not fraction and not precision:
+        return None
+    fraction = float(fraction) if fraction else DEFAULT_FRACTION
+    if not 0 < fraction <= 1:
+        raise ValueError(f'{SAMPLE_ENV} must be a fraction in (0, 1]')
+    return fraction, float(precision) if precision else None
+
+
+def sampling():
+    return sample_settings() is not None
+
+
+def strata_codes(frame):
+    bands = pd.cut(frame['Discount_Level'], bins=DISCOUNT_BINS, labels=False, include_lowest=True)
+    strata = pd.DataFrame({
+        'Common_Keywords': frame['Common_Keywords'],
+        'Subscription_Tier': frame['Subscription_Tier'],
+        'Discount_Band': bands,
+    })
+    return strata.groupby(STRATA, observed=True, dropna=False).ngroup().to_numpy()
+
+
+class Sample:
+    """Rows drawn from a table, with their weight in the full estimate and in each jackknife replicate."""
+
+    def __init__(self, rows, weights, fraction, population):
+        self.rows = rows
+        self.weights = weights          # (rows, 1 + replicates); column 0 is the full estimate
+        self.fraction = fraction
+        self.population = population
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class StratifiedSampler:
+    """Reproducible stratified samples of one table and the metric tables estimated from them.
+
+    Each row gets a seeded random priority; a sample of fraction f takes the
+    ceil(f * N_h) rows of highest priority in each stratum (at least
+    MIN_STRATUM_ROWS), so the draw is the same on every run and grows
+    monotonically with f.
+    """
+
+    def __init__(self, table, fraction=DEFAULT_FRACTION, precision=None, seed=SAMPLE_SEED, replicates=REPLICATES):
+        self.frame = getattr(table, 'frame', table)
+        self.fraction = fraction
+        self.precision = precision
+        self.replicates = replicates
+        self.codes = strata_codes(self.frame)
+        self.sizes = np.bincount(self.codes)
+        priority = np.random.default_rng(seed).random(len(self.frame))
+        order = np.lexsort((priority, self.codes))
+        starts = np.concatenate([[0], np.cumsum(self.sizes)[:-1]])
+        self.rank = np.empty(len(self.frame), dtype=np.int64)
+        self.rank[order] = np.arange(len(self.frame)) - np.repeat(starts, self.sizes)
+
+    def draw(self, fraction):
+        R = self.replicates
+        take = np.minimum(self.sizes, np.maximum(np.ceil(fraction * self.sizes), MIN_STRATUM_ROWS)).astype(np.int64)
+        rows = np.flatnonzero(self.rank < take[self.codes])
+        codes = self.codes[rows]
+        groups = self.rank[rows] % R
+        base = (self.sizes / take)[codes]
+
+        # Dropping replicate group g reweights the rest of its stratum by
+        # n_h / (n_h - n_hg); the deviation is shrunk by sqrt(1 - n_h / N_h)
+        # so the variance carries the finite-population correction, and
+        # fully sampled strata contribute none
+        in_group = np.bincount(codes * R + groups, minlength=len(self.sizes) * R).reshape(-1, R)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = take[:, None] / (take[:, None] - in_group)
+        replicate = base[:, None] * scale[codes]
+        replicate[np.arange(len(rows)), groups] = 0.0
+        shrink = np.sqrt(1 - take / self.sizes)[codes][:, None]
+        census = (take == self.sizes)[codes]
+        replicate[census] = base[census, None]
+        replicate = base[:, None] + shrink * (replicate - base[:, None])
+        return Sample(rows, np.column_stack([base, replicate]), fraction, len(self.frame))
+
+    def _weighted_aggregate(self, sample, keys, spec):
+        frame = self.frame.iloc[sample.rows]
+        grouped = frame.groupby(keys, observed=True, sort=True)
+        ids = grouped.ngroup().to_numpy()
+        groups = grouped.size().index.to_frame(index=False)
+        members = sparse.csr_matrix((np.ones(len(ids)), (ids, np.arange(len(ids)))), shape=(len(groups), len(ids)))
+        W = sample.weights
+        totals = {}
+        for col, func in spec.items():
+            if not isinstance(func, str):
+                raise ValueError('Sampled estimates take one aggregation per column')
+            values = frame[col].to_numpy(dtype=float)
+            valid = ~np.isnan(values)
+            weighted = members @ (W * np.where(valid, values, 0.0)[:, None])
+            count = members @ (W * valid[:, None])
+            if func == 'sum':
+                totals[col] = weighted
+            elif func == 'mean':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    totals[col] = weighted / count
+            elif func == 'count':
+                totals[col] = count
+            else:
+                raise ValueError(f"Sampled estimates support sum, mean and count, not '{func}'")
+
+        # Evaluate the metrics once over all replicates stacked
+        n_reps = W.shape[1]
+        stacked = groups.loc[np.tile(np.arange(len(groups)), n_reps)].reset_index(drop=True)
+        for col, values in totals.items():
+            stacked[col] = values.T.ravel()
+        return stacked, len(groups)
+
+    def estimate(self, keys, spec, metrics=(), fraction=None):
+        """compute_metrics() estimated from one sample, with a *_low / *_high interval per numeric column.
+
+        Groups with no sampled rows are missing from the result.
+        """
+        keys = [keys] if isinstance(keys, str) else list(keys)
+        sample = self.draw(self.fraction if fraction is None else fraction)
+        full_spec, helper_columns = metric_spec(spec, metrics)
+        stacked, n_groups = self._weighted_aggregate(sample, keys, full_spec)
+        stacked = evaluate(stacked, list(metrics)).drop(columns=helper_columns)
+
+        result = stacked.iloc[:n_groups].reset_index(drop=True)
+        R = self.replicates
+        for col in [c for c in result.columns if c not in keys]:
+            if not pd.api.types.is_numeric_dtype(result[col]):
+                continue
+            values = stacked[col].to_numpy(dtype=float).reshape(1 + R, n_groups)
+            variance = (R - 1) / R * ((values[1:] - values[0]) ** 2).sum(axis=0)
+            half_width = Z * np.sqrt(variance)
+            result[f'{col}_low'] = values[0] - half_width
+            result[f'{col}_high'] = values[0] + half_width
+        result.attrs['sample_rows'] = len(sample)
+        result.attrs['sample_fraction'] = sample.fraction
+        return result
+
+    def compute_metrics(self, keys, spec, metrics=(), targets=None):
+        """Estimate, growing the sample until every target column meets the precision (if one is set).
+
+        targets defaults to the metrics, or to the spec columns when there are none.
+        """
+        fraction = self.fraction
+        targets = list(targets or metrics or spec)
+        while True:
+            result = self.estimate(keys, spec, metrics, fraction)
+            if self.precision is None or fraction >= 1 or relative_error(result, targets) <= self.precision:
+                return result
+            fraction = min(fraction * GROWTH, 1.0)
+
+    def aggregate(self, keys, spec, targets=None):
+        return self.compute_metrics(keys, spec, (), targets)
+
+
+def relative_error(result, columns):
+    """Largest CI half-width relative to its estimate over the given columns (inf if any is undefined)."""
+    worst = 0.0
+    for col in columns:
+        if f'{col}_low' not in result:
+            continue
+        estimate = result[col].to_numpy(dtype=float)
+        half_width = (result[f'{col}_high'].to_numpy(dtype=float) - result[f'{col}_low'].to_numpy(dtype=float)) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(half_width == 0, 0.0, half_width / np.abs(estimate))
+        worst = max(worst, np.inf if np.isnan(ratio).any() else float(ratio.max(initial=0.0)))
+    return worst
+
+
+def sampler_for(table):
+    """The environment-configured sampler of a loaded table, or None when sampling is off.
+
+    Samplers are reused by dataset fingerprint and settings, not by table
+    object, since every load_table() returns a new one; only the last
+    CACHED_SAMPLERS are kept. Tables without a fingerprint are not cached.
+    """
+    settings = sample_settings()
+    if settings is None:
+        return None
+    fingerprint = getattr(table, 'fingerprint', None)
+    if fingerprint is None:
+        return StratifiedSampler(table, *settings)
+    key = (fingerprint, settings)
+    if key not in _samplers:
+        while len(_samplers) >= CACHED_SAMPLERS:
+            _samplers.pop(next(iter(_samplers)))
+        _samplers[key] = StratifiedSampler(table, *settings)
+    return _samplers[key]
+
+
+def estimate_metrics(table, keys, spec, metrics):
+    """compute_metrics(), or its sampled estimate with intervals when sampling is on."""
+    sampler = sampler_for(table)
+    if sampler is None:
+        return compute_metrics(table, keys, spec, metrics)
+    return sampler.compute_metrics(keys, spec, metrics)
+
+
+def estimate_aggregate(table, keys, spec):
+    """aggregate(), or its sampled estimate with intervals when sampling is on."""
+    sampler = sampler_for(table)
+    if sampler is None:
+        return aggregate(table, keys, spec)
+    return sampler.aggregate(keys, spec)
+
+
+def describe(result):
+    rows, fraction = result.attrs['sample_rows'], result.attrs['sample_fraction']
+    return f"Estimated from a stratified sample of {rows} rows ({fraction:.0%} of each stratum), with {CONFIDENCE:.0%} intervals"
@@ -0,0 +1,508 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CACHE_DIR
+from workers import worker_budget
+
+# KMeans fitting shared by the segmentation scripts. The default 'full' mode
+# is the plain full-batch KMeans the scripts have always used; 'minibatch'
+# seeds k-means++ on a sample of the customers and then refines the centroids
+# with mini-batch updates under an iteration and wall-clock budget, so the
+# cost no longer grows with passes over the whole customer base.
+#
+# Model selection sweeps candidate k values in parallel processes. Silhouette
+# is computed in fixed-size tiles of query x reference rows whose per-cluster
+# distance sums are accumulated, so its memory does not grow with the number
+# of customers, and beyond SILHOUETTE_SAMPLE
+# rows it is estimated from a label-stratified sample (each sampled point is
+# still scored against every row) with a normal confidence interval.
+#
+# A fitted segmentation is persisted as a SegmentModel (scaler, centroids,
+# feature spec, segment names and the fingerprint of the data it was fitted
+# on) and reused to score customers in chunks. It is refitted only when the
+# customer features drift beyond DRIFT_THRESHOLD from the fitted data.
+# OnlineSegments keeps a model current between fits: it holds every
+# customer's features and the running sum and count of each segment, and
+# reassigns only the customers a batch of new transactions touches.
+
+MODE_ENV = 'ANALYSIS_SEGMENT_MODE'
+MODES = ('full', 'minibatch')
+
+SEED_SAMPLE = 20_000      # customers used for k-means++ seeding
+BATCH_SIZE = 4096
+MAX_STEPS = 300           # mini-batch updates
+TIME_BUDGET = 30.0        # seconds per fit
+PATIENCE = 10             # steps without improvement before stopping
+
+SILHOUETTE_SAMPLE = 20_000    # rows scored exactly up to this size, sampled beyond it
+BLOCK_ROWS = 1024             # query rows per distance tile
+BLOCK_BYTES = 32 << 20        # size of one distance tile (query x reference rows, float64)
+SWEEP_JOBS_ENV = 'ANALYSIS_SWEEP_JOBS'
+
+MODEL_DIR = os.path.join(CACHE_DIR, 'segmentation')
+FEATURES = ['Revenue_Generated', 'Units_Sold', 'Customer_Satisfaction_Post_Refund', 'Subscription_Length']
+VALUE_FEATURES = ['Revenue_Generated', 'Units_Sold']
+TENURE_FEATURE = 'Subscription_Length'
+SCORE_CHUNK = 500_000
+# Largest tolerated shift of a feature's mean (in fitted standard deviations)
+# or log-ratio of its standard deviation before the model is refitted
+DRIFT_ENV = 'ANALYSIS_SEGMENT_DRIFT'
+DRIFT_THRESHOLD = 0.1
+# Batches between sequential-KMeans moves of the centroids to their members' mean
+CENTROID_INTERVAL = 5
+
+
+def segment_mode():
+    mode = os.environ.get(MODE_ENV, 'full')
+    if mode not in MODES:
+        raise ValueError(f"{MODE_ENV} must be one of {MODES}, not '{mode}'")
+    return mode
+
+
+def seed_centers(X, k, random_state=42, sample_size=SEED_SAMPLE):
+    """k-means++ initial centroids drawn from a random sample of the rows."""
+    from sklearn.cluster import kmeans_plusplus
+
+    rng = np.random.default_rng(random_state)
+    if len(X) > sample_size:
+        X = X[rng.choice(len(X), sample_size, replace=False)]
+    centers, _ = kmeans_plusplus(X, k, random_state=random_state)
+    return centers
+
+
+def fit_minibatch(X, k, random_state=42, batch_size=BATCH_SIZE, max_steps=MAX_STEPS,
+                  time_budget=TIME_BUDGET, patience=PATIENCE):
+    """MiniBatchKMeans seeded on a sample, stopped by step count, time budget or convergence."""
+    from sklearn.cluster import MiniBatchKMeans
+
+    X = np.asarray(X, dtype=float)
+    model = MiniBatchKMeans(n_clusters=k, init=seed_centers(X, k, random_state), n_init=1,
+                            batch_size=batch_size, random_state=random_state)
+    rng = np.random.default_rng(random_state)
+    deadline = time.monotonic() + time_budget
+    # Stop when the smoothed batch inertia has not improved for `patience`
+    # steps, as MiniBatchKMeans.fit does between full passes
+    smoothed, best, stalled = None, np.inf, 0
+    for step in range(max_steps):
+        batch = X[rng.integers(0, len(X), min(batch_size, len(X)))]
+        model.partial_fit(batch)
+        inertia = -model.score(batch) / len(batch)
+        smoothed = inertia if smoothed is None else 0.9 * smoothed + 0.1 * inertia
+        if smoothed < best:
+            best, stalled = smoothed, 0
+        else:
+            stalled += 1
+        if stalled >= patience or time.monotonic() > deadline:
+            break
+    model.n_steps_ = step + 1
+    return model
+
+
+def fit_kmeans(X, k, mode=None, random_state=42):
+    """Fitted KMeans-like model for k clusters in the configured segmentation mode."""
+    mode = mode or segment_mode()
+    if mode == 'minibatch':
+        return fit_minibatch(X, k, random_state)
+    from sklearn.cluster import KMeans
+    return KMeans(n_clusters=k, random_state=random_state).fit(X)
+
+
+def fit_predict(X, k, mode=None, random_state=42):
+    return fit_kmeans(X, k, mode, random_state).predict(X)
+
+
+def compare_models(X, model, reference):
+    """How closely model reproduces reference (e.g. the full-batch fit) on X.
+
+    Centroids are matched one-to-one to minimise their total distance, so
+    the numbers do not depend on how each fit happened to number clusters.
+    """
+    from scipy.optimize import linear_sum_assignment
+    from sklearn.metrics import adjusted_rand_score
+
+    X = np.asarray(X, dtype=float)
+    distances = np.linalg.norm(model.cluster_centers_[:, None, :] - reference.cluster_centers_[None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(distances)
+    labels, reference_labels = model.predict(X), reference.predict(X)
+    # Relabel model clusters to their matched reference clusters
+    matched = np.empty(len(rows), dtype=int)
+    matched[rows] = cols
+    inertia = ((X - model.cluster_centers_[labels]) ** 2).sum()
+    reference_inertia = ((X - reference.cluster_centers_[reference_labels]) ** 2).sum()
+    return {
+        'centroid_shift_max': float(distances[rows, cols].max()),
+        'centroid_shift_mean': float(distances[rows, cols].mean()),
+        'label_agreement': float((matched[labels] == reference_labels).mean()),
+        'adjusted_rand': float(adjusted_rand_score(reference_labels, labels)),
+        'inertia_ratio': float(inertia / reference_inertia) if reference_inertia else 1.0,
+    }
+
+
+def silhouette_values(X, labels, rows, block_rows=BLOCK_ROWS, block_bytes=BLOCK_BYTES):
+    """Exact silhouette of X[rows] against all of X, computed tile by tile.
+
+    Each tile holds the distances from up to block_rows query rows to as
+    many reference rows as fit in block_bytes, and its per-cluster sums are
+    accumulated, so memory stays bounded however many rows X has.
+    """
+    X = np.asarray(X, dtype=float)
+    labels = np.asarray(labels)
+    n_clusters = labels.max() + 1
+    sizes = np.bincount(labels, minlength=n_clusters).astype(float)
+    onehot = np.zeros((len(X), n_clusters))
+    onehot[np.arange(len(X)), labels] = 1.0
+    squared = (X ** 2).sum(axis=1)
+    values = np.empty(len(rows))
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        totals = np.zeros((len(block), n_clusters))
+        step = max(1, block_bytes // (8 * len(block)))
+        for ref in range(0, len(X), step):
+            stop = min(ref + step, len(X))
+            # One tile-sized buffer, updated in place
+            distances = X[block] @ X[ref:stop].T
+            distances *= -2
+            distances += squared[block, None]
+            distances += squared[None, ref:stop]
+            np.sqrt(np.maximum(distances, 0, out=distances), out=distances)
+            own_row = (block >= ref) & (block < stop)
+            distances[own_row, block[own_row] - ref] = 0.0
+            totals += distances @ onehot[ref:stop]
+        own = labels[block]
+        own_size = sizes[own] - 1
+        a = np.divide(totals[np.arange(len(block)), own], own_size, out=np.zeros(len(block)), where=own_size > 0)
+        means = totals / np.where(sizes > 0, sizes, np.nan)
+        means[np.arange(len(block)), own] = np.inf
+        b = np.nanmin(np.where(sizes > 0, means, np.inf), axis=1)
+        # Points alone in their cluster score 0, as in sklearn
+        values[start:start + len(block)] = np.where(own_size > 0, (b - a) / np.maximum(a, b), 0.0)
+    return values
+
+
+def silhouette(X, labels, sample_size=SILHOUETTE_SAMPLE, confidence=0.95, random_state=42):
+    """Mean silhouette with a confidence interval: (score, low, high).
+
+    Up to sample_size rows the score is exact and the interval has zero
+    width. Larger inputs are sampled in proportion to cluster size and the
+    interval comes from the stratified standard error.
+    """
+    from scipy.stats import norm
+
+    labels = np.asarray(labels)
+    if len(X) <= sample_size:
+        score = float(silhouette_values(X, labels, np.arange(len(X))).mean())
+        return score, score, score
+
+    rng = np.random.default_rng(random_state)
+    n_clusters = labels.max() + 1
+    sizes = np.bincount(labels, minlength=n_clusters)
+    quota = np.maximum(np.round(sample_size * sizes / len(X)).astype(int), np.minimum(sizes, 2))
+    strata = [rng.choice(np.flatnonzero(labels == c), quota[c], replace=False) for c in range(n_clusters) if quota[c]]
+    values = silhouette_values(X, labels, np.concatenate(strata))
+
+    score, variance, offset = 0.0, 0.0, 0
+    for rows in strata:
+        stratum = values[offset:offset + len(rows)]
+        offset += len(rows)
+        weight = sizes[labels[rows[0]]] / len(X)
+        score += weight * stratum.mean()
+        if len(rows) > 1:
+            fpc = 1 - len(rows) / sizes[labels[rows[0]]]
+            variance += weight ** 2 * stratum.var(ddof=1) / len(rows) * fpc
+    margin = norm.ppf(0.5 + confidence / 2) * np.sqrt(variance)
+    return float(score), float(score - margin), float(score + margin)
+
+
+# Customer matrix of a k sweep, set in each worker process by _init_sweep
+_sweep_X = None
+
+
+def _init_sweep(X):
+    global _sweep_X
+    _sweep_X = X
+
+
+def _evaluate_k(k, mode, random_state, with_silhouette):
+    X = _sweep_X
+    start = time.time()
+    model = fit_kmeans(X, k, mode, random_state)
+    labels = model.predict(X)
+    inertia = float(((X - model.cluster_centers_[labels]) ** 2).sum())
+    score = silhouette(X, labels, random_state=random_state) if with_silhouette and k > 1 else (np.nan,) * 3
+    return {'k': k, 'silhouette': score[0], 'silhouette_low': score[1], 'silhouette_high': score[2],
+            'inertia': inertia, 'seconds': time.time() - start}
+
+
+def sweep_k(X, ks, mode=None, jobs=None, random_state=42, with_silhouette=True):
+    """Silhouette (with interval), inertia and fit time for each candidate k, one row per k.
+
+    Candidates are fitted concurrently in up to ``jobs`` processes
+    (default: ANALYSIS_SWEEP_JOBS, else the shared budget of workers.py).
+    """
+    X = np.asarray(X, dtype=float)
+    ks = list(ks)
+    mode = mode or segment_mode()
+    jobs = worker_budget(jobs, SWEEP_JOBS_ENV)
+    jobs = min(jobs, len(ks))
+    if jobs <= 1:
+        _init_sweep(X)
+        rows = [_evaluate_k(k, mode, random_state, with_silhouette) for k in ks]
+    else:
+        # Forked workers share X with the parent instead of each unpickling a copy per k
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=_init_sweep,
+                                 initargs=(X,)) as pool:
+            futures = [pool.submit(_evaluate_k, k, mode, random_state, with_silhouette) for k in ks]
+            rows = [f.result() for f in futures]
+    return pd.DataFrame(rows)
+
+
+def elbow_k(ks, inertia):
+    """k at the elbow of an inertia curve: the point furthest below the chord joining its ends."""
+    ks = np.asarray(ks, dtype=float)
+    inertia = np.asarray(inertia, dtype=float)
+    if len(ks) < 3 or inertia[0] == inertia[-1]:
+        return int(ks[0])
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (inertia - inertia[-1]) / (inertia[0] - inertia[-1])
+    # The chord runs from (0, 1) to (1, 0); distance below it is 1 - x - y
+    return int(ks[np.argmax(1 - x - y)])
+
+
+def segment_names(centers, features):
+    """Name each centroid from its position rather than its cluster number.
+
+    Clusters are ranked by value (the scaled revenue and units of their
+    centroid): the top one is 'High Value' and the bottom one 'Low Value'.
+    The clusters in between are ranked by tenure, from 'Loyal' (longest
+    subscriptions) to 'New' (shortest); any further ones are 'Mid Value'.
+    """
+    value_cols = [features.index(f) for f in VALUE_FEATURES if f in features]
+    value = centers[:, value_cols].sum(axis=1)
+    by_value = list(np.argsort(-value, kind='stable'))
+    names = {by_value[0]: 'High Value'}
+    if len(by_value) > 1:
+        names[by_value[-1]] = 'Low Value'
+    middle = by_value[1:-1]
+    if TENURE_FEATURE in features:
+        tenure = centers[:, features.index(TENURE_FEATURE)]
+        middle = sorted(middle, key=lambda c: -tenure[c])
+    for rank, cluster in enumerate(middle):
+        if rank == 0:
+            names[cluster] = 'Loyal'
+        elif rank == len(middle) - 1:
+            names[cluster] = 'New'
+        else:
+            names[cluster] = f'Mid Value {rank}'
+    return [names[c] for c in range(len(centers))]
+
+
+class SegmentModel:
+    """Scaler, centroids and segment names of a fitted customer segmentation."""
+
+    def __init__(self, features, mean, scale, centers, names, fingerprint=None, stats=None, mode='full'):
+        self.features = list(features)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.cluster_centers_ = np.asarray(centers, dtype=float)
+        self.names = list(names)
+        self.fingerprint = fingerprint
+        self.stats = stats
+        self.mode = mode
+
+    @property
+    def k(self):
+        return len(self.cluster_centers_)
+
+    @classmethod
+    def fit(cls, customers, k, features=FEATURES, fingerprint=None, mode=None, random_state=42):
+        from sklearn.preprocessing import StandardScaler
+
+        mode = mode or segment_mode()
+        values = customers[features].to_numpy(dtype=float)
+        scaler = StandardScaler().fit(values)
+        model = fit_kmeans(scaler.transform(values), k, mode, random_state)
+        centers = model.cluster_centers_
+        return cls(features, scaler.mean_, scaler.scale_, centers, segment_names(centers, list(features)),
+                   fingerprint, feature_stats(values), mode)
+
+    def transform(self, values):
+        return (np.asarray(values, dtype=float) - self.mean) / self.scale
+
+    def predict(self, customers, chunk_rows=SCORE_CHUNK):
+        """Nearest-centroid segment of every customer, scored chunk_rows at a time."""
+        values = customers[self.features].to_numpy(dtype=float) if isinstance(customers, pd.DataFrame) \
+            else np.asarray(customers, dtype=float)
+        segments = np.empty(len(values), dtype=np.int32)
+        for start in range(0, len(values), chunk_rows):
+            segments[start:start + chunk_rows] = self.predict_scaled(self.transform(values[start:start + chunk_rows]))
+        return segments
+
+    def predict_scaled(self, scaled):
+        centers = self.cluster_centers_
+        # ||x - c||^2 without the ||x||^2 term, which is the same for every centroid
+        return np.argmin((centers ** 2).sum(axis=1) - 2 * scaled @ centers.T, axis=1)
+
+    def drift(self, customers):
+        """How far the customers' feature distribution is from the fitted one."""
+        if self.stats is None:
+            return np.inf
+        current = feature_stats(customers[self.features].to_numpy(dtype=float))
+        mean, std = np.array(self.stats['mean']), np.array(self.stats['std'])
+        std = np.where(std > 0, std, 1.0)
+        shift = np.abs(np.array(current['mean']) - mean) / std
+        spread = np.abs(np.log(np.maximum(current['std'], 1e-12) / std))
+        return float(max(shift.max(), spread.max()))
+
+    def to_dict(self):
+        return {'features': self.features, 'mean': self.mean.tolist(), 'scale': self.scale.tolist(),
+                'centers': self.cluster_centers_.tolist(), 'names': self.names,
+                'fingerprint': self.fingerprint, 'stats': self.stats, 'mode': self.mode}
+
+    def save(self, name):
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        path = os.path.join(MODEL_DIR, name + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, name):
+        try:
+            with open(os.path.join(MODEL_DIR, name + '.json')) as f:
+                return cls(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+
+def feature_stats(values):
+    values = np.asarray(values, dtype=float)
+    return {'rows': len(values), 'mean': values.mean(axis=0).tolist(), 'std': values.std(axis=0).tolist()}
+
+
+def load_or_fit(customers, name='customers', k=4, features=FEATURES, fingerprint=None, mode=None):
+    """The stored model when it still describes the customers, otherwise a fresh fit (saved)."""
+    mode = mode or segment_mode()
+    threshold = float(os.environ.get(DRIFT_ENV, DRIFT_THRESHOLD))
+    model = SegmentModel.load(name)
+    if model is not None and model.features == list(features) and model.k == k and model.mode == mode:
+        if fingerprint is not None and model.fingerprint == fingerprint:
+            return model
+        if model.drift(customers) <= threshold:
+            return model
+    model = SegmentModel.fit(customers, k, features, fingerprint, mode)
+    model.save(name)
+    return model
+
+
+def assign_segments(customers, model):
+    """Add Segment and Segment_Label columns from a fitted model."""
+    customers['Segment'] = model.predict(customers)
+    customers['Segment_Label'] = np.asarray(model.names, dtype=object)[customers['Segment'].to_numpy()]
+    return customers
+
+
+class OnlineSegments:
+    """Segment assignments kept current as customers' running features change.
+
+    ``features`` holds every customer's scaled features and ``segments`` their
+    segment, both indexed by Customer_ID; ``sums`` and ``counts`` are the
+    running totals of each segment's members. Every CENTROID_INTERVAL batches
+    the centroids move to their members' mean (sequential KMeans); customers
+    outside a batch keep their segment until they are next touched or the
+    model is refitted. Segment names stay those of the fitted model.
+    """
+
+    def __init__(self, model, features, segments, interval=CENTROID_INTERVAL):
+        self.model = model
+        self.features = features
+        self.segments = segments
+        self.interval = interval
+        self.batches = 0
+        self.sums = np.zeros_like(model.cluster_centers_)
+        self.counts = np.zeros(model.k)
+        np.add.at(self.sums, segments.to_numpy(), features.to_numpy())
+        np.add.at(self.counts, segments.to_numpy(), 1)
+
+    @classmethod
+    def start(cls, model, customers, interval=CENTROID_INTERVAL):
+        ids = pd.Index(customers['Customer_ID'])
+        scaled = model.transform(customers[model.features].to_numpy(dtype=float))
+        features = pd.DataFrame(scaled, index=ids, columns=model.features)
+        return cls(model, features, pd.Series(model.predict_scaled(scaled), index=ids), interval)
+
+    def update(self, customers):
+        """Reassign the given customers from their current features; adds Segment and Segment_Label."""
+        ids = pd.Index(customers['Customer_ID'])
+        scaled = self.model.transform(customers[self.model.features].to_numpy(dtype=float))
+
+        positions = self.segments.index.get_indexer(ids)
+        known = positions >= 0
+        # Take the customers' previous features out of their previous segments
+        old_segments = self.segments.to_numpy()[positions[known]]
+        np.subtract.at(self.sums, old_segments, self.features.to_numpy()[positions[known]])
+        np.subtract.at(self.counts, old_segments, 1)
+
+        segments = self.model.predict_scaled(scaled)
+        np.add.at(self.sums, segments, scaled)
+        np.add.at(self.counts, segments, 1)
+
+        self.features.iloc[positions[known]] = scaled[known]
+        self.segments.iloc[positions[known]] = segments[known]
+        if not known.all():
+            new_ids = ids[~known]
+            self.features = pd.concat([self.features, pd.DataFrame(scaled[~known], index=new_ids,
+                                                                   columns=self.model.features)])
+            self.segments = pd.concat([self.segments, pd.Series(segments[~known], index=new_ids)])
+
+        self.batches += 1
+        if self.batches % self.interval == 0:
+            filled = self.counts > 0
+            self.model.cluster_centers_[filled] = self.sums[filled] / self.counts[filled, None]
+
+        customers = customers.copy()
+        customers['Segment'] = segments.astype(np.int32)
+        customers['Segment_Label'] = np.asarray(self.model.names, dtype=object)[segments]
+        return customers
+
+
+def customer_matrix(table=None):
+    """Scaled per-customer features of the segmentation page."""
+    from sklearn.preprocessing import StandardScaler
+    from metrics import compute_metrics
+    from streaming import CUSTOMER_SPEC
+    from typed_table import load_table
+
+    customers = compute_metrics(table if table is not None else load_table(), 'Customer_ID', CUSTOMER_SPEC, ['CLTV'])
+    return StandardScaler().fit_transform(customers[FEATURES])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare mini-batch segmentation with the full-batch KMeans fit.')
+    parser.add_argument('--k', type=int, default=4, help='number of segments')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    X = customer_matrix()
+    start = time.time()
+    full = fit_kmeans(X, args.k, 'full')
+    full_time = time.time() - start
+    start = time.time()
+    mini = fit_kmeans(X, args.k, 'minibatch')
+    mini_time = time.time() - start
+
+    print(f"{len(X)} customers, k={args.k}")
+    print(f"full-batch: {full_time:.2f}s   mini-batch: {mini_time:.2f}s ({mini.n_steps_} steps)")
+    for name, value in compare_models(X, mini, full).items():
+        print(f"  {name}: {value:.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import compute_partials, merge_partials, remap_first_rows
+from column_store import attach, materialize, read_manifest, store_path
+from data_loader import dataset_fingerprint
+from typed_table import ID_COLUMNS
+
+# Hash-partitioned parallel aggregation. Rows are split across worker
+# processes by a hash of the grouping's entity key (Customer_ID, Campaign_ID,
+# Bundle_ID, ...), so every group lives in exactly one shard and the shard
+# results are simply concatenated. Groupings without an entity key, such as
+# per-channel totals, are split into row blocks and their per-shard partials
+# merged.
+#
+# When the rows are a loaded dataset version, workers are sent only the path
+# of its memory-mapped column store (see column_store.py) and their shard
+# number; each worker maps the columns read-only and selects its own rows, so
+# the data exists once in the page cache however many workers there are.
+# Other frames (with derived columns, or no fingerprint) are sent as pickled
+# shards.
+
+_pool = {'executor': None, 'jobs': None}
+# Column stores each worker process has mapped, by path
+_attached = {}
+
+
+def _executor(jobs):
+    if _pool['jobs'] != jobs:
+        if _pool['executor'] is not None:
+            _pool['executor'].shutdown()
+        _pool['executor'] = ProcessPoolExecutor(max_workers=jobs)
+        _pool['jobs'] = jobs
+    return _pool['executor']
+
+
+def shard_key(keys):
+    """The entity key to partition on, or None when groups span shards."""
+    return next((k for k in keys if k in ID_COLUMNS), None)
+
+
+def _buckets(frame, key, n_shards):
+    values = frame[key]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.codes
+    return pd.util.hash_array(values.to_numpy()) % np.uint64(n_shards)
+
+
+def shard_rows(frame, key, n_shards):
+    """Row positions of each shard; all rows of a key value land in the same shard."""
+    if key is None:
+        return [rows for rows in np.array_split(np.arange(len(frame)), n_shards) if len(rows)]
+    buckets = _buckets(frame, key, n_shards)
+    order = np.argsort(buckets, kind='stable')
+    bounds = np.searchsorted(buckets[order], np.arange(n_shards + 1, dtype=np.uint64))
+    return [order[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+
+
+def _shard_partials(shard, keys, partials, rows):
+    return remap_first_rows(compute_partials(shard, keys, partials), rows)
+
+
+def _store_shard_partials(store, columns, keys, partials, key, n_shards, shard):
+    if store not in _attached:
+        _attached[store] = attach(store).frame
+    frame = _attached[store]
+    if key is None:
+        # The same row blocks as shard_rows(), i.e. np.array_split
+        size, extra = divmod(len(frame), n_shards)
+        start = shard * size + min(shard, extra)
+        rows = np.arange(start, start + size + (shard < extra))
+    else:
+        rows = np.flatnonzero(_buckets(frame, key, n_shards) == np.uint64(shard))
+    if not len(rows):
+        return None
+    # Only this shard's rows of the needed columns are read from the mapping
+    part = frame.iloc[rows, frame.columns.get_indexer(columns)].reset_index(drop=True)
+    return _shard_partials(part, keys, partials, rows)
+
+
+def _column_store(fingerprint, columns, n_rows):
+    """Path of the column store holding these columns of this dataset version, or None."""
+    if fingerprint is None:
+        return None
+    path = store_path(fingerprint)
+    manifest = read_manifest(path)
+    if manifest is None:
+        if dataset_fingerprint() != fingerprint:
+            return None
+        # Written once per dataset version, then shared by every run's workers
+        path = materialize()
+        manifest = read_manifest(path)
+    stored = {entry['name'] for entry in manifest['columns']}
+    if manifest['rows'] != n_rows or not set(columns) <= stored:
+        return None
+    return path
+
+
+def sharded_partials(frame, keys, partials, jobs, fingerprint=None):
+    """Same result as ``compute_partials(frame, keys, partials)``, computed by ``jobs`` processes.
+
+    fingerprint is the dataset version frame was loaded from, if it is one
+    unchanged; its stored columns are then read by the workers themselves.
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    key = shard_key(keys)
+    if key is None and any(stat == 'nunique' for _, stat in partials):
+        # Distinct counts are only additive when no group spans two shards
+        return compute_partials(frame, keys, partials)
+
+    columns = list(dict.fromkeys(keys + [col for col, _ in partials if col in frame.columns]))
+    pool = _executor(jobs)
+    store = _column_store(fingerprint, columns, len(frame))
+    if store is not None:
+        futures = [pool.submit(_store_shard_partials, store, columns, keys, partials, key, jobs, shard)
+                   for shard in range(jobs)]
+    else:
+        futures = [pool.submit(_shard_partials, frame[columns].take(rows).reset_index(drop=True), keys, partials,
+                               rows) for rows in shard_rows(frame, key, jobs)]
+    parts = [part for part in (f.result() for f in futures) if part is not None]
+    if not parts:
+        return compute_partials(frame, keys, partials)
+    if key is None:
+        return merge_partials(parts, keys)
+    return pd.concat(parts, ignore_index=True).sort_values(keys, ignore_index=True)
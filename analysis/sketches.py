@@ -0,0 +1,298 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Mergeable sketches for the approximate analytics mode. Each sketch is built
+# from one chunk (or shard) of rows at a time and sketches of different
+# chunks merge into the sketch of their union, so a query over any number of
+# rows is one pass with bounded memory:
+#
+#   HyperLogLog   distinct counts         relative standard error 1.04 / sqrt(2^p)
+#   KLL           quantiles, histograms   rank error about 1.7 / k (k=200: under 1%)
+#   SpaceSaving   heavy hitters by weight overestimates each total by at most W / capacity
+#
+# ANALYSIS_APPROXIMATE=1 switches the scripts that support it to these
+# estimates; everything else is unaffected.
+
+APPROXIMATE_ENV = 'ANALYSIS_APPROXIMATE'
+CHUNK_ROWS = 250_000
+
+_POWERS_OF_TWO = np.uint64(1) << np.arange(64, dtype=np.uint64)
+
+
+def approximate():
+    return os.environ.get(APPROXIMATE_ENV, '0') not in ('', '0', 'false', 'no')
+
+
+def _chunks(n, chunk_rows=CHUNK_ROWS):
+    return (slice(start, min(start + chunk_rows, n)) for start in range(0, n, chunk_rows))
+
+
+def _hash(values):
+    values = values.to_numpy() if isinstance(values, pd.Series) else np.asarray(values)
+    return pd.util.hash_array(values)
+
+
+class HyperLogLog:
+    """Distinct-count sketch for n_groups groups at once (2^p one-byte registers per group).
+
+    The estimate has a relative standard error of about 1.04 / sqrt(2^p)
+    (p=12: 1.6%); small counts fall back to linear counting, which is close
+    to exact while most registers are still empty.
+    """
+
+    def __init__(self, p=12, n_groups=1):
+        if not 4 <= p <= 18:
+            raise ValueError('p must be between 4 and 18')
+        self.p = p
+        self.registers = np.zeros((n_groups, 1 << p), dtype=np.uint8)
+
+    def update(self, values, groups=None):
+        hashes = _hash(values)
+        bucket = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & ((np.uint64(1) << np.uint64(64 - self.p)) - np.uint64(1))
+        # Position of the first set bit among the remaining 64 - p bits
+        bit_length = np.searchsorted(_POWERS_OF_TWO, rest, side='right')
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        groups = np.zeros(len(hashes), dtype=np.int64) if groups is None else np.asarray(groups, dtype=np.int64)
+        np.maximum.at(self.registers, (groups, bucket), rank)
+        return self
+
+    def merge(self, other):
+        if other.registers.shape != self.registers.shape:
+            raise ValueError('Only sketches with the same p and groups can be merged')
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        """Estimated distinct count of each group."""
+        m = self.registers.shape[1]
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.power(2.0, -self.registers.astype(float)).sum(axis=1)
+        zeros = (self.registers == 0).sum(axis=1)
+        with np.errstate(divide='ignore'):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+class KLL:
+    """Quantile sketch: compactors of capacity shrinking by 2/3 per level below the top.
+
+    With k=200 the rank of a returned quantile is within about 1% of the
+    requested one (error scales as 1/k); min and max are kept exactly.
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min, self.max = np.inf, -np.inf
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        return max(int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))), 2)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.n += len(values)
+            self.min, self.max = min(self.min, values.min()), max(self.max, values.max())
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min, self.max = min(self.min, other.min), max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        while True:
+            # Adding a level shrinks every capacity below it, so rescan from the bottom
+            full = [level for level, items in enumerate(self.levels) if len(items) > self._capacity(level)]
+            if not full:
+                return
+            level = full[0]
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[level])
+            # An odd item out stays; of each sorted pair one survives at double weight
+            keep = items[:len(items) % 2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1],
+                                                     items[len(keep):][self.rng.integers(2)::2]])
+
+    def _weighted(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        values, cumulative = self._weighted()
+        if not len(values):
+            return np.full(len(np.atleast_1d(qs)), np.nan)
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        positions = np.searchsorted(cumulative, qs * cumulative[-1], side='left')
+        result = values[np.minimum(positions, len(values) - 1)]
+        result[qs <= 0] = self.min
+        result[qs >= 1] = self.max
+        return result
+
+    def cdf(self, points):
+        """Estimated fraction of values <= each point."""
+        values, cumulative = self._weighted()
+        positions = np.searchsorted(values, np.asarray(points, dtype=float), side='right')
+        ranks = np.where(positions > 0, cumulative[np.maximum(positions - 1, 0)], 0.0)
+        return ranks / cumulative[-1]
+
+    def histogram(self, bins=50):
+        """(counts, edges) over [min, max] like np.histogram, with counts from the sketch's CDF."""
+        edges = np.linspace(self.min, self.max, bins + 1)
+        below = self.cdf(edges[1:-1])
+        fractions = np.diff(np.concatenate([[0.0], below, [1.0]]))
+        return fractions * self.n, edges
+
+
+class SpaceSaving:
+    """Heavy hitters by total weight, keeping at most `capacity` counters.
+
+    Each reported total overestimates the true one by at most its `error`,
+    which never exceeds W / capacity for a stream of total weight W; any key
+    whose true total exceeds W / capacity is guaranteed to be kept.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=float)
+        self.errors = pd.Series(dtype=float)
+
+    @property
+    def floor(self):
+        """Upper bound on the total of any key not kept."""
+        return float(self.counts.min()) if len(self.counts) >= self.capacity else 0.0
+
+    def update(self, keys, weights=None):
+        weights = np.ones(len(keys)) if weights is None else np.asarray(weights, dtype=float)
+        exact = pd.Series(weights).groupby(np.asarray(keys), sort=False).sum()
+        chunk = SpaceSaving(self.capacity)
+        chunk.counts, chunk.errors = exact, pd.Series(0.0, index=exact.index)
+        chunk._truncate()
+        return self.merge(chunk)
+
+    def merge(self, other):
+        # A key missing from one summary may still have up to that summary's
+        # floor there; both floors are taken before the counts are replaced
+        own_floor, other_floor = self.floor, other.floor
+        keys = self.counts.index.union(other.counts.index)
+        self.counts = (self.counts.reindex(keys, fill_value=own_floor)
+                       + other.counts.reindex(keys, fill_value=other_floor))
+        self.errors = (self.errors.reindex(keys, fill_value=own_floor)
+                       + other.errors.reindex(keys, fill_value=other_floor))
+        self._truncate()
+        return self
+
+    def _truncate(self):
+        if len(self.counts) > self.capacity:
+            kept = self.counts.sort_values(ascending=False, kind='stable').index[:self.capacity]
+            self.counts, self.errors = self.counts[kept], self.errors[kept]
+
+    def top(self, n):
+        """The n heaviest keys with their estimated totals and error bounds."""
+        top = self.counts.sort_values(ascending=False, kind='stable').head(n)
+        return pd.DataFrame({'key': top.index, 'estimate': top.to_numpy(),
+                             'error': self.errors[top.index].to_numpy()})
+
+
+def approx_distinct(frame, key, column, p=6, chunk_rows=CHUNK_ROWS):
+    """Estimated number of distinct `column` values per `key`, one HyperLogLog per key.
+
+    p=6 keeps 64 bytes per key; counts up to a few dozen are in the near-exact
+    linear-counting range.
+    """
+    codes, keys = pd.factorize(frame[key], sort=True)
+    sketch = HyperLogLog(p, len(keys))
+    for rows in _chunks(len(frame), chunk_rows):
+        part = HyperLogLog(p, len(keys)).update(frame[column].iloc[rows], codes[rows])
+        sketch.merge(part)
+    return pd.Series(np.round(sketch.estimate()), index=pd.Index(keys, name=key), name=column)
+
+
+def quantile_sketch(values, k=200, chunk_rows=CHUNK_ROWS):
+    """KLL sketch of the values, built chunk by chunk and merged."""
+    values = np.asarray(values, dtype=float)
+    sketch = KLL(k)
+    for rows in _chunks(len(values), chunk_rows):
+        sketch.merge(KLL(k, seed=rows.start).update(values[rows]))
+    return sketch
+
+
+def approx_top(frame, key, weight, n, capacity=1000, chunk_rows=CHUNK_ROWS):
+    """Estimated top-n keys by total weight, from per-chunk Space-Saving summaries."""
+    sketch = SpaceSaving(capacity)
+    for rows in _chunks(len(frame), chunk_rows):
+        sketch.merge(SpaceSaving(capacity).update(frame[key].iloc[rows].to_numpy(),
+                                                  frame[weight].iloc[rows].to_numpy()))
+    return sketch.top(n).rename(columns={'key': key})
+
+
+def check_sketches(rows=200_000, capacity=200, chunk_rows=20_000, seed=0):
+    """Each sketch against the exact answer on a seeded skewed stream; returns the failed checks."""
+    rng = np.random.default_rng(seed)
+    keys = rng.zipf(1.3, rows) % 50_000
+    weights = rng.exponential(10.0, rows)
+    frame = pd.DataFrame({'key': keys, 'weight': weights, 'group': keys % 4})
+    failures = []
+
+    # SpaceSaving: per-chunk summaries merged, every bound against exact totals
+    exact = frame.groupby('key')['weight'].sum()
+    sketch = SpaceSaving(capacity)
+    for part in _chunks(rows, chunk_rows):
+        sketch.merge(SpaceSaving(capacity).update(keys[part], weights[part]))
+    bound = weights.sum() / capacity
+    truth = exact[sketch.counts.index]
+    if (sketch.counts < truth - 1e-6).any() or (sketch.counts - sketch.errors > truth + 1e-6).any():
+        failures.append('SpaceSaving: an exact total falls outside [estimate - error, estimate]')
+    if sketch.errors.max() > bound + 1e-6:
+        failures.append(f'SpaceSaving: error {sketch.errors.max():.1f} exceeds W / capacity = {bound:.1f}')
+    if not exact[exact > bound].index.isin(sketch.counts.index).all():
+        failures.append('SpaceSaving: a key heavier than W / capacity was dropped')
+
+    # A merged error is each side's error, or that side's floor where the key is missing
+    half = rows // 2
+    left = SpaceSaving(capacity).update(keys[:half], weights[:half])
+    right = SpaceSaving(capacity).update(keys[half:], weights[half:])
+    expected = (left.errors.reindex(exact.index, fill_value=left.floor)
+                + right.errors.reindex(exact.index, fill_value=right.floor))
+    merged = left.merge(right)
+    if not np.allclose(merged.errors, expected[merged.errors.index]):
+        failures.append('SpaceSaving: merged error bounds differ from the pre-merge floors and errors')
+
+    # KLL: rank error of the merged sketch at a few quantiles
+    kll = quantile_sketch(weights, chunk_rows=chunk_rows)
+    qs = np.array([0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99])
+    rank_error = np.abs(np.searchsorted(np.sort(weights), kll.quantiles(qs)) / rows - qs).max()
+    if rank_error > 0.02:
+        failures.append(f'KLL: rank error {rank_error:.4f} above 0.02')
+
+    # HyperLogLog: distinct keys per group, well within four standard errors
+    estimate = approx_distinct(frame, 'group', 'key', p=12, chunk_rows=chunk_rows)
+    relative = (estimate / frame.groupby('group')['key'].nunique() - 1).abs().max()
+    if relative > 4 * 1.04 / np.sqrt(2 ** 12):
+        failures.append(f'HyperLogLog: relative error {relative:.4f} above four standard errors')
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check_sketches()
+    for failure in failures:
+        print(failure)
+    print('Sketch checks failed' if failures else 'Sketch checks passed')
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Sparse counterpart of DataFrame.pivot_table(...).corr() for wide, mostly
+# empty pivots such as bundle x discount level, where each bundle is sold at
+# only a few of the levels. Cells are kept as sparse (value, presence)
+# matrices, and the pairwise-complete Pearson correlation of every pair of
+# columns is assembled from a handful of sparse matrix products over the rows
+# both columns have, instead of scanning dense, NaN-filled columns pair by pair.
+
+# Overlap variances this small relative to the overlap's sum of squares are
+# rounding noise from the one-pass formula; pandas sees an exact zero there
+_VARIANCE_RTOL = 1e-12
+
+
+class SparsePivot:
+    """Rows x (value, column level) cells of a pivot_table, with missing cells left out."""
+
+    def __init__(self, index, columns, data, present):
+        self.index = index
+        self.columns = columns
+        self.data = data
+        self.present = present
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def density(self):
+        return self.present.nnz / max(self.shape[0] * self.shape[1], 1)
+
+    def to_frame(self):
+        """The dense pivot_table() result (NaN for missing cells)."""
+        dense = np.full(self.shape, np.nan)
+        rows, cols = self.present.nonzero()
+        dense[rows, cols] = np.asarray(self.data[rows, cols]).ravel()
+        return pd.DataFrame(dense, index=self.index, columns=self.columns)
+
+    def corr(self, min_periods=1):
+        """Pairwise-complete Pearson correlation of the columns, as DataFrame.corr() computes it."""
+        X = self.data.tocsc(copy=True)
+        M = self.present.tocsc().astype(float)
+        counts = np.asarray(M.sum(axis=0)).ravel()
+        # Correlation is unchanged by shifting a column, and shifting each one
+        # by its mean keeps the sums below from cancelling catastrophically
+        means = np.asarray(X.sum(axis=0)).ravel() / np.maximum(counts, 1)
+        X.data -= np.repeat(means, np.diff(X.indptr))
+        X2 = X.multiply(X).tocsc()
+
+        n = (M.T @ M).toarray()
+        sx = (X.T @ M).toarray()         # sx[i, j]: sum of column i over rows where j is present
+        sxx = (X2.T @ M).toarray()
+        sxy = (X.T @ X).toarray()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sxy - sx * sx.T / n
+            var_x = sxx - sx ** 2 / n
+            var_y = var_x.T
+            var_x[var_x <= _VARIANCE_RTOL * sxx] = 0.0
+            var_y[var_y <= _VARIANCE_RTOL * sxx.T] = 0.0
+            result = cov / np.sqrt(var_x * var_y)
+        result[(n < max(min_periods, 1)) | (var_x == 0) | (var_y == 0)] = np.nan
+        result = np.clip(result, -1.0, 1.0)
+        return pd.DataFrame(result, index=self.columns, columns=self.columns)
+
+
+def sparse_pivot(frame, index, columns, values):
+    """Sparse equivalent of ``frame.pivot_table(index=index, columns=columns, values=values)``.
+
+    Duplicate (index, columns) pairs are averaged and missing or NaN cells
+    are left out; as in pivot_table, values are ordered by name and
+    columns with no cells are dropped.
+    """
+    values = sorted([values] if isinstance(values, str) else values)
+    row_codes, row_labels = pd.factorize(frame[index], sort=True)
+    level_codes, level_labels = pd.factorize(frame[columns], sort=True)
+    n_rows, n_levels = len(row_labels), len(level_labels)
+
+    blocks, presence, labels = [], [], []
+    for value in values:
+        v = frame[value].to_numpy(dtype=float)
+        keep = ~np.isnan(v) & (row_codes >= 0) & (level_codes >= 0)
+        shape = (n_rows, n_levels)
+        sums = sparse.coo_matrix((v[keep], (row_codes[keep], level_codes[keep])), shape=shape).tocsc()
+        counts = sparse.coo_matrix((np.ones(keep.sum()), (row_codes[keep], level_codes[keep])), shape=shape).tocsc()
+        # Same pattern for both, since every stored sum has a count behind it
+        sums.sum_duplicates()
+        counts.sum_duplicates()
+        used = np.flatnonzero(np.diff(counts.indptr))
+        means = sums.copy()
+        means.data = sums.data / counts.data
+        blocks.append(means[:, used])
+        presence.append((counts[:, used] > 0).astype(np.int8))
+        labels.extend((value, level_labels[i]) for i in used)
+
+    col_index = pd.MultiIndex.from_tuples(labels, names=[None, columns])
+    row_index = pd.Index(row_labels, name=index)
+    return SparsePivot(row_index, col_index, sparse.hstack(blocks, format='csc'),
+                       sparse.hstack(presence, format='csc'))
@@ -4,60 +4,63 @@ import matplotlib.pyplot as plt
 import numpy as np
 import os
 from datetime import datetime
+from typed_table import load_table
+from aggregate_cache import aggregate
+from partitions import aggregate_months, trends_range
+from figures import FigureSet
+from plot_summaries import histogram_summary, plot_histogram
 
 # Create reports directory if it doesn't exist
 if not os.path.exists('reports/figures/presentation'):
     os.makedirs('reports/figures/presentation')
 
 # Load the dataset
-df = pd.read_csv('../data/marketing_and_product_performance.csv')
+table = load_table()
+df = table.frame
+# Charts are rendered together at the end; unchanged ones are not redrawn
+figures = FigureSet()
+TIGHT = {'bbox_inches': 'tight'}
 
 # 1. Trend Plots
-plt.figure(figsize=(15, 6))
-
-# Create a synthetic date column since Campaign_ID doesn't contain dates
-np.random.seed(42)
-dates = pd.date_range(start='2023-01-01', periods=len(df), freq='D')
-df['Date'] = np.random.choice(dates, len(df))
-
-# Monthly trends
-df_monthly = df.groupby(pd.Grouper(key='Date', freq='M')).agg({
+# Monthly trends from the month partitions (synthetic dates, since
+# Campaign_ID doesn't contain dates), labelled by month end
+df_monthly = aggregate_months(table, 'Month', {
     'Revenue_Generated': 'sum',
     'Conversions': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean'
-}).reset_index()
+}, *trends_range())
+df_monthly['Date'] = df_monthly['Month'].dt.to_timestamp(how='end').dt.normalize()
 
 # Create subplots
-plt.figure(figsize=(15, 8))
-
-# Revenue Trend
-plt.subplot(3, 1, 1)
-sns.lineplot(data=df_monthly, x='Date', y='Revenue_Generated', color='green')
-plt.title('Monthly Revenue Trend')
-plt.xlabel('')
-plt.ylabel('Revenue ($)')
-
-# Conversion Trend
-plt.subplot(3, 1, 2)
-sns.lineplot(data=df_monthly, x='Date', y='Conversions', color='blue')
-plt.title('Monthly Conversions Trend')
-plt.xlabel('')
-plt.ylabel('Conversions')
-
-# Satisfaction Trend
-plt.subplot(3, 1, 3)
-sns.lineplot(data=df_monthly, x='Date', y='Customer_Satisfaction_Post_Refund', color='orange')
-plt.title('Monthly Customer Satisfaction Trend')
-plt.xlabel('Date')
-plt.ylabel('Satisfaction Score')
-
-plt.tight_layout()
-plt.savefig('reports/figures/presentation/trend_plots.png', dpi=300, bbox_inches='tight')
-plt.close()
+def plot_trends(data):
+    # Revenue Trend
+    plt.subplot(3, 1, 1)
+    sns.lineplot(data=data, x='Date', y='Revenue_Generated', color='green')
+    plt.title('Monthly Revenue Trend')
+    plt.xlabel('')
+    plt.ylabel('Revenue ($)')
+
+    # Conversion Trend
+    plt.subplot(3, 1, 2)
+    sns.lineplot(data=data, x='Date', y='Conversions', color='blue')
+    plt.title('Monthly Conversions Trend')
+    plt.xlabel('')
+    plt.ylabel('Conversions')
+
+    # Satisfaction Trend
+    plt.subplot(3, 1, 3)
+    sns.lineplot(data=data, x='Date', y='Customer_Satisfaction_Post_Refund', color='orange')
+    plt.title('Monthly Customer Satisfaction Trend')
+    plt.xlabel('Date')
+    plt.ylabel('Satisfaction Score')
+
+    plt.tight_layout()
+
+
+figures.add('reports/figures/presentation/trend_plots.png', plot_trends, df_monthly, figsize=(15, 8), savefig=TIGHT)
 
 # 2. Customer Map
 # Since we don't have actual geographical data, we'll create a synthetic map
-plt.figure(figsize=(12, 8))
 
 # Create synthetic customer locations (for demonstration)
 np.random.seed(42)
@@ -74,46 +77,52 @@ customer_locations = pd.DataFrame({
 # Aggregate customer counts per location
 customer_map = customer_locations.groupby(['Latitude', 'Longitude']).sum().reset_index()
 
-plt.scatter(customer_map['Longitude'], customer_map['Latitude'], 
-            s=customer_map['Customer_Count'] * 10, alpha=0.6, c='blue')
-plt.title('Customer Distribution Map')
-plt.xlabel('Longitude')
-plt.ylabel('Latitude')
-plt.savefig('reports/figures/presentation/customer_map.png', dpi=300, bbox_inches='tight')
-plt.close()
+def plot_customer_map(data):
+    plt.scatter(data['Longitude'], data['Latitude'],
+                s=data['Customer_Count'] * 10, alpha=0.6, c='blue')
+    plt.title('Customer Distribution Map')
+    plt.xlabel('Longitude')
+    plt.ylabel('Latitude')
+
+
+figures.add('reports/figures/presentation/customer_map.png', plot_customer_map, customer_map,
+            figsize=(12, 8), savefig=TIGHT)
 
 # 3. Segmentation Charts
 # Create segmentation data
-customer_metrics = df.groupby('Customer_ID').agg({
+customer_metrics = aggregate(table, 'Customer_ID', {
     'Revenue_Generated': 'sum',
     'Units_Sold': 'sum',
     'Customer_Satisfaction_Post_Refund': 'mean',
     'Subscription_Tier': 'first',
     'Subscription_Length': 'mean'
-}).reset_index()
+})
+
+# Create segmentation plot from tier shares and a fixed-bin satisfaction histogram
+def plot_segmentation(data):
+    # Subscription Tier Distribution
+    plt.subplot(1, 2, 1)
+    subscription_dist = data['tiers'].set_index('Subscription_Tier')['Share']
+    subscription_dist.plot(kind='pie', autopct='%.1f%%',
+                           colors=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4'])
+    plt.title('Subscription Tier Distribution')
+    plt.ylabel('')
+
+    # Satisfaction Score Distribution
+    plt.subplot(1, 2, 2)
+    plot_histogram(data['satisfaction'], bins=20, kde=True, color='#4ECDC4')
+    plt.title('Customer Satisfaction Distribution')
+    plt.xlabel('Satisfaction Score')
+    plt.ylabel('Number of Customers')
+
+    plt.tight_layout()
 
-# Create segmentation plot
-plt.figure(figsize=(15, 6))
 
-# Subscription Tier Distribution
-plt.subplot(1, 2, 1)
 subscription_dist = customer_metrics['Subscription_Tier'].value_counts(normalize=True) * 100
-subscription_dist.plot(kind='pie', autopct='%.1f%%',
-                       colors=['#FF6B6B', '#4ECDC4', '#45B7D1', '#96CEB4'])
-plt.title('Subscription Tier Distribution')
-plt.ylabel('')
-
-# Satisfaction Score Distribution
-plt.subplot(1, 2, 2)
-sns.histplot(data=customer_metrics, x='Customer_Satisfaction_Post_Refund', bins=20,
-             kde=True, color='#4ECDC4')
-plt.title('Customer Satisfaction Distribution')
-plt.xlabel('Satisfaction Score')
-plt.ylabel('Number of Customers')
-
-plt.tight_layout()
-plt.savefig('reports/figures/presentation/segmentation_charts.png', dpi=300, bbox_inches='tight')
-plt.close()
+figures.add('reports/figures/presentation/segmentation_charts.png', plot_segmentation, {
+    'tiers': subscription_dist.rename('Share').reset_index(),
+    'satisfaction': histogram_summary(customer_metrics['Customer_Satisfaction_Post_Refund'], 20),
+}, figsize=(15, 6), savefig=TIGHT)
 
 # 4. KPI Bar Graphs
 # Calculate KPIs
@@ -125,23 +134,24 @@ kpi_data = {
 
 kpi_df = pd.DataFrame(kpi_data)
 
-plt.figure(figsize=(15, 8))
+def plot_kpis(data):
+    # Create bar plot for KPIs
+    bars = plt.bar(data['KPI'], data['Value'], color='#4ECDC4', alpha=0.7)
+    plt.bar(data['KPI'], data['Target'], color='#FF6B6B', alpha=0.3)
+
+    # Add value labels
+    for bar in bars:
+        yval = bar.get_height()
+        plt.text(bar.get_x() + bar.get_width()/2, yval + 0.02, round(yval, 2),
+                 ha='center', va='bottom')
 
-# Create bar plot for KPIs
-bars = plt.bar(kpi_df['KPI'], kpi_df['Value'], color='#4ECDC4', alpha=0.7)
-plt.bar(kpi_df['KPI'], kpi_df['Target'], color='#FF6B6B', alpha=0.3)
+    plt.title('Key Performance Indicators')
+    plt.ylabel('Value')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
 
-# Add value labels
-for bar in bars:
-    yval = bar.get_height()
-    plt.text(bar.get_x() + bar.get_width()/2, yval + 0.02, round(yval, 2),
-             ha='center', va='bottom')
 
-plt.title('Key Performance Indicators')
-plt.ylabel('Value')
-plt.xticks(rotation=45)
-plt.tight_layout()
-plt.savefig('reports/figures/presentation/kpi_bars.png', dpi=300, bbox_inches='tight')
-plt.close()
+figures.add('reports/figures/presentation/kpi_bars.png', plot_kpis, kpi_df, figsize=(15, 8), savefig=TIGHT)
+figures.render()
 
 print("All visuals have been generated and saved to reports/figures/presentation/")
@@ -0,0 +1,299 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate_cache import compute_partials, finalize, merge_partials, normalize_spec, required_partials
+from data_loader import DATA_PATH, SCHEMA
+from exports import write_exports
+from metrics import evaluate
+from typed_table import SyntheticDates
+
+# Streaming mode for extracts larger than memory. The transaction file is read
+# in bounded chunks and every Power BI table is built from mergeable partial
+# aggregates (sums, counts, first-seen values and exact distinct sets), so
+# peak memory grows with the number of groups rather than the number of rows.
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CHUNKSIZE = 250_000
+
+CAMPAIGN_SPEC = {
+    'Revenue_Generated': 'sum',
+    'Budget': 'mean',
+    'Clicks': 'sum',
+    'Conversions': 'sum',
+    'Customer_Satisfaction_Post_Refund': 'mean'
+}
+CHANNEL_SPEC = {
+    'Revenue_Generated': 'sum',
+    'Budget': 'sum',
+    'Clicks': 'sum',
+    'Conversions': 'sum',
+    'Customer_Satisfaction_Post_Refund': 'mean'
+}
+BUNDLE_SPEC = {
+    'Revenue_Generated': 'sum',
+    'Units_Sold': 'sum',
+    'Customer_Satisfaction_Post_Refund': 'mean'
+}
+CUSTOMER_SPEC = {
+    'Revenue_Generated': 'sum',
+    'Units_Sold': 'sum',
+    'Customer_Satisfaction_Post_Refund': 'mean',
+    'Subscription_Tier': 'first',
+    'Subscription_Length': 'mean'
+}
+
+# Every grouping the Power BI exports need, built in one pass over the chunks
+ACCUMULATORS = {
+    'campaign': (['Campaign_ID', 'Common_Keywords'], CAMPAIGN_SPEC),
+    'channel': (['Common_Keywords'], CHANNEL_SPEC),
+    'bundle_discount': (['Bundle_ID', 'Discount_Level'], dict(BUNDLE_SPEC, Bundle_Price='mean')),
+    'bundle': (['Bundle_ID'], BUNDLE_SPEC),
+    'customer': (['Customer_ID'], CUSTOMER_SPEC),
+    'month_discount': (['Month', 'Discount_Level'], dict(BUNDLE_SPEC, Conversions='sum')),
+    'year_month': (['Year', 'Month'], {
+        'Revenue_Generated': 'sum',
+        'Conversions': 'sum',
+        'Clicks': 'sum',
+        'Customer_Satisfaction_Post_Refund': 'mean'
+    }),
+    'campaign_month': (['Campaign_ID', 'Month'], {
+        'Revenue_Generated': 'sum',
+        'Conversions': 'sum',
+        'Customer_Satisfaction_Post_Refund': 'mean'
+    }),
+}
+
+
+class StreamingAggregate:
+    """Mergeable partial aggregate for one grouping, fed chunk by chunk."""
+
+    def __init__(self, keys, spec):
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.spec = spec
+        self.spec_items = normalize_spec(spec)
+        partials = required_partials(self.spec_items)
+        self.partials = {p for p in partials if p[1] != 'nunique'}
+        self.distinct = {col: None for col, func in self.spec_items if func == 'nunique'}
+        self.state = None
+        self.pending = []
+
+    def update(self, chunk, row_offset):
+        part = compute_partials(chunk, self.keys, self.partials)
+        for name in part.columns:
+            if name.endswith('|first_row'):
+                part[name] += row_offset
+        self.pending.append(part)
+        for col, pairs in self.distinct.items():
+            chunk_pairs = chunk[self.keys + [col]].dropna().drop_duplicates()
+            merged = chunk_pairs if pairs is None else pd.concat([pairs, chunk_pairs], ignore_index=True)
+            self.distinct[col] = merged.drop_duplicates(ignore_index=True)
+        # Merge once the buffered partials outgrow the state, so merging stays
+        # amortized linear in the number of groups
+        buffered = sum(len(p) for p in self.pending)
+        if buffered >= max(len(self.state) if self.state is not None else 0, 50_000):
+            self._flush()
+
+    def _flush(self):
+        if self.pending:
+            frames = self.pending if self.state is None else [self.state] + self.pending
+            self.state = merge_partials(frames, self.keys)
+            self.pending = []
+
+    def result(self):
+        self._flush()
+        frame = self.state
+        for col, pairs in self.distinct.items():
+            counts = pairs.groupby(self.keys, observed=True)[col].nunique().rename(f'{col}|nunique')
+            frame = frame.merge(counts.reset_index(), on=self.keys, how='left')
+            frame[f'{col}|nunique'] = frame[f'{col}|nunique'].fillna(0).astype('int64')
+        multi = any(not isinstance(funcs, str) for funcs in self.spec.values())
+        return finalize(frame, self.keys, self.spec_items, multi)
+
+    def partial_frame(self):
+        self._flush()
+        return self.state
+
+    def first_rows(self):
+        return self.partial_frame()[self.keys + ['__group__|first_row']]
+
+
+def count_rows(path):
+    with open(path, 'rb') as f:
+        lines = sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b''))
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            lines += 1
+    return lines - 1
+
+
+def stream_aggregates(path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, accumulators=ACCUMULATORS):
+    aggregates = {name: StreamingAggregate(keys, spec) for name, (keys, spec) in accumulators.items()}
+    dates = SyntheticDates(count_rows(path))
+    offset = 0
+    for chunk in pd.read_csv(path, dtype=SCHEMA, chunksize=chunksize):
+        chunk = dates.add_to(chunk.reset_index(drop=True))
+        for aggregate in aggregates.values():
+            aggregate.update(chunk, offset)
+        offset += len(chunk)
+    return aggregates
+
+
+class Export:
+    """Power BI tables built from one accumulator's finalized groups.
+
+    ``build(frame, aggregates)`` returns {relative path: table}. Rows of each
+    table are keyed by the accumulator's keys and ordered by ``order`` (the
+    keys by default).
+    """
+
+    def __init__(self, source, build, order=None):
+        self.source = source
+        self.build = build
+        self.order = order or {}
+
+
+def _campaign_tables(frame, aggregates):
+    campaign = evaluate(frame, ['ROI', 'CPA', 'ROI_Category', 'CPA_Category'])
+    return {
+        'campaign_metrics.csv': campaign.drop(columns=['ROI_Category', 'CPA_Category']),
+        'campaigns/campaign_metrics.csv': campaign,
+    }
+
+
+def _channel_tables(frame, aggregates):
+    return {'campaigns/channel_efficiency.csv': evaluate(frame, ['CTR', 'CPC'])}
+
+
+def _bundle_tables(frame, aggregates):
+    bundle = evaluate(frame, ['Average_Revenue_per_Unit', 'Bundle_ROI', 'Bundle_ROI_Category'])
+    bundle = bundle.drop(columns=['Bundle_Price'])
+    return {
+        'bundle_metrics.csv': bundle[['Bundle_ID', 'Discount_Level'] + list(BUNDLE_SPEC) + ['Bundle_ROI']].rename(
+            columns={'Bundle_ROI': 'ROI'}),
+        'bundles/bundle_metrics.csv': bundle.rename(columns={
+            'Average_Revenue_per_Unit': 'Bundle_Price',
+            'Bundle_ROI': 'ROI',
+            'Bundle_ROI_Category': 'ROI_Category'
+        }),
+    }
+
+
+def _bundle_category_tables(frame, aggregates):
+    # Synthetic bundle categories cycle over bundles in order of first appearance
+    first_seen = aggregates['bundle'].first_rows().sort_values('__group__|first_row')
+    categories = ['Premium', 'Standard', 'Basic'] * (len(first_seen) // 3 + 1)
+    bundle_categories = dict(zip(first_seen['Bundle_ID'], categories[:len(first_seen)]))
+    bundle_totals = frame.copy()
+    bundle_totals.insert(0, 'Bundle_Category', bundle_totals['Bundle_ID'].map(bundle_categories))
+    return {'bundles/bundle_category_metrics.csv': bundle_totals}
+
+
+def _customer_tables(frame, aggregates):
+    return {'customer_metrics.csv': evaluate(frame, ['CLTV'])}
+
+
+def segment_customers(customer_metrics, fingerprint=None):
+    """Add the Segment and Segment_Label columns of the segmentation page."""
+    from segmentation import assign_segments, load_or_fit
+
+    return assign_segments(customer_metrics, load_or_fit(customer_metrics, k=4, fingerprint=fingerprint))
+
+
+def segmentation_frames(customer_metrics, churn_risk):
+    churn = customer_metrics[['Customer_ID', 'Segment', 'Segment_Label']].copy()
+    churn['Churn_Risk'] = churn_risk
+    return {
+        'segmentation/customer_metrics.csv': customer_metrics,
+        'segmentation/churn_risk.csv': churn,
+    }
+
+
+def _segmentation_tables(frame, aggregates):
+    customer_metrics = segment_customers(evaluate(frame, ['CLTV']))
+    np.random.seed(42)
+    return segmentation_frames(customer_metrics, np.random.choice([0, 1], size=len(customer_metrics), p=[0.85, 0.15]))
+
+
+def _month_discount_tables(frame, aggregates):
+    discount_analysis = frame[['Discount_Level', 'Month'] + list(BUNDLE_SPEC)].copy()
+    discount_analysis['Discount_Category'] = pd.cut(
+        discount_analysis['Discount_Level'],
+        bins=[0, 10, 20, 30, np.inf],
+        labels=['0-10%', '10-20%', '20-30%', '>30%']
+    )
+    return {
+        'monthly_trends.csv': frame[['Month', 'Discount_Level', 'Conversions', 'Revenue_Generated']],
+        'trends/discount_analysis.csv': discount_analysis,
+    }
+
+
+def _year_month_tables(frame, aggregates):
+    monthly_trends = frame.copy()
+    monthly_trends['Month_Name'] = monthly_trends['Month'].dt.strftime('%B')
+    return {'trends/monthly_trends.csv': monthly_trends}
+
+
+def _campaign_month_tables(frame, aggregates):
+    return {'trends/campaign_trends.csv': frame}
+
+
+# Needs every customer at once (a clustering fit), so appends update it
+# through OnlineSegments instead (see incremental.py)
+SEGMENTATION_EXPORT = Export('customer', _segmentation_tables)
+
+# Same tables, with the same columns and row order, as prepare_powerbi_data.py
+# and the prepare_*_page scripts
+EXPORTS = [
+    Export('campaign', _campaign_tables),
+    Export('channel', _channel_tables),
+    Export('bundle_discount', _bundle_tables),
+    Export('bundle', _bundle_category_tables,
+           order={'bundles/bundle_category_metrics.csv': ['Bundle_Category', 'Bundle_ID']}),
+    Export('customer', _customer_tables),
+    SEGMENTATION_EXPORT,
+    Export('month_discount', _month_discount_tables,
+           order={'trends/discount_analysis.csv': ['Discount_Level', 'Month']}),
+    Export('year_month', _year_month_tables),
+    Export('campaign_month', _campaign_month_tables),
+]
+
+
+def order_table(table, columns):
+    return table.sort_values(columns, kind='stable', ignore_index=True)
+
+
+def build_tables(aggregates, exports=EXPORTS):
+    results = {}
+    tables = {}
+    for export in exports:
+        if export.source not in results:
+            results[export.source] = aggregates[export.source].result()
+        for name, table in export.build(results[export.source], aggregates).items():
+            if name in export.order:
+                table = order_table(table, export.order[name])
+            tables[name] = table
+    return tables
+
+
+def write_tables(tables, output_dir):
+    """Write the tables through the export layer; only changed ones are rewritten."""
+    return write_exports({os.path.splitext(name)[0]: frame for name, frame in tables.items()}, output_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the Power BI tables from the transaction file in bounded-memory chunks.')
+    parser.add_argument('--source', default=DATA_PATH, help='transaction CSV to stream')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='rows per chunk')
+    parser.add_argument('--output-dir', default=os.path.join(ANALYSIS_DIR, 'reports', 'powerbi'))
+    args = parser.parse_args()
+
+    tables = build_tables(stream_aggregates(args.source, args.chunksize))
+    written = write_tables(tables, args.output_dir)
+    print(f"Streaming build wrote {len(written)} changed files for {len(tables)} tables to {args.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import dataset_fingerprint, load_dataset
+
+# Compact in-memory representation of the transaction table: ID columns are
+# interned into int32 codes with a reversible dictionary, low-cardinality
+# strings become categoricals and small integer columns are downcast.
+
+ID_COLUMNS = ['Campaign_ID', 'Product_ID', 'Customer_ID', 'Flash_Sale_ID', 'Bundle_ID']
+CATEGORY_COLUMNS = ['Subscription_Tier', 'Common_Keywords']
+SMALL_INT_COLUMNS = ['Clicks', 'Conversions', 'Subscription_Length', 'Discount_Level',
+                     'Units_Sold', 'Customer_Satisfaction_Post_Refund']
+
+
+class TypedTable:
+    def __init__(self, frame, dictionaries, fingerprint=None):
+        self.frame = frame
+        self.dictionaries = dictionaries
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_frame(cls, df, fingerprint=None):
+        frame = df.copy()
+        dictionaries = {}
+        for col in ID_COLUMNS:
+            # sort=True keeps code order equal to label order, so groupby output
+            # on codes comes back in the same order as on the strings
+            codes, uniques = pd.factorize(frame[col], sort=True)
+            frame[col] = codes.astype(np.int32)
+            dictionaries[col] = pd.Index(uniques, name=col)
+        for col in CATEGORY_COLUMNS:
+            frame[col] = frame[col].astype('category')
+        for col in SMALL_INT_COLUMNS:
+            frame[col] = pd.to_numeric(frame[col], downcast='integer')
+        return cls(frame, dictionaries, fingerprint)
+
+    def encode(self, column, labels):
+        """Map ID labels to their codes (-1 for unknown labels)."""
+        return self.dictionaries[column].get_indexer(labels).astype(np.int32)
+
+    def decode(self, df):
+        """Return a copy of df with any ID code columns replaced by their labels."""
+        out = df.copy()
+        for col, dictionary in self.dictionaries.items():
+            if col in out.columns and pd.api.types.is_integer_dtype(out[col]):
+                out[col] = dictionary.take(out[col].to_numpy())
+        return out
+
+    def labels(self, column, codes):
+        return self.dictionaries[column].take(np.asarray(codes)).tolist()
+
+    def memory_usage(self):
+        frame_bytes = self.frame.memory_usage(deep=True).sum()
+        dictionary_bytes = sum(d.memory_usage(deep=True) for d in self.dictionaries.values())
+        return frame_bytes + dictionary_bytes
+
+
+SYNTHETIC_START = '2023-01-01'
+
+
+def set_date_columns(df, dates):
+    df['Date'] = dates
+    df['Month'] = df['Date'].dt.to_period('M')
+    df['Year'] = df['Date'].dt.year
+    return df
+
+
+def add_synthetic_dates(df):
+    # Campaign_ID carries no date, so the trend tables use a seeded synthetic
+    # date; every script derives the same Date/Month/Year from the same seed
+    np.random.seed(42)
+    dates = pd.date_range(start=SYNTHETIC_START, periods=len(df), freq='D')
+    return set_date_columns(df, np.random.choice(dates, len(df)))
+
+
+class SyntheticDates:
+    """Chunk-by-chunk equivalent of add_synthetic_dates for a file of n_rows rows."""
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self.rng = np.random.RandomState(42)
+        self.start = pd.Timestamp(SYNTHETIC_START)
+
+    def add_to(self, chunk):
+        # np.random.choice(dates, n) draws randint(0, n, n); drawing the same
+        # stream chunk by chunk yields identical dates
+        offsets = self.rng.randint(0, self.n_rows, size=len(chunk))
+        dates = self.start + pd.to_timedelta(offsets, unit='D')
+        return set_date_columns(chunk, dates.to_numpy())
+
+
+# Set by the pipeline runner to a column store (see column_store.py) that its
+# worker processes attach to instead of loading the dataset themselves
+COLUMN_STORE_ENV = 'ANALYSIS_COLUMN_STORE'
+
+_resident = {'enabled': False, 'table': None}
+
+
+def keep_resident(enabled=True):
+    """Keep the loaded table in memory so later load_table() calls reuse it."""
+    _resident['enabled'] = enabled
+    if not enabled:
+        _resident['table'] = None
+
+
+def _load(fingerprint):
+    store = os.environ.get(COLUMN_STORE_ENV)
+    if store and os.path.exists(os.path.join(store, 'manifest.json')):
+        from column_store import attach
+        table = attach(store)
+        if table.fingerprint == fingerprint:
+            return table
+    return TypedTable.from_frame(load_dataset(), fingerprint)
+
+
+def load_table():
+    fingerprint = dataset_fingerprint()
+    if not _resident['enabled']:
+        return _load(fingerprint)
+
+    table = _resident['table']
+    if table is None or table.fingerprint != fingerprint:
+        table = _load(fingerprint)
+        _resident['table'] = table
+    # Scripts add derived columns to the frame, so hand out a shallow copy
+    return TypedTable(table.frame.copy(deep=False), table.dictionaries, fingerprint)
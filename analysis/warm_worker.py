@@ -0,0 +1,241 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+# Long-lived worker that keeps pandas, matplotlib, seaborn, scipy and sklearn
+# imported and the typed dataset resident, and runs pipeline stages on request
+# from a small CLI client over a Unix socket (or localhost TCP). The shared
+# library modules are imported once at start-up; if one of them is edited
+# afterwards the worker refuses to run stages until it is restarted, so it
+# never records a stage as fresh for code it did not run.
+
+ANALYSIS_DIR = os.path.dirname(os.path.abspath(__file__))
+# The same directory as data_loader.CACHE_DIR, spelled out so the client
+# commands start without importing pandas; the heavy modules load in serve()
+SOCKET_PATH = os.path.join(os.path.dirname(ANALYSIS_DIR), 'data', '.cache', 'warm_worker.sock')
+
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib.pyplot', 'seaborn', 'scipy.stats',
+                 'sklearn.cluster', 'sklearn.preprocessing', 'sklearn.metrics']
+
+
+def _warm_up():
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    os.chdir(ANALYSIS_DIR)
+    if ANALYSIS_DIR not in sys.path:
+        sys.path.insert(0, ANALYSIS_DIR)
+    for name in HEAVY_MODULES:
+        __import__(name)
+
+    import pipeline
+    # Stages run one at a time on the request threads, and forking a threaded
+    # process is unsafe, so their pools run inline
+    pipeline.stage_defaults(1)
+    # Hashed before importing, so an edit in between makes the worker refuse jobs
+    code = pipeline.module_hashes(_watched_modules())
+    for name in pipeline.LIBRARY_MODULES:
+        __import__(os.path.splitext(name)[0])
+
+    import typed_table
+    typed_table.keep_resident(True)
+    typed_table.load_table()
+    return code
+
+
+def _watched_modules():
+    import pipeline
+    return pipeline.LIBRARY_MODULES + ['pipeline.py']
+
+
+class WorkerState:
+    def __init__(self, code):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.runs = 0
+        # Hash of each library module as the worker imported it
+        self.code = code
+
+    def changed_modules(self):
+        import pipeline
+        current = pipeline.module_hashes(_watched_modules())
+        return sorted(name for name, digest in current.items() if self.code.get(name) != digest)
+
+
+def _restart_error(changed):
+    return {'ok': False, 'error': f"Library modules changed since the worker started ({', '.join(changed)}); "
+                                  "restart it with 'warm_worker.py stop' and 'warm_worker.py serve'"}
+
+
+def run_stages(worker, names, only_stale=False):
+    import matplotlib.pyplot as plt
+    import pipeline
+
+    by_name = {s.name: s for s in pipeline.STAGES}
+    unknown = [n for n in names if n not in by_name]
+    if unknown:
+        return {'ok': False, 'error': f"Unknown stage(s): {', '.join(unknown)}"}
+    changed = worker.changed_modules()
+    if changed:
+        return _restart_error(changed)
+
+    state = pipeline.load_state()
+    results = []
+    ok = True
+    for stage in [s for s in pipeline.STAGES if s.name in names]:
+        if only_stale and not pipeline.is_stale(stage, state):
+            results.append({'stage': stage.name, 'status': 'fresh'})
+            continue
+        # Taken before the run, from the code the worker is about to execute
+        stage_signature = pipeline.signature(stage)
+        buffer = io.StringIO()
+        start = time.time()
+        try:
+            with contextlib.redirect_stdout(buffer):
+                pipeline.run_script(stage.script)
+        except BaseException as exc:
+            plt.close('all')
+            ok = False
+            state.pop(stage.name, None)
+            results.append({'stage': stage.name, 'status': 'failed', 'error': repr(exc),
+                            'output': buffer.getvalue()})
+            continue
+        plt.close('all')
+        results.append({'stage': stage.name, 'status': 'done', 'seconds': round(time.time() - start, 3),
+                        'output': buffer.getvalue()})
+        changed = worker.changed_modules()
+        if changed:
+            # Edited while the stage ran: its outputs may not match either version
+            state.pop(stage.name, None)
+            pipeline.save_state(state)
+            return dict(_restart_error(changed), results=results)
+        state[stage.name] = stage_signature
+    pipeline.save_state(state)
+    return {'ok': ok, 'results': results}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+        except ValueError:
+            self._reply({'ok': False, 'error': 'invalid request'})
+            return
+
+        command = request.get('cmd')
+        worker = self.server.worker
+        if command == 'ping':
+            self._reply({'ok': True, 'pid': os.getpid(), 'uptime': round(time.time() - worker.started, 1),
+                         'runs': worker.runs, 'changed_modules': worker.changed_modules()})
+        elif command == 'run':
+            with worker.lock:
+                response = run_stages(worker, request.get('stages', []), request.get('only_stale', False))
+                worker.runs += 1
+            self._reply(response)
+        elif command == 'reload':
+            import typed_table
+            with worker.lock:
+                typed_table.keep_resident(False)
+                typed_table.keep_resident(True)
+                typed_table.load_table()
+            self._reply({'ok': True})
+        elif command == 'stop':
+            self._reply({'ok': True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        else:
+            self._reply({'ok': False, 'error': f'unknown command {command!r}'})
+
+    def _reply(self, payload):
+        self.wfile.write((json.dumps(payload) + '\n').encode())
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(socket_path=SOCKET_PATH, port=None):
+    code = _warm_up()
+    if port is not None:
+        server = TCPServer(('127.0.0.1', port), Handler)
+        address = f'127.0.0.1:{port}'
+    else:
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixServer(socket_path, Handler)
+        address = socket_path
+    server.worker = WorkerState(code)
+    print(f"Warm worker ready on {address}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if port is None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def request(payload, socket_path=SOCKET_PATH, port=None, timeout=None):
+    if port is not None:
+        conn = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    else:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(timeout)
+        conn.connect(socket_path)
+    with conn, conn.makefile('rwb') as stream:
+        stream.write((json.dumps(payload) + '\n').encode())
+        stream.flush()
+        return json.loads(stream.readline())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm analysis worker and its client.')
+    parser.add_argument('--socket', default=SOCKET_PATH, help='Unix socket path')
+    parser.add_argument('--port', type=int, default=None, help='use localhost TCP on this port instead of a Unix socket')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('serve', help='start the worker in the foreground')
+    run_parser = sub.add_parser('run', help='run stages in the worker')
+    run_parser.add_argument('stages', nargs='+')
+    run_parser.add_argument('--stale', action='store_true', help='skip stages that are up to date')
+    sub.add_parser('ping', help='check that the worker is up')
+    sub.add_parser('reload', help='drop and reload the resident dataset')
+    sub.add_parser('stop', help='shut the worker down')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.port)
+        return
+
+    payload = {'cmd': args.command}
+    if args.command == 'run':
+        payload.update(stages=args.stages, only_stale=args.stale)
+    try:
+        response = request(payload, args.socket, args.port)
+    except OSError as exc:
+        print(f"Warm worker not reachable: {exc}")
+        sys.exit(2)
+
+    if args.command == 'run':
+        for result in response.get('results', []):
+            sys.stdout.write(result.get('output', ''))
+            detail = f" ({result['seconds']}s)" if 'seconds' in result else ''
+            print(f"[{result['status']}] {result['stage']}{detail}" + (f": {result['error']}" if 'error' in result else ''))
+        if 'error' in response:
+            print(response['error'])
+    else:
+        print(json.dumps(response))
+    sys.exit(0 if response.get('ok') else 1)
+
+
+if __name__ == '__main__':
+    main()
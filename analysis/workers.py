@@ -0,0 +1,23 @@
+import os
+
+# Process budget shared by the pools the library modules start (figure
+# rendering, resampling, the k sweep). A pool uses its own variable if set,
+# else ANALYSIS_WORKERS, else every core. pipeline.py divides the cores among
+# its stage processes and sets ANALYSIS_WORKERS in each, and the warm worker
+# sets it to 1, so a pool started inside a stage never multiplies the
+# process count by the number of stages.
+
+WORKERS_ENV = 'ANALYSIS_WORKERS'
+
+
+def worker_budget(jobs=None, env=None):
+    """Processes a pool may start: jobs if given, else $env, else $ANALYSIS_WORKERS, else the CPU count."""
+    for value in (jobs, os.environ.get(env, '') if env else '', os.environ.get(WORKERS_ENV, '')):
+        if value:
+            return max(1, int(value))
+    return os.cpu_count() or 1
+
+
+def stage_budget(stage_jobs):
+    """ANALYSIS_WORKERS for each of stage_jobs concurrent stage processes: an equal share of the cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, stage_jobs))